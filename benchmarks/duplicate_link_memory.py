@@ -0,0 +1,132 @@
+"""
+Memory benchmark for the duplicate link index
+
+Compares the bytes used per tracked link by the old layout (one redis string per guild and
+full URL, holding a JSON string) against the hashed, bucketed index. Index records also
+snapshot the author, channel, and content of the message, so those are filled in with a
+short, typical message containing the link.
+
+By default the sizes are estimated from the bytes each layout stores plus Redis' approximate
+per-entry bookkeeping. Pass `--redis` to instead write both layouts to the Redis server at
+localhost and measure the change in its `used_memory`. This flushes the selected database,
+so point it at a scratch instance
+
+Usage: python -m benchmarks.duplicate_link_memory [--redis] [link count]
+"""
+from datetime import datetime, timezone
+import json
+import random
+import sys
+from types import SimpleNamespace
+
+import redis
+
+from embedGenerator import DuplicateLinkAlertGenerator
+
+# Approximate bytes Redis spends on bookkeeping for each top-level key with an expiry
+# (main dict entry, key object and header, and expires dict entry)
+KEY_OVERHEAD = 72
+# Approximate bytes Redis spends on bookkeeping for each field of a large hash
+FIELD_OVERHEAD = 32
+
+HOSTS = ["www.youtube.com", "twitter.com", "www.reddit.com", "en.wikipedia.org", "imgur.com",
+         "www.nytimes.com", "arstechnica.com", "github.com", "store.steampowered.com", "www.theverge.com"]
+
+GUILD_ID = 360523650912223253
+CHANNEL_ID = 360523651650682880
+AUTHOR_ID = 187086824588443648
+
+# What a typical message sharing a link looks like, for the snapshot in each sighting record
+AUTHOR_NAME = "Ray"
+CHANNEL_NAME = "general"
+CONTENT_WORDS = ["check", "this", "out", "lol", "new", "trailer", "is", "wild", "thoughts?"]
+
+
+def build_links(count: int, seed: int = 0) -> [str]:
+    """ Builds a list of unique, realistically long links """
+    rng = random.Random(seed)
+    links = []
+    for index in range(count):
+        path = "/".join(rng.choice(["news", "watch", "r", "comments", "wiki", "article", "2022", "status"])
+                        for _ in range(rng.randint(1, 4)))
+        slug = "_".join(rng.choice(["space", "launch", "cat", "rocket", "review", "update", "guide"])
+                        for _ in range(rng.randint(1, 6)))
+        links.append(f"https://{rng.choice(HOSTS)}/{path}/{slug}{index}")
+    return links
+
+
+def old_entry(link: str, message_id: int) -> (str, str):
+    """ The key and value the old layout stored for a link """
+    key = f"EG-DuplicateLinkAlertGenerator-DATA-{GUILD_ID}-{link}"
+    return key, json.dumps(f"{CHANNEL_ID}/{message_id}/{AUTHOR_ID}")
+
+
+def new_entry(link: str, message_id: int) -> (bytes, bytes):
+    """ The hash field and value the index stores for a link """
+    rng = random.Random(message_id)
+    words = " ".join(rng.choice(CONTENT_WORDS) for _ in range(rng.randint(0, 8)))
+    message = SimpleNamespace(id=message_id,
+                              channel=SimpleNamespace(id=CHANNEL_ID, name=CHANNEL_NAME),
+                              author=SimpleNamespace(id=AUTHOR_ID, name=AUTHOR_NAME),
+                              created_at=datetime.now(timezone.utc),
+                              content=f"{words} {link}".strip())
+    return (DuplicateLinkAlertGenerator.get_link_digest(link),
+            DuplicateLinkAlertGenerator.pack_sighting(message))
+
+
+def estimate(links: [str]) -> (float, float):
+    """ Estimates bytes per link for each layout from the stored bytes and Redis' bookkeeping """
+    old_total = sum(len(key.encode()) + len(value.encode()) + KEY_OVERHEAD
+                    for key, value in (old_entry(link, index) for index, link in enumerate(links)))
+    new_total = sum(len(field) + len(value) + FIELD_OVERHEAD
+                    for field, value in (new_entry(link, index) for index, link in enumerate(links)))
+    # The index also has one key per bucket, but that is shared by every link in it
+    new_total += KEY_OVERHEAD + len(f"EG-DuplicateLinkAlertGenerator-DATA-INDEX-{GUILD_ID}-19000")
+    return old_total / len(links), new_total / len(links)
+
+
+def measure(links: [str]) -> (float, float):
+    """ Measures bytes per link for each layout on a real Redis server """
+    client = redis.StrictRedis(host="localhost")
+    client.flushdb()
+
+    start = client.info("memory")["used_memory"]
+    pipe = client.pipeline(transaction=False)
+    for index, link in enumerate(links):
+        key, value = old_entry(link, index)
+        pipe.set(key, value, ex=DuplicateLinkAlertGenerator.DUPLICATE_LINK_EXPIRY_SECONDS)
+    pipe.execute()
+    old_bytes = client.info("memory")["used_memory"] - start
+    client.flushdb()
+
+    start = client.info("memory")["used_memory"]
+    bucket_key = f"EG-DuplicateLinkAlertGenerator-DATA-INDEX-{GUILD_ID}-19000"
+    pipe = client.pipeline(transaction=False)
+    for index, link in enumerate(links):
+        field, value = new_entry(link, index)
+        pipe.hsetnx(bucket_key, field, value)
+    pipe.expire(bucket_key, DuplicateLinkAlertGenerator.DUPLICATE_LINK_EXPIRY_SECONDS)
+    pipe.execute()
+    new_bytes = client.info("memory")["used_memory"] - start
+    client.flushdb()
+    return old_bytes / len(links), new_bytes / len(links)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    count = int(args[0]) if args else 100000
+    links = build_links(count)
+    if "--redis" in sys.argv:
+        old, new = measure(links)
+        method = "measured with used_memory"
+    else:
+        old, new = estimate(links)
+        method = "estimated"
+    print(f"Links:       {count:,} ({method})")
+    print(f"Old layout:  {old:6.1f} bytes/link")
+    print(f"New index:   {new:6.1f} bytes/link")
+    print(f"Reduction:   {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
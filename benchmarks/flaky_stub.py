@@ -0,0 +1,143 @@
+"""
+Resilience benchmark against a flaky web API
+
+Sends a steady stream of GET requests through `utils.get_json_with_get` to a local stub which
+fails some requests with 503 while it's healthy, then stops answering for a while (so requests
+time out), then recovers. The stream is run twice: once without retries or circuit breakers,
+and once with them, and the success rate, latency, and load on the stub are compared.
+
+Retries should turn most of the occasional 503s into successes, and the breaker should turn
+the outage's timeouts into immediate failures, and spare the stub the requests, until a probe
+finds that it has recovered. `check` asserts this of the run with the policy
+
+Usage: python -m benchmarks.flaky_stub [requests per second]
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+from aiohttp import web
+
+import circuitbreaker
+import utils
+
+HEALTHY_ERROR_RATE = 0.15  # Fraction of requests answered with 503 while the stub is up
+PHASES = [(1.5, "healthy"), (2.0, "outage"), (2.0, "recovered")]  # (seconds, state)
+REQUEST_TIMEOUT = 0.5
+OUTAGE_HANG = 5  # How long the stub leaves requests hanging during an outage
+BREAKER_RESET_SECONDS = 0.5
+
+
+class FlakyStub:
+    """ A web server whose health follows `PHASES` from when it's started """
+
+    def __init__(self, seed: int = 0):
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.started = 0.0
+        self.runner = None
+        self.port = None
+
+    def state(self) -> str:
+        elapsed = time.monotonic() - self.started
+        for duration, state in PHASES:
+            if elapsed < duration:
+                return state
+            elapsed -= duration
+        return PHASES[-1][1]
+
+    async def handle(self, _):
+        self.requests += 1
+        if self.state() == "outage":
+            await asyncio.sleep(OUTAGE_HANG)
+        if self.rng.random() < HEALTHY_ERROR_RATE:
+            return web.Response(status=503, text="Service Unavailable")
+        return web.json_response({"data": {"title": "A post", "score": 1234}})
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/{path:.*}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        self.started = time.monotonic()
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+async def timed_request(url: str, phase: str, results: list) -> None:
+    start = time.perf_counter()
+    try:
+        _, status = await utils.get_json_with_get(url, use_cache=False)
+    except Exception:
+        status = None
+    results.append((phase, status, time.perf_counter() - start))
+
+
+async def run_stream(rate: int, retries: int, breakers: circuitbreaker.CircuitBreakers) -> dict:
+    """ Sends `rate` requests per second for the length of `PHASES` and reports how they went """
+    utils.HTTP_GET_RETRIES = retries
+    circuitbreaker.BREAKERS = breakers
+    stub = FlakyStub()
+    await stub.start()
+    utils.OUTBOUND.host_limits["127.0.0.1"] = (rate * 10, rate * 10)
+    utils.HTTP_HOST_SETTINGS["127.0.0.1"] = {"timeout": REQUEST_TIMEOUT}
+
+    results = []
+    tasks = []
+    count = int(rate * sum(duration for duration, _ in PHASES))
+    for index in range(count):
+        url = f"http://127.0.0.1:{stub.port}/item/{index}.json"
+        tasks.append(asyncio.ensure_future(timed_request(url, stub.state(), results)))
+        await asyncio.sleep(1 / rate)
+    await asyncio.gather(*tasks)
+
+    await stub.stop()
+    await utils.close_http_session()
+    phases = {}
+    for _, phase in PHASES:
+        outcomes = [(status, latency) for state, status, latency in results if state == phase]
+        phases[phase] = (sum(status == 200 for status, _ in outcomes) / len(outcomes),
+                         statistics.mean(latency for _, latency in outcomes))
+    return {"requests": count,
+            "phases": phases,
+            "stub_requests": stub.requests,
+            "rejected": sum(breaker.rejected for breaker in breakers),
+            "opened": sum(breaker.times_opened for breaker in breakers),
+            "states": [breaker.state for breaker in breakers]}
+
+
+def check(result: dict) -> None:
+    """ Checks that the breaker opened during the outage, refused requests, and closed again after a probe """
+    assert result["opened"] >= 1, "The breaker never opened"
+    assert result["rejected"] > 0, "The breaker never refused a request"
+    assert result["states"] == [circuitbreaker.CLOSED], f"The breaker ended {result['states']}"
+    outage, recovered = result["phases"]["outage"], result["phases"]["recovered"]
+    assert recovered[0] > outage[0], "Requests didn't succeed again after the outage"
+
+
+def describe(name: str, result: dict) -> str:
+    phases = "".join(f" {success:>8.1%} {mean * 1000:>6.0f}ms" for success, mean in result["phases"].values())
+    return f"{name:<16}{phases} {result['stub_requests']:>13,} {result['rejected']:>8,} {result['opened']:>7,}"
+
+
+def main():
+    rate = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    without = asyncio.run(run_stream(rate, 0, circuitbreaker.CircuitBreakers(float("inf"), 0)))
+    with_policy = asyncio.run(run_stream(rate, 2, circuitbreaker.CircuitBreakers(5, BREAKER_RESET_SECONDS)))
+    print(f"Requests: {without['requests']:,} at {rate}/s; phases: "
+          + ", ".join(f"{state} {duration}s" for duration, state in PHASES))
+    print(f"{'':<16}" + "".join(f" {state.capitalize() + ': success, mean':>24}" for _, state in PHASES)
+          + f" {'Stub requests':>13} {'Refused':>8} {'Opened':>7}")
+    print(describe("Without policy", without))
+    print(describe("With policy", with_policy))
+    check(with_policy)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Micro-benchmark for per-message generator dispatch
+
+Measures how long it takes to decide which generators run on a message and find their
+triggers, as the number of generators grows. Most generators in a large deployment are
+limited to a few servers, so three in four of the synthetic generators here are
+whitelisted to servers other than the ones the messages come from.
+
+"Before" scans every generator's triggers and starts a task for each one that matched,
+which then checks its own server and channel lists. "After" looks up the channel's cached
+route and only scans, and starts tasks for, the generators active there. Task counts are
+reported alongside the timings, since each task costs far more than the scan itself
+
+Usage: python -m benchmarks.generator_dispatch [message count]
+"""
+import random
+import re
+import sys
+
+from benchmarks.trigger_scan import build_corpus, measure
+from embedGenerator import BaseGenerator
+from embedGenerator.routingTable import RoutingTable
+from embedGenerator.triggerScanner import TriggerScanner
+
+GENERATOR_COUNTS = [5, 10, 25, 50, 100]
+CHANNELS = [(guild, guild * 100 + channel) for guild in range(1, 5) for channel in range(5)]
+
+
+def build_generators(count: int, seed: int = 0) -> list:
+    """ Builds synthetic generator classes, each matching links to its own site """
+    rng = random.Random(seed)
+    generators = []
+    for index in range(count):
+        restricted = rng.random() < 0.75
+        generators.append(type(f"Generator{index}", (), {
+            "TRIGGER_PATTERN": re.compile(rf"https://site{index}\.example/(\w+)"),
+            "TRIGGER_HINTS": (f"site{index}.example/",),
+            "SERVER_BLACKLIST": [],
+            "CHANNEL_BLACKLIST": [],
+            "SERVER_WHITELIST": [1000 + index] if restricted else [],
+            "CHANNEL_WHITELIST": [],
+            "source_allowed": classmethod(BaseGenerator.source_allowed.__func__),
+        }))
+    return generators
+
+
+def build_messages(count: int, generator_count: int, seed: int = 0) -> list:
+    """ Builds (guild ID, channel ID, content) messages, where some link to the synthetic sites """
+    rng = random.Random(seed)
+    messages = []
+    for content in build_corpus(count, seed):
+        if rng.random() < 0.05:
+            content = f"{content} https://site{rng.randrange(generator_count)}.example/post{rng.randrange(1000)}"
+        messages.append((*rng.choice(CHANNELS), content))
+    return messages
+
+
+def dispatch_before(scanner: TriggerScanner):
+    """ The old approach: scan for every generator, then each matching generator checks its lists """
+    def run(messages: list) -> int:
+        tasks = 0
+        for guild_id, channel_id, content in messages:
+            for generator in scanner.scan(content):
+                tasks += 1
+                generator.source_allowed(guild_id, channel_id)
+        return tasks
+    return run
+
+
+def dispatch_after(scanner: TriggerScanner, routing_table: RoutingTable):
+    """ The new approach: look up the channel's route and only scan the generators on it """
+    def run(messages: list) -> int:
+        tasks = 0
+        for guild_id, channel_id, content in messages:
+            tasks += len(scanner.scan(content, routing_table.generators_for(guild_id, channel_id)))
+        return tasks
+    return run
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print(f"Messages: {count:,} across {len(CHANNELS)} channels")
+    print(f"{'Generators':>10}  {'Before (us/msg)':>15}  {'After (us/msg)':>14}  {'Speedup':>7}  "
+          f"{'Tasks before':>12}  {'Tasks after':>11}")
+    for generator_count in GENERATOR_COUNTS:
+        scanner = TriggerScanner()
+        routing_table = RoutingTable()
+        for generator in build_generators(generator_count):
+            scanner.register(generator, generator.TRIGGER_PATTERN, generator.TRIGGER_HINTS)
+            routing_table.register(generator)
+        messages = build_messages(count, generator_count)
+
+        before, before_tasks = measure(dispatch_before(scanner), messages)
+        after, after_tasks = measure(dispatch_after(scanner, routing_table), messages)
+        print(f"{generator_count:>10}  {1e6 / before:>15.2f}  {1e6 / after:>14.2f}  {after / before:>6.1f}x  "
+              f"{before_tasks:>12,}  {after_tasks:>11,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Latency benchmark for outbound web requests
+
+Compares opening a new aiohttp ClientSession for every request, which is how the web
+functions in utils used to work, against the shared, pooled session. Requests go to a local
+aiohttp server by host name, so the new-session path pays for a DNS lookup and a TCP
+handshake on every request, while the pooled session reuses its connections and cached
+lookups. Real hosts are further away and use TLS, so the gap in production is larger
+
+Usage: python -m benchmarks.http_session [request count]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+import utils
+
+HOST = "localhost"
+
+
+async def start_server() -> (web.AppRunner, int):
+    """ Starts a local server which answers every request with a small JSON document """
+    async def handle(_):
+        return web.json_response({"data": {"children": [{"data": {"title": "A post", "score": 1234}}]}})
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+async def request_with_new_session(url: str) -> None:
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as resp:
+            await resp.json()
+
+
+async def request_with_shared_session(url: str) -> None:
+    async with utils.http_request("GET", url) as resp:
+        await resp.json()
+
+
+async def measure(request, url: str, count: int) -> [float]:
+    """ Times a number of sequential requests, in milliseconds """
+    latencies = []
+    for index in range(count):
+        start = time.perf_counter()
+        await request(f"{url}/{index}.json")
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies)
+
+
+def describe(latencies: [float]) -> str:
+    p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+    return f"mean {statistics.mean(latencies):6.2f}ms, p50 {statistics.median(latencies):6.2f}ms, p99 {p99:6.2f}ms"
+
+
+async def run(count: int) -> None:
+    runner, port = await start_server()
+    url = f"http://{HOST}:{port}/r/test"
+    await utils.open_http_session()
+
+    before = await measure(request_with_new_session, url, count)
+    after = await measure(request_with_shared_session, url, count)
+
+    await utils.close_http_session()
+    await runner.cleanup()
+    print(f"Requests:        {count:,} to {HOST}")
+    print(f"New session:     {describe(before)}")
+    print(f"Shared session:  {describe(after)}")
+    print(f"Speedup:         {statistics.mean(before) / statistics.mean(after):.1f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    asyncio.run(run(count))
+
+
+if __name__ == "__main__":
+    main()
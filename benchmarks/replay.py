@@ -0,0 +1,395 @@
+"""
+Offline replay benchmark for the embed generator pipeline
+
+Replays a corpus of recorded messages through `embedGenerator.process_message` exactly as
+`on_message` feeds it, with no Discord connection and no network:
+    - Messages, channels, guilds, and the bot are fakes which record every Discord API call
+      they would have made
+    - Redis is replaced by the in-process stand-in
+    - Reddit and Twitter requests are redirected to a local HTTP stub serving canned JSON,
+      which answers after a configurable delay to stand in for network latency. The stub is
+      a single host, so the outbound rate limiter is opened up for it and doesn't pace requests
+
+The corpus is a JSONL file with one message per line:
+    {"guild_id": 1, "channel_id": 2, "author_id": 3, "author_name": "ray", "content": "..."}
+`guild_id` may be null for DMs. Without a corpus, a synthetic one shaped like real chat is used,
+and `--write-corpus PATH` saves it for later runs.
+
+Reports messages per second, p50/p99 per-message latency (from dispatch until every generator
+task for the message has finished), and the API calls issued
+
+Usage: python -m benchmarks.replay [corpus.jsonl] [--messages N] [--concurrency N]
+                                   [--stub-latency MS] [--write-corpus PATH] [--verbose]
+"""
+import argparse
+import asyncio
+import contextlib
+from datetime import datetime, timezone
+import io
+import json
+import random
+import re
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from aiohttp import web
+from discord import NotFound
+
+import redisconnection
+redisconnection.use_memory_store()
+
+import embedGenerator  # noqa: E402 (the memory store must be in place before generators use redis)
+import ratelimit  # noqa: E402
+import utils  # noqa: E402
+from benchmarks.trigger_scan import WORDS  # noqa: E402
+from messagecache import MESSAGE_CACHE  # noqa: E402
+
+STUB_HOST = "127.0.0.1"
+
+# Counts every call that would have gone to the Discord API or a web API
+API_CALLS = Counter()
+
+FIRST_SNOWFLAKE = 900000000000000000  # 18 digits, the length the Discord jump link pattern expects
+GUILD_IDS = [FIRST_SNOWFLAKE - 1000 - index for index in range(3)]
+SUBREDDITS = ["spacex", "kerbalspaceprogram", "aww", "python", "space", "nasa", "rocketry", "askscience"]
+
+
+# ------------------------------------------------------------------------ Fake Discord objects
+
+
+class FakeHTTP:
+    """ Stands in for the bot's HTTP client, which `utils.reply_with_embeds` posts through """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def request(self, route, json=None):
+        API_CALLS["discord"] += 1
+        return {"id": self.channel.next_id(), "content": "", "embeds": json.get("embeds", [])}
+
+
+class FakeState:
+    """ The parts of discord.py's connection state that the pipeline uses """
+
+    allowed_mentions = None
+
+    def __init__(self, channel):
+        self.http = FakeHTTP(channel)
+
+    def create_message(self, channel, data):
+        return FakeMessage(data["id"], channel, channel.bot_user, "")
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, bot_user):
+        self.id = guild_id
+        self.name = f"Guild {guild_id}"
+        self.me = bot_user
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+        self.avatar_url = ""
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, guild, bot_user, replay):
+        self.id = channel_id
+        self.name = f"channel-{channel_id % 1000}"
+        self.guild = guild
+        self.bot_user = bot_user
+        self.replay = replay
+
+    def next_id(self) -> int:
+        return self.replay.next_id()
+
+    async def send(self, content=None, embed=None):
+        API_CALLS["discord"] += 1
+        return FakeMessage(self.next_id(), self, self.bot_user, content or "")
+
+    async def fetch_message(self, message_id: int):
+        API_CALLS["discord"] += 1
+        message = self.replay.messages.get(message_id)
+        if message is None:
+            raise NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+        return message
+
+    def get_partial_message(self, message_id: int):
+        return FakeMessage(message_id, self, self.bot_user, "")
+
+    def permissions_for(self, _):
+        return SimpleNamespace(manage_messages=True)
+
+    async def delete_messages(self, _):
+        API_CALLS["discord"] += 1
+
+
+class FakeMessage:
+    def __init__(self, message_id: int, channel, author, content: str):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.created_at = datetime.now(timezone.utc)
+        self.edited_at = None
+        self.embeds = []
+        self.attachments = []
+        self.reactions = []
+        self.mentions = []
+        self._state = FakeState(channel)
+
+    async def reply(self, content=None, embed=None):
+        API_CALLS["discord"] += 1
+        return FakeMessage(self.channel.next_id(), self.channel, self.channel.bot_user, content or "")
+
+    async def add_reaction(self, _):
+        API_CALLS["discord"] += 1
+
+    async def delete(self):
+        API_CALLS["discord"] += 1
+
+    def to_message_reference_dict(self) -> dict:
+        return {"message_id": self.id, "channel_id": self.channel.id}
+
+
+class FakeBot:
+    """ Stands in for the bot, so lookups, flags, and reports stay in process """
+
+    def __init__(self, replay):
+        self.user = FakeUser(FIRST_SNOWFLAKE - 1, "SuitsBot", bot=True)
+        self.replay = replay
+        alerts = FakeChannel(FIRST_SNOWFLAKE - 2, None, self.user, replay)
+        self.ALERT_CHANNEL = self.ERROR_CHANNEL = alerts
+
+    def get_channel(self, channel_id: int):
+        return self.replay.channels.get(channel_id)
+
+    def get_guild(self, guild_id: int):
+        return self.replay.guilds.get(guild_id)
+
+
+class Replay:
+    """ Builds fake Discord objects for the messages in a corpus """
+
+    def __init__(self):
+        self.bot = FakeBot(self)
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+        self.messages = {}
+        self._next_id = FIRST_SNOWFLAKE
+
+    def next_id(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def build_message(self, record: dict) -> FakeMessage:
+        """ Builds a message from a corpus record, creating its guild, channel, and author on first use """
+        guild = None
+        if record.get("guild_id") is not None:
+            guild = self.guilds.setdefault(record["guild_id"], FakeGuild(record["guild_id"], self.bot.user))
+        channel = self.channels.get(record["channel_id"])
+        if channel is None:
+            channel = self.channels[record["channel_id"]] = FakeChannel(record["channel_id"], guild, self.bot.user, self)
+        author = self.users.setdefault(record["author_id"],
+                                       FakeUser(record["author_id"], record.get("author_name", "user")))
+        message = FakeMessage(self.next_id(), channel, author, record["content"])
+        self.messages[message.id] = message
+        return message
+
+
+# ------------------------------------------------------------------------ Web API stub
+
+
+def canned_response(host: str, path: str, query) -> object:
+    """ Builds the JSON a web API would return for a request, shaped like the real thing """
+    rng = random.Random(f"{host}{path}{sorted(query.items())}")
+    if host == "api.twitter.com":
+        tweet_id = int(query["id"])
+        is_reply = tweet_id % 2 == 1
+        return {"id": tweet_id,
+                "in_reply_to_status_id_str": str(tweet_id - 1) if is_reply else None,
+                "is_quote_status": False,
+                "full_text": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))),
+                "retweet_count": rng.randint(0, 5000),
+                "favorite_count": rng.randint(0, 50000),
+                "user": {"name": "Space Fan", "screen_name": "spacefan",
+                         "profile_image_url_https": "https://pbs.twimg.com/profile.png"}}
+
+    subreddit = re.match(r"/r/(\w+)/about\.json", path)
+    if subreddit:
+        return {"data": {"display_name": subreddit.group(1), "url": f"/r/{subreddit.group(1)}/",
+                         "subscribers": rng.randint(1000, 5000000), "created": 1200000000,
+                         "over18": False, "quarantine": False, "icon_img": "",
+                         "banner_img": "", "public_description": "A community for things"}}
+
+    post = {"title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))),
+            "author": "redditor", "subreddit_name_prefixed": "r/spacex", "is_self": True,
+            "hide_score": False, "score": rng.randint(1, 20000), "upvote_ratio": 0.97,
+            "num_comments": rng.randint(0, 2000), "over_18": False, "spoiler": False,
+            "created_utc": 1650000000, "thumbnail": "self", "gildings": {},
+            "selftext": " ".join(rng.choice(WORDS) for _ in range(rng.randint(10, 200)))}
+    comment = {"body": " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 80))),
+               "author": "commenter", "score": rng.randint(1, 3000),
+               "created_utc": 1650000100, "gildings": {}}
+    return [{"data": {"children": [{"data": post}]}}, {"data": {"children": [{"data": comment}]}}]
+
+
+async def start_stub(latency: float) -> (web.AppRunner, int):
+    """ Starts the web API stub on a free local port """
+    async def handle(request):
+        host = request.match_info["host"]
+        API_CALLS[host] += 1
+        await asyncio.sleep(latency)
+        return web.json_response(canned_response(host, "/" + request.match_info["path"], request.query))
+
+    app = web.Application()
+    app.router.add_get("/{host}/{path:.*}", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, STUB_HOST, 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+def redirect_web_requests(port: int) -> None:
+    """ Sends every JSON request the generators make to the stub instead of the real host """
+    original = utils.get_json_with_get
+
+    async def get_json_with_get(url, *args, **kwargs):
+        url = re.sub(r"^https?://", f"http://{STUB_HOST}:{port}/", url)
+        return await original(url, *args, **kwargs)
+    utils.get_json_with_get = get_json_with_get
+    ratelimit.OUTBOUND.host_limits[STUB_HOST] = (float("inf"), 1000000)
+
+
+# ------------------------------------------------------------------------ Corpus
+
+
+def build_corpus(count: int, seed: int = 0) -> [dict]:
+    """
+    Builds a synthetic corpus. Most messages are short chat with no triggers, and the links
+    that do appear are drawn from small pools, so caches and duplicate detection get exercised
+    """
+    rng = random.Random(seed)
+    channels = [(guild_id, guild_id + 100 + index) for guild_id in GUILD_IDS for index in range(4)]
+    def reddit_id(length: int) -> str:
+        return "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for _ in range(length))
+    posts = [f"https://www.reddit.com/r/{rng.choice(SUBREDDITS)}/comments/{reddit_id(6)}/"
+             f"{'_'.join(rng.choice(WORDS) for _ in range(3))}/" for _ in range(40)]
+    posts += [f"{post}{reddit_id(7)}/" for post in posts[:20]]  # Links to comments
+    tweets = [f"https://twitter.com/spacefan/status/{1500000000000000000 + rng.randrange(10 ** 9)}"
+              for _ in range(40)]
+    corpus = []
+    for index in range(count):
+        guild_id, channel_id = rng.choice(channels)
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 15)))
+        roll = rng.random()
+        if roll < 0.03:
+            text = f"{text} {rng.choice(posts)}"
+        elif roll < 0.05:
+            text = f"{text} {rng.choice(tweets)}"
+        elif roll < 0.06:
+            text = f"check out r/{rng.choice(SUBREDDITS)} {text}"
+        elif roll < 0.07 and index:
+            # A jump link to an earlier message, whose ID is known since IDs are handed out in order
+            target = rng.randrange(index)
+            text = f"{text} https://discord.com/channels/{corpus[target]['guild_id']}/" \
+                   f"{corpus[target]['channel_id']}/{FIRST_SNOWFLAKE + target + 1}"
+        elif roll < 0.09:
+            text = f"{text} https://example.com/{rng.choice(WORDS)}/{rng.randrange(200)}"
+        author_id = FIRST_SNOWFLAKE - 100 - rng.randrange(50)
+        corpus.append({"guild_id": guild_id, "channel_id": channel_id,
+                       "author_id": author_id, "author_name": f"user{author_id % 100}", "content": text})
+    return corpus
+
+
+def load_corpus(path: str) -> [dict]:
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+# ------------------------------------------------------------------------ Replay
+
+
+async def replay_message(message, latencies: [float]) -> None:
+    """ Feeds a message through the pipeline the way on_message does, and times it to completion """
+    start = time.perf_counter()
+    MESSAGE_CACHE.put(message)
+    embedGenerator.RECENT_LINKS.record(message)
+    before = set(embedGenerator._GENERATOR_TASKS)
+    await embedGenerator.process_message(message)
+    tasks = embedGenerator._GENERATOR_TASKS - before
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    latencies.append(time.perf_counter() - start)
+
+
+async def run_replay(corpus: [dict], concurrency: int, stub_latency: float) -> dict:
+    replay = Replay()
+    utils._bot = replay.bot
+    runner, port = await start_stub(stub_latency)
+    redirect_web_requests(port)
+
+    # Build every message first, so jump links can find messages later in the corpus
+    messages = [replay.build_message(record) for record in corpus]
+    latencies = []
+    in_flight = set()
+    start = time.perf_counter()
+    for message in messages:
+        if len(in_flight) >= concurrency:
+            _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        in_flight.add(asyncio.ensure_future(replay_message(message, latencies)))
+    if in_flight:
+        await asyncio.wait(in_flight)
+    elapsed = time.perf_counter() - start
+
+    await utils.close_http_session()
+    await runner.cleanup()
+    return {"elapsed": elapsed, "latencies": sorted(latencies)}
+
+
+def percentile(values: [float], quantile: float) -> float:
+    return values[min(len(values) - 1, int(quantile * len(values)))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded messages through the embed generator pipeline")
+    parser.add_argument("corpus", nargs="?", help="JSONL corpus of messages. A synthetic one is used if omitted")
+    parser.add_argument("--messages", type=int, default=5000, help="Size of the synthetic corpus")
+    parser.add_argument("--concurrency", type=int, default=32, help="Messages in flight at once")
+    parser.add_argument("--stub-latency", type=float, default=20, help="Web API stub response time, in ms")
+    parser.add_argument("--write-corpus", help="Save the synthetic corpus to this path and exit")
+    parser.add_argument("--verbose", action="store_true", help="Show what the generators print")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else build_corpus(args.messages)
+    if args.write_corpus:
+        with open(args.write_corpus, "w", encoding="utf-8") as corpus_file:
+            corpus_file.writelines(json.dumps(record) + "\n" for record in corpus)
+        print(f"Wrote {len(corpus):,} messages to {args.write_corpus}")
+        return
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        result = asyncio.run(run_replay(corpus, args.concurrency, args.stub_latency / 1000))
+
+    latencies = result["latencies"]
+    web_calls = {host: count for host, count in API_CALLS.items() if host != "discord"}
+    print(f"Messages:      {len(corpus):,} ({args.concurrency} in flight, {args.stub_latency:g}ms stub latency)")
+    print(f"Throughput:    {len(corpus) / result['elapsed']:,.0f} msg/s")
+    print(f"Latency:       p50 {percentile(latencies, 0.5) * 1000:.2f}ms, p99 {percentile(latencies, 0.99) * 1000:.2f}ms")
+    print(f"Discord calls: {API_CALLS['discord']:,}")
+    print(f"Web calls:     {sum(web_calls.values()):,} "
+          f"({', '.join(f'{host} {count:,}' for host, count in sorted(web_calls.items())) or 'none'})")
+    print(f"Merged:        {ratelimit.OUTBOUND.merged:,} in-flight duplicate requests")
+
+
+if __name__ == "__main__":
+    main()
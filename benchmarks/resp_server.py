@@ -0,0 +1,212 @@
+"""
+A Redis stand-in which other processes can connect to
+
+Serves the in-process stand-in from redisconnection over the Redis protocol (RESP2), so that
+benchmarks can run several bot processes against one store without a Redis server. Only the
+commands InMemoryRedis supports are available, along with PING, MULTI, EXEC, DISCARD, WATCH and
+UNWATCH. None of the commands suspend, so each one, and each MULTI ... EXEC block, runs atomically.
+An EXEC fails, replying with a null, if any key the client is watching has changed since WATCH
+
+Usage: python -m benchmarks.resp_server [port]
+"""
+import asyncio
+import sys
+
+from redisconnection import InMemoryRedis
+
+CRLF = b"\r\n"
+
+
+class Status(bytes):
+    """ A reply sent as a simple string, such as `+OK` """
+
+
+OK = Status(b"OK")
+QUEUED = Status(b"QUEUED")
+
+
+class RESPServer:
+    """ Serves an InMemoryRedis store to Redis clients """
+
+    def __init__(self, data: dict = None):
+        """
+        :param data: The dictionary holding the stored keys, shared with any InMemoryRedis using it.
+            If not provided, a new one is made
+        """
+        self.client = InMemoryRedis(data, decode_responses=False)
+        self.commands = 0
+        self.port = None
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """ Starts listening. If `port` is 0, a free port is picked and saved to `self.port` """
+        self._server = await asyncio.start_server(self._serve, host, port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Answers one client's commands until it disconnects """
+        transaction = None  # The commands queued since MULTI, if a transaction is open
+        watched = {}  # Maps each key the client is watching to a copy of its entry when it was watched
+        try:
+            while True:
+                command = await _read_command(reader)
+                if command is None:
+                    break
+                name = command[0].upper()
+                if name == b"MULTI":
+                    transaction, reply = [], OK
+                elif name == b"EXEC":
+                    if transaction is None:
+                        reply = Exception("ERR EXEC without MULTI")
+                    elif any(self.client._snapshot(key) != entry for key, entry in watched.items()):
+                        transaction, reply = None, None
+                    else:
+                        commands, transaction = transaction, None
+                        reply = [await self._run(queued) for queued in commands]
+                    watched = {}
+                elif name == b"DISCARD":
+                    transaction, watched, reply = None, {}, OK
+                elif name == b"WATCH" and transaction is None:
+                    watched.update((key, self.client._snapshot(key)) for key in command[1:])
+                    reply = OK
+                elif name == b"UNWATCH":
+                    watched, reply = {}, OK
+                elif transaction is not None:
+                    transaction.append(command)
+                    reply = QUEUED
+                else:
+                    reply = await self._run(command)
+                writer.write(_encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _run(self, command: list):
+        """ Runs a command, returning its reply, or the exception it raised """
+        self.commands += 1
+        name, args = command[0].upper().decode(), command[1:]
+        handler = getattr(self, "_" + name.lower(), None)
+        try:
+            if handler is not None:
+                return await handler(*args)
+            if name.lower() in _PASSTHROUGH:
+                return await getattr(self.client, name.lower())(*args)
+            return Exception(f"ERR unknown command '{name}'")
+        except TypeError:
+            return Exception(f"ERR wrong number of arguments for '{name}' command")
+        except Exception as e:
+            message = str(e)
+            return Exception(message if message.split(" ", 1)[0].isupper() else "ERR " + message)
+
+    # ---------------------------------------------------- Commands which need their arguments or replies converted
+
+    async def _ping(self, message: bytes = None):
+        return Status(b"PONG") if message is None else message
+
+    async def _set(self, name, value, *options):
+        kwargs = {}
+        index = 0
+        while index < len(options):
+            option = options[index].upper()
+            if option in (b"NX", b"XX"):
+                kwargs[option.decode().lower()] = True
+            elif option in (b"EX", b"PX"):
+                index += 1
+                kwargs[option.decode().lower()] = int(options[index])
+            else:
+                raise ValueError("syntax error")
+            index += 1
+        return OK if await self.client.set(name, value, **kwargs) else None
+
+    async def _del(self, *names):
+        return await self.client.delete(*names)
+
+    async def _expire(self, name, seconds):
+        return int(await self.client.expire(name, int(seconds)))
+
+    async def _pexpire(self, name, milliseconds):
+        return int(await self.client.pexpire(name, int(milliseconds)))
+
+    async def _type(self, name):
+        return Status(await self.client.type(name))
+
+    async def _hset(self, name, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise TypeError
+        return await self.client.hset(name, mapping=dict(zip(pairs[::2], pairs[1::2])))
+
+    async def _hsetnx(self, name, key, value):
+        return int(await self.client.hsetnx(name, key, value))
+
+    async def _lpop(self, name, count=None):
+        return await self.client.lpop(name, None if count is None else int(count))
+
+    async def _rpop(self, name, count=None):
+        return await self.client.rpop(name, None if count is None else int(count))
+
+    async def _ltrim(self, name, start, end):
+        await self.client.ltrim(name, int(start), int(end))
+        return OK
+
+    async def _lrange(self, name, start, end):
+        return await self.client.lrange(name, int(start), int(end))
+
+
+# Commands whose arguments and replies need no conversion
+_PASSTHROUGH = {"get", "exists", "ttl", "hget", "hlen", "rpush", "lpush", "llen"}
+
+
+async def _read_command(reader: asyncio.StreamReader):
+    """ Reads a command sent as an array of bulk strings. Returns `None` once the client disconnects """
+    header = await reader.readline()
+    if not header:
+        return None
+    if not header.startswith(b"*"):  # An inline command, as typed into telnet
+        return header.split()
+    command = []
+    for _ in range(int(header[1:])):
+        length = int((await reader.readline())[1:])
+        command.append((await reader.readexactly(length + 2))[:-2])
+    return command
+
+
+def _encode(reply) -> bytes:
+    """ Encodes a reply as RESP2 """
+    if reply is None:
+        return b"$-1" + CRLF
+    if isinstance(reply, Status):
+        return b"+" + reply + CRLF
+    if isinstance(reply, Exception):
+        return b"-" + str(reply).encode() + CRLF
+    if isinstance(reply, int):
+        return b":" + str(int(reply)).encode() + CRLF
+    if isinstance(reply, str):
+        reply = reply.encode("utf-8")
+    if isinstance(reply, bytes):
+        return b"$" + str(len(reply)).encode() + CRLF + reply + CRLF
+    return b"*" + str(len(reply)).encode() + CRLF + b"".join(_encode(item) for item in reply)
+
+
+async def serve_forever(port: int) -> None:
+    server = RESPServer()
+    await server.start(port=port)
+    print(f"Serving the Redis stand-in on 127.0.0.1:{server.port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 6379
+    try:
+        asyncio.run(serve_forever(port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Cold fill benchmark for StringCache
+
+Fills an empty `CatCache` from a local stub of thecatapi's image search. Each request takes a
+fixed time to answer and, like the real search, returns a random batch from a limited pool, so
+batches overlap with each other and with values served earlier. The cache's own `gather()` is
+used, so requests go through `utils.get_json_with_get` with its rate limiting, merging, and caching
+exactly as they do in the bot, and every gather should reach the stub as its own request.
+
+The sequential fill runs one gather at a time, as `_fill()` used to. The parallel fills run
+several at once, which should bring the fill time down towards a single gather's latency
+while making about the same number of calls, since no more are started than it should take
+to reach `fill_size`
+
+Usage: python -m benchmarks.stringcache_fill [gather latency in ms]
+"""
+import asyncio
+import random
+import sys
+import time
+import types
+
+from aiohttp import web
+
+import redisconnection
+
+redisconnection.use_memory_store()
+
+import utils  # noqa: E402 (the Redis stand-in has to be in place before the cache is imported)
+from cogs.images import CatCache  # noqa: E402
+from stringcache import StringCache  # noqa: E402
+
+FILL_SIZE = 50
+BATCH_SIZE = 10
+POOL_SIZE = 400  # How many distinct values the source can return
+PARALLELISM = [1, 3, 5]
+ROUNDS = 5
+
+
+class CatSearchStub:
+    """ A web server which answers image searches after a delay with a random batch of values from a fixed pool """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.rng = random.Random(0)
+        self.requests = 0
+        self.runner = None
+        self.port = None
+
+    async def handle(self, _):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        return web.json_response([{"url": f"https://cdn.example/cat/{index}.jpg"}
+                                  for index in self.rng.sample(range(POOL_SIZE), BATCH_SIZE)])
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/v1/images/search", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        # The stub is a single host, so the outbound rate limiter is opened up for it
+        utils.OUTBOUND.host_limits["127.0.0.1"] = (float("inf"), 1000000)
+
+    async def stop(self) -> None:
+        await self.runner.cleanup()
+
+
+class BenchCache(CatCache):
+    """ A CatCache which searches the stub, and counts its gathers """
+
+    def __init__(self, bot, cache_id, stub: CatSearchStub, **kwargs):
+        # Pops never trigger fills, so only the fills being timed run
+        StringCache.__init__(self, bot, cache_id, fill_size=FILL_SIZE, fill_threshold=0, gather_limit=FILL_SIZE,
+                             adaptive=False, **kwargs)
+        self.SEARCH_URL = f"http://127.0.0.1:{stub.port}/v1/images/search?limit={BATCH_SIZE}"
+        self.gathers = 0
+
+    async def gather(self) -> list:
+        self.gathers += 1
+        return await super().gather()
+
+
+async def cold_fill(stub: CatSearchStub, parallelism: int, round_index: int) -> (float, int, int, int):
+    """ Times filling an empty cache, after a previous fill's worth of values has been served """
+    bot = types.SimpleNamespace(loop=asyncio.get_running_loop())
+    cache = BenchCache(bot, f"bench-{parallelism}-{round_index}", stub, fill_parallelism=parallelism)
+    await cache.fill()
+    while len(cache) > 1:  # Serve everything, so the next fill has a recently served window to avoid
+        cache.pop()
+    cache.clear()
+    cache.gathers = cache.duplicates = 0
+    requests = stub.requests
+
+    start = time.perf_counter()
+    await cache.fill()
+    return time.perf_counter() - start, cache.gathers, stub.requests - requests, cache.duplicates
+
+
+async def run(latency: float) -> None:
+    stub = CatSearchStub(latency)
+    await stub.start()
+    print(f"Fill size: {FILL_SIZE}, batches of {BATCH_SIZE} from a pool of {POOL_SIZE}, "
+          f"{latency * 1000:.0f}ms per gather")
+    print(f"{'Parallelism':>11}  {'Fill time':>9}  {'Gathers':>7}  {'Requests':>8}  {'Duplicates':>10}")
+    for parallelism in PARALLELISM:
+        results = [await cold_fill(stub, parallelism, round_index) for round_index in range(ROUNDS)]
+        elapsed, gathers, requests, duplicates = (sum(values) / ROUNDS for values in zip(*results))
+        print(f"{parallelism:>11}  {elapsed * 1000:>7.0f}ms  {gathers:>7.1f}  {requests:>8.1f}  {duplicates:>10.1f}")
+    await stub.stop()
+    await utils.close_http_session()
+
+
+def main():
+    latency = float(sys.argv[1]) / 1000 if len(sys.argv) > 1 else 0.2
+    utils.report = utils.flag = _print_alert
+    asyncio.run(run(latency))
+
+
+async def _print_alert(alert, *args, **kwargs):
+    print(alert)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Multi-process benchmark for shared StringCaches
+
+Starts the Redis stand-in from `benchmarks.resp_server`, seeds a cache's queue, and runs several
+worker processes which each serve values from the same cache as fast as a steady stream of
+commands asks for them, refilling it from a stub source with a fixed latency.
+
+It runs once with local caches, where each worker loads the queue and keeps its own copy, and
+once with shared ones. Local caches should serve seeded values more than once, and lose values
+which one worker queued but another popped from its own copy of the queue. Shared caches should
+serve each value once, and with the refill lease, no two workers' fills should ever overlap.
+`check` asserts this of the shared round
+
+Usage: python -m benchmarks.stringcache_shared [workers]
+"""
+import asyncio
+import itertools
+import json
+import os
+import sys
+import time
+import types
+
+import redisconnection
+from benchmarks.resp_server import RESPServer
+
+CACHE_ID = "shared-bench"
+SEEDED = 60  # Values in the queue before the workers start
+TAKES = 150  # Values each worker serves
+TAKE_INTERVAL = 0.02
+GATHER_LATENCY = 0.05
+BATCH_SIZE = 10
+
+
+# ------------------------------------------------------------------------ Workers
+
+
+async def work(port: int, shared: bool) -> dict:
+    """ Serves `TAKES` values from the cache, recording what was served and when it was gathered """
+    redisconnection.REDIS_IN_MEMORY = False
+    redisconnection.REDIS_HOST, redisconnection.REDIS_PORT = "127.0.0.1", port
+
+    import utils
+    from stringcache import StringCache
+
+    async def _ignore_alert(*args, **kwargs):
+        pass
+    utils.report = utils.flag = _ignore_alert
+
+    queued = []  # Every value the worker added to the queue. Gathered values aren't all queued once it's full
+    gathers = []  # (start, end) of each gather(), by wall clock so they can be compared across workers
+    counter = itertools.count()
+
+    class StubCache(StringCache):
+        async def gather(self) -> list:
+            start = time.time()
+            await asyncio.sleep(GATHER_LATENCY)
+            values = [f"https://cdn.example/cat/{os.getpid()}-{next(counter)}.jpg" for _ in range(BATCH_SIZE)]
+            gathers.append((start, time.time()))
+            return values
+
+        def _append(self, values: list) -> None:
+            queued.extend(values)
+            super()._append(values)
+
+    bot = types.SimpleNamespace(loop=asyncio.get_running_loop())
+    cache = StubCache(bot, CACHE_ID, fill_size=20, fill_threshold=5, shared=shared)
+    served = []
+    for _ in range(TAKES):
+        value = await cache.take()
+        served.append((value, cache.is_stale()))
+        await asyncio.sleep(TAKE_INTERVAL)
+    while cache._locked:  # Let any fill in progress finish, so its values are counted
+        await asyncio.sleep(0.01)
+    if cache._writer is not None:
+        await cache._writer
+    await redisconnection.close()
+    return {"served": served, "queued": queued, "gathers": gathers}
+
+
+# ------------------------------------------------------------------------ Coordinator
+
+
+async def run_round(workers: int, shared: bool) -> dict:
+    """ Runs the workers against a freshly seeded queue, and checks what they served """
+    server = RESPServer()
+    await server.start()
+    key = "STRING-CACHE-QUEUE-" + CACHE_ID
+    seeded = [f"https://cdn.example/cat/seed-{index}.jpg" for index in range(SEEDED)]
+    await server.client.rpush(key, *seeded)
+
+    processes = [await asyncio.create_subprocess_exec(sys.executable, "-m", "benchmarks.stringcache_shared",
+                                                      "--worker", str(server.port), str(int(shared)),
+                                                      stdout=asyncio.subprocess.PIPE)
+                 for _ in range(workers)]
+    results = []
+    for process in processes:
+        output, _ = await process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"Worker failed with exit code {process.returncode}")
+        results.append(json.loads(output.splitlines()[-1]))  # Earlier lines are the cache's progress messages
+    remaining = {value.decode() for value in await server.client.lrange(key, 0, -1)}
+    await server.stop()
+
+    fresh = [value for result in results for value, stale in result["served"] if value is not None and not stale]
+    produced = set(seeded).union(*(result["queued"] for result in results))
+    overlaps = sum(1 for first, second in itertools.combinations(range(workers), 2)
+                   for a in results[first]["gathers"] for b in results[second]["gathers"]
+                   if a[0] < b[1] and b[0] < a[1])
+    return {"served": len(fresh),
+            "twice": len(fresh) - len(set(fresh)),
+            "stale": sum(stale for result in results for _, stale in result["served"]),
+            "empty": sum(value is None for result in results for value, _ in result["served"]),
+            "lost": len(produced - set(fresh) - remaining),
+            "gathers": sum(len(result["gathers"]) for result in results),
+            "overlaps": overlaps,
+            "commands": server.commands}
+
+
+def check(result: dict) -> None:
+    """ Checks that a shared round served no value twice, lost none, and never ran two gathers at once """
+    assert result["twice"] == 0, f"{result['twice']} values were served twice"
+    assert result["lost"] == 0, f"{result['lost']} values were lost"
+    assert result["overlaps"] == 0, f"{result['overlaps']} gathers overlapped"
+
+
+async def run(workers: int) -> None:
+    print(f"{workers} workers serving {TAKES} values each from a queue seeded with {SEEDED}, "
+          f"{GATHER_LATENCY * 1000:.0f}ms per gather of {BATCH_SIZE}")
+    print(f"{'':<8} {'Served':>6} {'Twice':>6} {'Stale':>6} {'Empty':>6} {'Lost':>6} {'Gathers':>7} "
+          f"{'Overlapping':>11} {'Commands':>8}")
+    for shared in (False, True):
+        result = await run_round(workers, shared)
+        print(f"{'Shared' if shared else 'Local':<8} {result['served']:>6} {result['twice']:>6} "
+              f"{result['stale']:>6} {result['empty']:>6} {result['lost']:>6} {result['gathers']:>7} "
+              f"{result['overlaps']:>11} {result['commands']:>8}")
+    check(result)  # The last round is the shared one
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--worker":
+        result = asyncio.run(work(int(sys.argv[2]), bool(int(sys.argv[3]))))
+        print(json.dumps(result))
+        return
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    asyncio.run(run(workers))
+
+
+if __name__ == "__main__":
+    main()
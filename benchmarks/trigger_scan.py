@@ -0,0 +1,92 @@
+"""
+Micro-benchmark for trigger extraction
+
+Compares the old approach, where every generator ran its own regex over every message,
+against the single shared pass of the TriggerScanner. The corpus is synthetic but shaped
+like real chat: most messages are short and contain no links at all
+
+Usage: python -m benchmarks.trigger_scan [message count]
+"""
+import random
+import sys
+import time
+
+from embedGenerator import BaseGenerator, TRIGGER_SCANNER
+
+WORDS = ["lol", "yeah", "i", "think", "that", "game", "was", "so", "good", "anyone", "want", "to", "play",
+         "tonight", "honestly", "no", "way", "the", "launch", "got", "scrubbed", "again", "what", "time",
+         "is", "it", "brb", "dinner", "omg", "did", "you", "see", "this", "wait", "really", "nice", "gg"]
+
+LINKS = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "https://en.wikipedia.org/wiki/Kerbal_Space_Program",
+    "https://www.reddit.com/r/KerbalSpaceProgram/comments/abc123/my_first_landing/",
+    "https://www.reddit.com/r/spacex/comments/xyz789/starship_flight/abcdefg/",
+    "https://twitter.com/SpaceX/status/1234567890123456789",
+    "https://discord.com/channels/123456789012345678/123456789012345678/123456789012345678",
+    "https://imgur.com/gallery/aBcDeF",
+]
+
+MENTIONS = ["check out r/aww", "r/KerbalSpaceProgram is great", "this belongs on r/mildlyinteresting"]
+
+
+def build_corpus(count: int, seed: int = 0) -> [str]:
+    """ Builds a list of chat messages where roughly 1 in 14 contains a link or subreddit mention """
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 15)))
+        roll = rng.random()
+        if roll < 0.06:
+            text = f"{text} {rng.choice(LINKS)}"
+        elif roll < 0.07:
+            text = f"{rng.choice(MENTIONS)} {text}"
+        corpus.append(text)
+    return corpus
+
+
+def scan_separately(corpus: [str]) -> int:
+    """ The old approach: every generator runs its own regex over every message """
+    patterns = [subclass.TRIGGER_PATTERN for subclass in BaseGenerator.__subclasses__()]
+    found = 0
+    for content in corpus:
+        for pattern in patterns:
+            found += len(pattern.findall(content))
+    return found
+
+
+def scan_combined(corpus: [str]) -> int:
+    """ The new approach: one prefiltered pass through the TriggerScanner """
+    found = 0
+    for content in corpus:
+        for matches in TRIGGER_SCANNER.scan(content).values():
+            found += len(matches)
+    return found
+
+
+def measure(func, corpus: [str], repeats: int = 5) -> (float, int):
+    """ Returns the best messages per second over several runs, along with the trigger count """
+    best = None
+    found = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        found = func(corpus)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(corpus) / best, found
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    corpus = build_corpus(count)
+    print(f"Generators: {', '.join(sub.__name__ for sub in BaseGenerator.__subclasses__())}")
+    print(f"Messages:   {count:,}")
+    before, before_found = measure(scan_separately, corpus)
+    after, after_found = measure(scan_combined, corpus)
+    print(f"Before:     {before:>12,.0f} msg/s ({before_found} triggers)")
+    print(f"After:      {after:>12,.0f} msg/s ({after_found} triggers)")
+    print(f"Speedup:    {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import asyncio
+import random
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from config import *
+
+"""
+Retries and Circuit Breakers
+
+Outbound web requests are sent through `call()`, which retries idempotent requests that fail
+with a connection error, a timeout, or a temporary server error, waiting a jittered, exponentially growing
+delay between attempts. Every host has a circuit breaker which opens after several failures in
+a row. While it's open, requests to the host fail immediately instead of waiting out timeouts,
+until a single probe request is let through to check whether the host has recovered
+"""
+
+CLOSED = "closed"  # Requests are sent as normal
+OPEN = "open"  # Requests fail immediately
+HALF_OPEN = "half-open"  # A single probe request is in flight, and the rest fail immediately
+
+# Errors which mean the request may succeed if it's tried again
+TRANSIENT_ERRORS = (aiohttp.ClientError, asyncio.TimeoutError)
+# Response statuses which mean the same. Others, like 501 Not Implemented, won't change on a retry
+TRANSIENT_STATUSES = frozenset({500, 502, 503, 504})
+
+
+class ServerError(Exception):
+    """
+    Raised by a request function when the host answered with one of the `TRANSIENT_STATUSES`
+
+    :param status: The response status
+    :param result: What the request should return if it isn't retried
+    """
+
+    def __init__(self, status: int, result):
+        super().__init__(f"Server error ({status})")
+        self.status = status
+        self.result = result
+
+
+class CircuitOpen(Exception):
+    """ Raised when a request is refused because its host's circuit breaker is open """
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"{host} is unavailable, retrying in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """ Tracks the health of a single host """
+
+    def __init__(self, host: str, failure_threshold: int, reset_timeout: float, clock=time.monotonic):
+        """
+        :param host: The host name
+        :param failure_threshold: How many failures in a row open the breaker
+        :param reset_timeout: How many seconds the breaker stays open before a probe request is allowed
+        :param clock: (Optional) A function returning the current time in seconds. Defaults to `time.monotonic`
+        """
+        self.host = host
+        self.clock = clock
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.failures = 0  # Failed requests
+        self.rejected = 0  # Requests refused while the breaker was open
+        self.times_opened = 0
+        self.opened_at = 0.0
+
+    def retry_in(self) -> float:
+        """ How many seconds until a probe request will be allowed, if the breaker is open """
+        return max(0.0, self.opened_at + self.reset_timeout - self.clock())
+
+    def before_request(self) -> None:
+        """ Checks that a request may be sent, raising `CircuitOpen` if it may not """
+        if self.state == OPEN and self.retry_in() == 0:
+            self.state = HALF_OPEN  # Let this request through as the probe
+            return
+        if self.state != CLOSED:
+            self.rejected += 1
+            raise CircuitOpen(self.host, self.retry_in())
+
+    def record_success(self) -> None:
+        self.state = CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.times_opened += 1
+            self.state = OPEN
+            self.opened_at = self.clock()
+
+
+class CircuitBreakers:
+    """ The circuit breakers for every host the bot makes requests to """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}  # Maps host -> CircuitBreaker
+
+    def __iter__(self):
+        return iter(self._breakers.values())
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        """ Gets the circuit breaker for a URL's host, creating it if necessary """
+        host = urlsplit(url).hostname or ""
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(host, self.failure_threshold, self.reset_timeout)
+        return breaker
+
+
+def backoff_delay(attempt: int, base: float = HTTP_RETRY_BASE_DELAY, cap: float = HTTP_RETRY_MAX_DELAY) -> float:
+    """ A random delay of up to `base * 2^attempt` seconds, capped at `cap`, so retries from many requests spread out """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call(url: str, send, retries: int = 0, breakers: Optional[CircuitBreakers] = None):
+    """
+    Sends a request, retrying transient failures and failing fast while the host is unhealthy
+
+    :param url: The URL being requested, which decides the circuit breaker used
+    :param send: A coroutine function which makes the request and returns its result. It should
+        raise `ServerError` if the host answers with one of the `TRANSIENT_STATUSES`
+    :param retries: (Optional) How many times to retry a failed request. Only pass this for
+        requests without side effects. Defaults to 0
+    :param breakers: (Optional) The circuit breakers to use. Defaults to `BREAKERS`
+    :return: Whatever `send` returns, or the `result` of the last `ServerError`
+    :raises CircuitOpen: If the host's circuit breaker is open
+    """
+    breaker = (breakers or BREAKERS).for_url(url)
+    attempt = 0
+    while True:
+        breaker.before_request()
+        try:
+            result = await send()
+        except ServerError as e:
+            breaker.record_failure()
+            if attempt >= retries or breaker.state == OPEN:
+                return e.result
+        except TRANSIENT_ERRORS:
+            breaker.record_failure()
+            if attempt >= retries or breaker.state == OPEN:
+                raise
+        except BaseException:
+            # Anything else, such as a 429 or a cancellation, says nothing about the host's health,
+            # but a probe has to be resolved either way so the breaker doesn't stay half-open
+            if breaker.state == HALF_OPEN:
+                breaker.state = OPEN
+                breaker.opened_at = breaker.clock() - breaker.reset_timeout
+            raise
+        else:
+            breaker.record_success()
+            return result
+        await asyncio.sleep(backoff_delay(attempt))
+        attempt += 1
+
+
+# The circuit breakers used by the web functions in utils
+BREAKERS = CircuitBreakers(CIRCUIT_BREAKER_FAILURE_THRESHOLD, CIRCUIT_BREAKER_RESET_SECONDS)
@@ -92,7 +92,7 @@ class Images(Cog):
     @commands.command(help=LONG_HELP['meow'], brief=BRIEF_HELP['meow'], aliases=ALIASES['meow'])
     async def meow(self, ctx):
         try:
-            meow_url = self.meow_cache.pop()
+            meow_url = await self.meow_cache.take()
             if meow_url:
                 embed = Embed().set_image(url=meow_url)
                 embed.colour = EMBED_COLORS["meow"]
@@ -138,7 +138,7 @@ class Images(Cog):
 
             # Get the image URL
             json = await utils.get_json_with_get('https://api.unsplash.com/photos/random?query=' + query,
-                                                 headers=headers)
+                                                 headers=headers, use_cache=False, coalesce=False)
             print(json)
             author_url = json[0]['user']['links']['html'] + "?utm_source=SuitsBot&utm_medium=referral"
             pic_embed = Embed().set_image(url=json[0]['urls']['full'])
@@ -155,7 +155,8 @@ class Images(Cog):
     async def woof(self, ctx):
         try:
             # Get the image URL
-            json = await utils.get_json_with_get("https://dog.ceo/api/breeds/image/random")
+            json = await utils.get_json_with_get("https://dog.ceo/api/breeds/image/random",
+                                                 use_cache=False, coalesce=False)
 
             # If there is an error
             if 'status' not in json[0].keys() or json[0]['status'] != "success":
@@ -184,13 +185,17 @@ class Images(Cog):
 
 class CatCache(StringCache):
     """ An implementation of the StringCache for cat photos """
+
+    SEARCH_URL = "https://api.thecatapi.com/v1/images/search?limit=10"
+
     def __init__(self, bot):
         StringCache.__init__(self, bot, cache_id="meow")
 
     async def gather(self):
         """ Fetches cat urls from thecatapi.com """
-        json = await utils.get_json_with_get("https://api.thecatapi.com/v1/images/search?limit=10",
-                                             headers={"x-api-token": tokens["THECATAPI"]})
+        json = await utils.get_json_with_get(self.SEARCH_URL,
+                                             headers={"x-api-token": tokens["THECATAPI"]},
+                                             use_cache=False, coalesce=False)
         return [result["url"] for result in json[0]]
 
 
@@ -207,7 +212,8 @@ async def get_apod_embed():
     embed_icon = "https://upload.wikimedia.org/wikipedia/commons/thumb/e/e5/NASA_logo.svg/" + \
                  "1200px-NASA_logo.svg.png"
     api_url = f"https://api.nasa.gov/planetary/apod?api_key={tokens['APOD']}"
-    [json, status_code] = await utils.get_json_with_get(api_url)
+    # A new picture is posted each day, so there's no need to ask for it more than once an hour
+    [json, status_code] = await utils.get_json_with_get(api_url, ttl=60 * 60)
     if status_code != 200:
         raise RuntimeError(f"Failed to retrieve APOD, status code: {status_code}")
     if json['media_type'] == "video":
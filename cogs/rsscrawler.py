@@ -1,3 +1,4 @@
+import asyncio
 from datetime import datetime, timedelta
 from random import randint
 import re
@@ -66,8 +67,8 @@ class RSSCrawler(Cog):
         try:
             message = parse.strip_command(ctx.message.content)
 
-            # Update feed
-            feed.refresh_if_stale()
+            # Update feed. Stale feeds are refreshed in the background while their last copy is used
+            await feed.refresh_if_stale()
 
             # Show most recent episode
             if message == "":
@@ -133,7 +134,7 @@ class RSSCrawler(Cog):
 
             # Force a refresh on the feed
             if subcommand == "refresh":
-                feed.refresh()
+                await feed.refresh()
                 await ctx.send(f"Alright, I have refreshed the feed `{feed.feed_id}`")
                 return
 
@@ -189,6 +190,9 @@ class RSSFeed:
         self.image = None  # The covert art for the feed
         self.link = None  # The website associated with the feed
         self.items = None  # The list of items in the feed
+        self.etag = None  # The validators of the last response, for conditional requests
+        self.modified = None
+        self._refresh_task = None  # The refresh in progress, if there is one
 
     def __len__(self):
         """
@@ -249,13 +253,45 @@ Fetch time: {self.fetch_time}
             return True
         return datetime.today() > self.fetch_time + self.ttl
 
-    def refresh(self):
+    async def refresh(self):
         """
-        Updates the cached data
+        Updates the cached data. If a refresh is already in progress, this waits for it instead of starting another
+        """
+        await asyncio.shield(self._start_refresh())
+
+    async def refresh_if_stale(self):
+        """
+        Helper method. Makes sure there is data to serve. The first time, this waits for the feed to be
+        downloaded. After that, stale data is kept while the feed is refreshed in the background
+        """
+        if self.raw_rss is None:
+            await self.refresh()
+        elif self.is_stale() and (self._refresh_task is None or self._refresh_task.done()):
+            self._start_refresh().add_done_callback(self._report_refresh_failure)
+
+    def _start_refresh(self) -> asyncio.Task:
+        """ Starts refreshing the feed, unless it's already being refreshed """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._fetch())
+        return self._refresh_task
+
+    def _report_refresh_failure(self, task: asyncio.Task) -> None:
+        """ Reports a background refresh which failed. The stale data is kept, and retried on the next command """
+        if not task.cancelled() and task.exception() is not None:
+            asyncio.ensure_future(utils.report(str(task.exception()), source=f"Refreshing feed '{self.feed_id}'"))
+
+    async def _fetch(self):
+        """
+        Downloads the feed, if it has changed since it was last downloaded, and updates the cached data
         """
         print(f"Refreshing feed '{self.feed_id}'")
-        self.raw_rss = utils.get_rss_feed(self.feed_url)
+        raw_rss = await utils.get_rss_feed(self.feed_url, etag=self.etag, modified=self.modified)
         self.fetch_time = datetime.today()
+        if raw_rss is None:
+            return  # Not modified
+        self.raw_rss = raw_rss
+        self.etag = raw_rss.get("etag")
+        self.modified = raw_rss.get("modified")
         self.channel = self.raw_rss["channel"]
         self.items = self.raw_rss["items"]
 
@@ -269,14 +305,7 @@ Fetch time: {self.fetch_time}
 
         # Optional elements
         if "ttl" in self.channel:
-            self.ttl = self.channel["ttl"]
-
-    def refresh_if_stale(self):
-        """
-        Helper method. Only refreshes information if cache is 'data' (i.e. data is older than max_age)
-        """
-        if self.is_stale():
-            self.refresh()
+            self.ttl = timedelta(minutes=int(self.channel["ttl"]))  # Given in minutes
 
     def get_embed(self, item):
         """
@@ -1,4 +1,3 @@
-import aiohttp
 from urllib.parse import quote
 from discord.ext import commands
 from discord.ext.commands import Cog
@@ -9,6 +8,9 @@ import utils
 from config import credentials
 from config.local_config import *
 
+# A reply holds 2000 characters, each of which is up to 4 bytes
+WOLFRAMALPHA_MAX_BYTES = 4 * 2000
+
 
 class WebQueries(Cog):
 
@@ -38,7 +40,7 @@ class WebQueries(Cog):
 
             # Query the API and post its response
             url = "http://api.urbandictionary.com/v0/define?term=" + quote(message)
-            (ud_json, response) = await utils.get_json_with_get(url)
+            (ud_json, response) = await utils.get_json_with_get(url, ttl=60 * 60)
             if response is not 200:
                 await ctx.send("There was an error processing your request. I apologize for the inconvenience.")
                 return
@@ -79,7 +81,7 @@ class WebQueries(Cog):
             wiki_search_url = ("http://en.wikipedia.org/w/api.php?action=query&format=json" +
                                "&prop=&list=search&titles=&srsearch=" + quote(term))
             # Looks for articles matching the search term
-            wiki_search_json = await utils.get_json_with_get(wiki_search_url)
+            wiki_search_json = await utils.get_json_with_get(wiki_search_url, ttl=60 * 60)
             if wiki_search_json[0]['query']['searchinfo']['totalhits'] == 0:
                 return None
             return wiki_search_json[0]['query']['search'][0]['title']
@@ -94,7 +96,7 @@ class WebQueries(Cog):
                               "&prop=info%7Cextracts%7Cdescription&titles=" + quoted_article_title +
                               "&exlimit=max&explaintext=1&exsectionformat=plain")
             # Gets the article details
-            response = await utils.get_json_with_get(wiki_query_url)
+            response = await utils.get_json_with_get(wiki_query_url, ttl=60 * 60)
             # If Wikipedia found nothing
             if "-1" in response[0]['query']['pages'].keys():
                 return None
@@ -180,16 +182,19 @@ class WebQueries(Cog):
                 await ctx.send("You must pass in a question to get a response")
                 return
 
-            # Query the API and post its response
-            async with aiohttp.ClientSession(headers=HEADERS) as session:
-                async with session.get("http://api.wolframalpha.com/v1/result?appid=" +
-                                       credentials.tokens["WOLFRAMALPHA_APPID"] + "&i=" + quote(message)) as resp:
-                    if resp.status is 501:
-                        await ctx.send(f"WolframAlpha could not understand the "
-                                       f"question '{message}' because {resp.reason}")
-                        return
-                    data = await resp.content.read()
-                    await ctx.send(data.decode("utf-8"))
+            # Query the API and post its response. Only as much as fits in a message is read
+            (answer, status, _) = await utils.fetch_text("http://api.wolframalpha.com/v1/result?appid=" +
+                                                         credentials.tokens["WOLFRAMALPHA_APPID"] +
+                                                         "&i=" + quote(message),
+                                                         max_bytes=WOLFRAMALPHA_MAX_BYTES)
+            if status == 501:
+                await ctx.send(f"WolframAlpha could not understand the "
+                               f"question '{message}' because {answer}")
+                return
+            if answer is None:
+                await ctx.send("There was an error processing your request. I apologize for the inconvenience.")
+                return
+            await ctx.send(utils.trim_to_len(answer, 2000))
         except Exception as e:
             await utils.report(str(e), source="wolf command", ctx=ctx)
 
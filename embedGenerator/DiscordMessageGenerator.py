@@ -1,4 +1,5 @@
 import re
+from re import Match
 
 from discord import Embed, Member, Message
 
@@ -8,10 +9,13 @@ import utils
 
 
 class DiscordMessageGenerator(BaseGenerator):
+
+    TRIGGER_PATTERN = re.compile(r'discord(?:app)?.com/channels/(\d{18}/\d{18}/\d{18})')
+    TRIGGER_HINTS = ("/channels/",)
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
-        links = re.findall(r'discord(app)?.com/channels/(\d{18}/\d{18}/\d{18})', msg.content)
-        return [group[1] for group in links]
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
+        return [match.group(1) for match in matches]
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
@@ -1,16 +1,54 @@
-import re
+import hashlib
+import json
+from re import Match
+import struct
+import time
+from typing import NamedTuple, Optional
 
-
-from discord import Embed, Message
+from discord import Embed, Forbidden, Message, NotFound
 
 from embedGenerator import BaseGenerator
+from embedGenerator.bloomFilter import RotatingBloomFilter
 from constants import *
 from config import DEV_MODE
+import redisconnection
 import utils
 import parse
 
 
+class Sighting(NamedTuple):
+    """ Where and when a link was seen, along with everything needed to describe it in an alert """
+    channel_id: int
+    message_id: int
+    author_id: int
+    created_at: Optional[int] = None  # Unix timestamp. The fields from here on are missing from legacy sightings
+    author_name: Optional[str] = None
+    channel_name: Optional[str] = None
+    content: Optional[str] = None
+
+    @property
+    def is_legacy(self) -> bool:
+        """ Whether this sighting was stored by an older version, which only kept IDs """
+        return self.created_at is None
+
+
 class DuplicateLinkAlertGenerator(BaseGenerator):
+    """
+    EmbedGenerator which warns users when they post a link someone else recently posted on the same server
+
+    Sightings are kept in a compact index. Each link is canonicalized and hashed to a fixed-width
+    digest, and where it was seen is packed into a binary record. Records are stored in one redis
+    hash per guild per day, so a whole day of sightings expires at once instead of each link being
+    its own key. Records snapshot the author's name, the channel's name, and the start of the message,
+    so alerts can be built without fetching the original message from Discord
+
+    Nearly every link has never been seen before, so each guild also has an in-process Bloom
+    filter of its recent links. Links the filter has definitely never seen aren't looked up in
+    the older buckets. The filter is only trusted once it holds every sighting that can still be
+    reported: either it was restored from a snapshot saved on a clean shutdown, or it has been
+    running for as long as sightings are reported. Until then, every link is looked up.
+    NOTE: This assumes a single bot process records sightings, since the filter only holds its own
+    """
 
     DUPLICATE_LINK_EXPIRY_SECONDS = 60 * 60 * 24 * 2    # Two days
     GENERATOR_ALLOWS_REPEATS = True  # The whole point is to find OTHER PEOPLE'S repeats
@@ -18,34 +56,269 @@ class DuplicateLinkAlertGenerator(BaseGenerator):
     # List of websites where query parameters should not be discarded
     WEBSITE_WHITELIST = ("https://www.youtube.com/watch",)
 
+    TRIGGER_PATTERN = parse.URL_REGEX
+    TRIGGER_HINTS = ("://",)
+
+    # Sighting index layout
+    INDEX_BUCKET_SECONDS = 60 * 60 * 24  # Each guild's sightings are grouped into one hash per day
+    LINK_DIGEST_SIZE = 12  # Bytes of the hashed link. Collisions within a guild's few days of links are negligible
+    SIGHTING_VERSION = 2
+    # Version, channel ID, message ID, author ID, and creation time. Followed by the author name,
+    # channel name, and message content, each prefixed with its length in bytes
+    SIGHTING_RECORD = struct.Struct(">BQQQI")
+    SIGHTING_STRING_LENGTH = struct.Struct(">H")
+    SIGHTING_CONTENT_LENGTH = 500  # Characters of the message kept, which is as much as the alert shows
+    # Older versions stored each sighting under its own key, as "<channel ID>/<message ID>/<author ID>".
+    # Those keys are still read until they have all expired, which is two days after upgrading
+    READ_LEGACY_SIGHTINGS = True
+
+    # Link filter configuration. Three one-day generations means every link is remembered
+    # for at least the two days it can be reported as a duplicate
+    LINK_FILTER_CAPACITY = 20000  # Links per guild per day
+    LINK_FILTER_ERROR_RATE = 0.01
+    LINK_FILTER_GENERATION_SECONDS = 60 * 60 * 24
+    LINK_FILTER_GENERATIONS = 3
+
+    _link_filters = {}  # Maps guild ID -> RotatingBloomFilter
+    _link_filters_trusted_at = {}  # Maps guild ID -> the time its link filter holds every reportable sighting
+
+    @classmethod
+    def get_link_digest(cls, link: str) -> bytes:
+        """ Hashes a link to the fixed-width digest it is indexed under """
+        return hashlib.blake2b(parse.canonical_url(link).encode("utf-8"), digest_size=cls.LINK_DIGEST_SIZE).digest()
+
+    @classmethod
+    def pack_sighting(cls, msg: Message) -> bytes:
+        """ Packs where and when a message was sent into a sighting record """
+        record = cls.SIGHTING_RECORD.pack(cls.SIGHTING_VERSION, msg.channel.id, msg.id, msg.author.id,
+                                          int(msg.created_at.timestamp()))
+        for value in (utils.get_screen_name(msg.author),
+                      msg.channel.name,
+                      utils.trim_to_len(msg.content, cls.SIGHTING_CONTENT_LENGTH)):
+            encoded = value.encode("utf-8")
+            record += cls.SIGHTING_STRING_LENGTH.pack(len(encoded)) + encoded
+        return record
+
+    @classmethod
+    def unpack_sighting(cls, record: bytes) -> Sighting:
+        """
+        Unpacks a sighting record
+
+        :param record: The packed sighting record
+        :return: The Sighting
+        """
+        version, *ids = cls.SIGHTING_RECORD.unpack_from(record)
+        if version != cls.SIGHTING_VERSION:
+            raise ValueError(f"Unknown sighting record version {version}")
+        strings = []
+        offset = cls.SIGHTING_RECORD.size
+        for _ in range(3):
+            (length,) = cls.SIGHTING_STRING_LENGTH.unpack_from(record, offset)
+            offset += cls.SIGHTING_STRING_LENGTH.size
+            strings.append(record[offset:offset + length].decode("utf-8"))
+            offset += length
+        return Sighting(*ids, *strings)
+
+    @classmethod
+    def _get_legacy_key(cls, link: str, guild_id: int) -> str:
+        """ Gets the key an older version stored a link's sighting under """
+        return f"{cls._get_data_prefix()}{guild_id}-{link}"
+
+    @classmethod
+    def parse_legacy_sighting(cls, data: bytes) -> Sighting:
+        """ Parses a sighting stored by an older version, which gives a Sighting with only its IDs set """
+        return Sighting(*(int(part) for part in json.loads(data).split("/")))
+
+    @classmethod
+    def _get_bucket_keys(cls, guild_id: int) -> [str]:
+        """
+        Gets the keys of every index bucket that can hold a recent sighting for a guild
+
+        :param guild_id: The ID of the guild
+        :return: The bucket keys, from oldest to the current bucket
+        """
+        current = int(time.time()) // cls.INDEX_BUCKET_SECONDS
+        bucket_count = -(-cls.DUPLICATE_LINK_EXPIRY_SECONDS // cls.INDEX_BUCKET_SECONDS)
+        return [f"{cls._get_data_prefix()}INDEX-{guild_id}-{bucket}"
+                for bucket in range(current - bucket_count, current + 1)]
+
+    @classmethod
+    async def recently_on_server(cls, links: [str], msg: Message) -> [str]:
+        """
+        Checks which of the given links were recently seen in a different message on this server.
+        Every link is also recorded in the current bucket of the index along with a snapshot of
+        the message it was seen in. The first sighting in a bucket is kept, so the earliest
+        sighting is always the one reported, and a link which keeps being shared stays in the index
+
+        All the links are checked and recorded in a single round trip to redis
+
+        :param links: The links to check in the past 48 hours for
+        :param msg: The Message where the links were found
+        :return: The links which were recently seen on the server
+        """
+        if not links:
+            return []
+        *older_keys, current_key = cls._get_bucket_keys(msg.guild.id)
+        record = cls.pack_sighting(msg)
+        digests = {link: cls.get_link_digest(link) for link in links}
+
+        # Split off the links the filter has definitely never seen. These only need recording,
+        # though whether they were already in the current bucket is still checked
+        link_filter = await cls._get_link_filter(msg.guild.id)
+        if time.time() >= cls._link_filters_trusted_at[msg.guild.id]:
+            possible = [link for link, digest in digests.items() if link_filter.might_contain(digest)]
+        else:
+            possible = list(digests)
+        for digest in digests.values():
+            link_filter.add(digest)
+
+        pipe = redisconnection.get_client(decode_responses=False).pipeline(transaction=False)
+        for link, digest in digests.items():
+            if link in possible:
+                for key in older_keys:
+                    pipe.hget(key, digest)
+                if cls.READ_LEGACY_SIGHTINGS:
+                    pipe.exists(cls._get_legacy_key(link, msg.guild.id))
+            pipe.hsetnx(current_key, digest, record)
+        # Keep the bucket until its newest possible sighting is old enough to expire
+        bucket_end = (int(time.time()) // cls.INDEX_BUCKET_SECONDS + 1) * cls.INDEX_BUCKET_SECONDS
+        pipe.expire(current_key, bucket_end - int(time.time()) + cls.DUPLICATE_LINK_EXPIRY_SECONDS)
+
+        results = await pipe.execute()
+        duplicates = []
+        index = 0
+        for link in digests:
+            step = len(older_keys) + int(cls.READ_LEGACY_SIGHTINGS) + 1 if link in possible else 1
+            *older_records, was_new = results[index:index + step]
+            index += step
+            if any(older_records) or not was_new:
+                duplicates.append(link)
+        return duplicates
+
+    @classmethod
+    async def _get_link_filter(cls, guild_id: int) -> RotatingBloomFilter:
+        """
+        Gets a guild's link filter, restoring it from its last snapshot if it isn't loaded yet.
+        A snapshot saved on a clean shutdown holds every sighting, so the filter is trusted straight
+        away. Otherwise, sightings made after the snapshot may be missing, so the filter isn't trusted
+        until every sighting it could be missing is too old to report
+        """
+        if guild_id in cls._link_filters:
+            return cls._link_filters[guild_id]
+        link_filter = RotatingBloomFilter(cls.LINK_FILTER_CAPACITY,
+                                          cls.LINK_FILTER_ERROR_RATE,
+                                          cls.LINK_FILTER_GENERATION_SECONDS,
+                                          cls.LINK_FILTER_GENERATIONS)
+        pipe = redisconnection.get_client(decode_responses=False).pipeline(transaction=True)
+        pipe.get(cls._get_filter_key(guild_id))
+        pipe.get(cls._get_clean_filter_key(guild_id))
+        # Whether or not the snapshot is used, it won't hold what's recorded from now on
+        pipe.delete(cls._get_clean_filter_key(guild_id))
+        snapshot, clean, _ = await pipe.execute()
+        trusted_at = time.time() + cls.DUPLICATE_LINK_EXPIRY_SECONDS
+        if snapshot:
+            try:
+                link_filter.load_bytes(snapshot)
+                if clean:
+                    trusted_at = 0
+            except (ValueError, struct.error) as e:
+                print(f"Discarding link filter snapshot for guild {guild_id}: {e}")
+        # Another message may have loaded the filter while this one was waiting on redis
+        if guild_id not in cls._link_filters:
+            cls._link_filters[guild_id] = link_filter
+            cls._link_filters_trusted_at[guild_id] = trusted_at
+        return cls._link_filters[guild_id]
+
+    @classmethod
+    def _get_filter_key(cls, guild_id: int) -> str:
+        """ Gets the redis key a guild's link filter snapshot is stored under """
+        return f"{cls._get_data_prefix()}FILTER-{guild_id}"
+
+    @classmethod
+    def _get_clean_filter_key(cls, guild_id: int) -> str:
+        """ Gets the redis key which marks a guild's link filter snapshot as saved on a clean shutdown """
+        return f"{cls._get_data_prefix()}FILTER-CLEAN-{guild_id}"
+
+    @classmethod
+    async def save_link_filters(cls, clean: bool = False) -> None:
+        """
+        Snapshots every guild's link filter to redis so they survive restarts
+
+        :param clean: Whether the bot is shutting down, so no more sightings will be recorded after
+            the snapshot and it can be trusted as soon as it's restored. Defaults to `False`
+        """
+        expiry = cls.LINK_FILTER_GENERATION_SECONDS * cls.LINK_FILTER_GENERATIONS
+        pipe = redisconnection.get_client(decode_responses=False).pipeline(transaction=False)
+        for guild_id, link_filter in cls._link_filters.items():
+            pipe.set(cls._get_filter_key(guild_id), link_filter.to_bytes(), ex=expiry)
+            if clean:
+                pipe.set(cls._get_clean_filter_key(guild_id), 1, ex=expiry)
+        await pipe.execute()
+
     @classmethod
-    def get_link_key(cls, link: str, msg: Message) -> str:
-        """ Generates the key for a link seen in a given Message """
-        return f"{msg.guild.id}-{link}"
+    def link_filter_stats(cls) -> dict:
+        """
+        Reports the state of each guild's link filter
+
+        :return: A dictionary mapping guild ID -> (links tracked, bytes used, estimated false positive rate)
+        """
+        return {guild_id: (len(link_filter), link_filter.size_in_bytes(), link_filter.false_positive_rate())
+                for guild_id, link_filter in cls._link_filters.items()}
 
     @classmethod
-    async def recently_on_server(cls, link: str, msg: Message) -> bool:
+    async def find_sightings(cls, links: [str], guild_id: int) -> dict:
+        """
+        Finds the earliest recent sighting of each link on a server
+
+        :param links: The links to look up
+        :param guild_id: The ID of the guild
+        :return: A dictionary mapping each link that was found to its Sighting
         """
-        Checks if a given links was recently seen in a different message on this server
-        If it wasn't, the link and guild ID are used as a key to store the channel and
-        message ID where they were seen. This data is stored as the string
+        bucket_keys = cls._get_bucket_keys(guild_id)
+        step = len(bucket_keys) + int(cls.READ_LEGACY_SIGHTINGS)
+        pipe = redisconnection.get_client(decode_responses=False).pipeline(transaction=False)
+        for link in links:
+            # A legacy sighting predates every record in the index, so it's looked up first
+            if cls.READ_LEGACY_SIGHTINGS:
+                pipe.get(cls._get_legacy_key(link, guild_id))
+            digest = cls.get_link_digest(link)
+            for key in bucket_keys:
+                pipe.hget(key, digest)
+        results = await pipe.execute()
+
+        sightings = {}
+        for index, link in enumerate(links):
+            records = [record for record in results[index * step:(index + 1) * step] if record]
+            if not records:
+                continue
+            if cls.READ_LEGACY_SIGHTINGS and results[index * step]:
+                sightings[link] = cls.parse_legacy_sighting(records[0])
+            else:
+                sightings[link] = cls.unpack_sighting(records[0])
+        return sightings
 
-        `<channel_ID>/<message_ID>/<author_ID>'
+    @classmethod
+    async def _complete_legacy_sighting(cls, sighting: Sighting) -> Optional[Sighting]:
+        """
+        Fills in a legacy sighting by fetching the message it refers to. Legacy sightings
+        expire two days after upgrading, after which this is never needed
 
-        :param link: The link to check in the past 48 hours for
-        :param msg: The Message where the link was found
-        :return: `True` if the link was recently seen on the server
+        :param sighting: The legacy Sighting
+        :return: The completed Sighting, or `None` if the message is no longer available
         """
-        link_key = cls.get_link_key(link, msg)
-        if await cls.load_data(link_key) is not None:
-            return True
-        await cls.store_data(link_key,
-                             f"{msg.channel.id}/{msg.id}/{msg.author.id}",
-                             expiration=cls.DUPLICATE_LINK_EXPIRY_SECONDS)
-        return False
+        try:
+            prev_message = await utils.get_message(sighting.channel_id, sighting.message_id)
+        except (NotFound, Forbidden):
+            return None
+        if prev_message is None:
+            return None
+        return sighting._replace(created_at=int(prev_message.created_at.timestamp()),
+                                 author_name=utils.get_screen_name(prev_message.author),
+                                 channel_name=prev_message.channel.name,
+                                 content=utils.trim_to_len(prev_message.content, cls.SIGHTING_CONTENT_LENGTH))
 
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
         """
         Finds URLs inside messages and checks if those links have been
         previously shared on the server. Links will be ignored if:
@@ -53,14 +326,14 @@ class DuplicateLinkAlertGenerator(BaseGenerator):
             - They were sent in DMs
 
         :param msg: The message to extract links from
+        :param matches: The URLs found in the message
         :return: A list of all strings which contain duplicate links
         """
         if msg.content and msg.content[0] in ["?!.#/"]:     # Ignore bot commands
             return
         if msg.guild is None:   # Ignore in DMs
             return
-        links = re.findall(parse.URL_REGEX, msg.content)    # Extract URLs
-        links = [group[0] for group in links]   # Get just the full string
+        links = [match.group(0) for match in matches]   # Get just the full string
         # Strip query parameters
         for index, link in enumerate(links):
             if link.startswith(cls.WEBSITE_WHITELIST):
@@ -69,7 +342,7 @@ class DuplicateLinkAlertGenerator(BaseGenerator):
             elif "?" in link:
                 links[index] = link[:link.find("?")]
         # Return only the links that were already seen on this server recently
-        return [link for link in links if await cls.recently_on_server(link, msg)]
+        return await cls.recently_on_server(links, msg)
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
@@ -86,45 +359,43 @@ class DuplicateLinkAlertGenerator(BaseGenerator):
 
         alert_icon = "http://icons.iconarchive.com/icons/paomedia/small-n-flat/96/sign-warning-icon.png"
 
-        for trigger in triggers:
-            # Get channel id and message id of previous sighting
-            link_key = cls.get_link_key(trigger, msg)
-            prev_sighting = await cls.load_data(link_key)
+        # Get channel id and message id of previous sightings
+        sightings = await cls.find_sightings(triggers, msg.guild.id)
 
-            if prev_sighting is None:   # Alert and abort if it didn't find anything
+        for trigger in triggers:
+            if trigger not in sightings:   # Alert and abort if it didn't find anything
                 print(f"Didn't find trigger {trigger} in the DB")
                 continue
 
-            channel_id, message_id, prev_author_id = prev_sighting.split("/")
+            sighting = sightings[trigger]
 
             # If it's the same user, don't say anything
-            if int(prev_author_id) == msg.author.id and not DEV_MODE:
+            if sighting.author_id == msg.author.id and not DEV_MODE:
                 continue
 
-            prev_message = await utils.get_message(int(channel_id), int(message_id))
-
-            # Make sure the bot isn't linking to a different guild
-            guild_id = prev_message.guild.id
-            assert guild_id == msg.guild.id
+            if sighting.is_legacy:
+                sighting = await cls._complete_legacy_sighting(sighting)
+                if sighting is None:    # The original message was deleted
+                    continue
 
-            # Make alert embed
+            # Make alert embed. Sightings are indexed per guild, so the original is always on this server
             embed = Embed()
-            embed.url = f"http://discord.com/channels/{guild_id}/{channel_id}/{message_id}"
+            embed.url = f"http://discord.com/channels/{msg.guild.id}/{sighting.channel_id}/{sighting.message_id}"
             embed.colour = EMBED_COLORS["flag"]
 
             trigger_author_name = utils.get_screen_name(msg.author)
-            prev_author_name = prev_message.author
-            if prev_message.channel.id == msg.channel.id:
+            prev_author_name = sighting.author_name
+            if sighting.channel_id == msg.channel.id:
                 embed.title = f"Heads up {trigger_author_name}, " \
                               f"I think {prev_author_name} recently posted that link in this channel"
             else:
                 embed.title = f"Heads up {trigger_author_name}, " \
-                              f"I think {prev_author_name} recently posted that link in #{prev_message.channel.name}"
+                              f"I think {prev_author_name} recently posted that link in #{sighting.channel_name}"
 
             embed.add_field(name="Author", value=prev_author_name)
-            embed.add_field(name="Sent", value=f"<t:{int(prev_message.created_at.timestamp())}>")
+            embed.add_field(name="Sent", value=f"<t:{sighting.created_at}>")
 
-            embed.description = f"```{utils.trim_to_len(prev_message.content, 500)}```"  # Just in case it's really long
+            embed.description = f"```{sighting.content}```"  # Trimmed when recorded, in case it's really long
             embed.set_footer(text=f"If this was a mistake, click the {REPORT_EMOJI} reaction to report it",
                              icon_url=alert_icon)
 
@@ -1,4 +1,5 @@
 import re
+from re import Match
 
 from discord import Message
 
@@ -9,10 +10,13 @@ import utils
 
 class FxTwitterGenerator(BaseGenerator):
 
+    TRIGGER_PATTERN = re.compile(r'\b(?:https://twitter\.com/\w{1,15}/status/)(\d{19})\b')
+    TRIGGER_HINTS = ("twitter.com/",)
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
         # By extracting all twitter links without checking them, you avoid having to invoke the API on duplicates
-        return re.findall(r'\b(?:https://twitter\.com/\w{1,15}/status/)(\d{19})\b', msg.content)
+        return [match.group(1) for match in matches]
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
@@ -1,4 +1,5 @@
 import re
+from re import Match
 
 from discord import Message, Embed
 
@@ -8,9 +9,18 @@ import utils
 
 
 class RedditSelfPostGenerator(BaseGenerator):
+
+    TRIGGER_PATTERN = re.compile(r'reddit.com/r/\w{1,20}/comments/\w{5,6}/\w+/?')
+    UNFURL_CACHE_TTL = 60 * 10  # Ten minutes, so scores and comment counts stay reasonably fresh
+    TRIGGER_HINTS = ("/comments/",)
+
+    @classmethod
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
+        return [match.group(0) for match in matches]
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
-        return re.findall(r'reddit.com/r/\w{1,20}/comments/\w{5,6}/\w+/?', msg.content)
+    def normalize_trigger(cls, trigger: str) -> str:
+        return trigger.rstrip("/").lower()  # Reddit paths are case-insensitive
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
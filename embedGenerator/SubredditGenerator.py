@@ -1,4 +1,5 @@
 import re
+from re import Match
 
 from discord import Message, Embed
 
@@ -12,11 +13,13 @@ class SubredditGenerator(BaseGenerator):
         EmbedGenerator for detecting the names of Subreddits
     """
 
+    TRIGGER_PATTERN = re.compile(r'(?:^|\s)/?r/(\w+)(?:|$)')
+    TRIGGER_HINTS = ("r/",)
+    UNFURL_CACHE_TTL = 60 * 60  # Subreddit details rarely change
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
-        subreddit = re.compile(r'(?:^|\s)/?r/(\w+)(?:|$)')
-        triggers = re.findall(pattern=subreddit, string=msg.content)
-        return [trig.lower() for trig in triggers]  # Subreddits are case-insensitive
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
+        return [match.group(1).lower() for match in matches]  # Subreddits are case-insensitive
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
@@ -37,7 +40,8 @@ class SubredditGenerator(BaseGenerator):
             if sub_name in muted_subreddits:
                 continue
 
-            [json, response] = await utils.get_json_with_get("https://www.reddit.com/r/" + sub_name + "/about.json")
+            [json, response] = await utils.get_json_with_get("https://www.reddit.com/r/" + sub_name + "/about.json",
+                                                             ttl=cls.UNFURL_CACHE_TTL)
             if response is not 200:
                 continue
             data = json["data"]
@@ -1,18 +1,28 @@
 import re
+from re import Match
 from typing import Optional
 
 from discord import Message, Embed
 
 from embedGenerator import BaseGenerator
+from embedGenerator.recentLinks import RECENT_LINKS
 from config.credentials import tokens
 from constants import *
 import utils
 
 
 class TwitterReplyGenerator(BaseGenerator):
+
+    GENERATOR_TIMEOUT = 30  # Every trigger costs two API calls
+    RECENT_POST_WINDOW = 30  # How many messages back to look for the original tweet
+
+    TRIGGER_PATTERN = re.compile(r'\b(?:https://twitter\.com/\w{1,15}/status/)(\d{19})\b')
+    TRIGGER_HINTS = ("twitter.com/",)
+    UNFURL_CACHE_TTL = 60 * 10
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
-        return re.findall(r'\b(?:https://twitter\.com/\w{1,15}/status/)(\d{19})\b', msg.content)
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
+        return [match.group(1) for match in matches]
 
     @classmethod
     async def unfurl(cls, triggers: [str], msg: Message) -> list:
@@ -47,18 +57,6 @@ class TwitterReplyGenerator(BaseGenerator):
             if response is not 200:
                 continue
 
-            # Ignore if tweet had been recently posted
-            short_url = original_json["full_text"].split(" ")[-1]
-            full_url = f"https://twitter.com/{original_json['user']['screen_name']}/status/{original_id}"
-            prev_mentioned = False
-            async for message in msg.channel.history(limit=30):
-                if short_url in message.content or full_url in message.content:
-                    prev_mentioned = True
-                    break
-            if prev_mentioned:
-                print("reply was recently posted")
-                continue
-
             # ==== Generate Embed
 
             # Header
@@ -90,6 +88,25 @@ class TwitterReplyGenerator(BaseGenerator):
             embed_list.append(embed)
         return embed_list
 
+    @classmethod
+    async def is_redundant(cls, reply, msg: Message) -> bool:
+        """
+        Checks if the original tweet was recently posted in the channel, either by its full URL
+        or by its short link, which is the last word of the tweet's text. This uses the index of
+        recently posted links rather than the channel history, so it makes no API calls
+
+        :param reply: The embed describing the original tweet
+        :param msg: The message which linked the reply tweet
+        :return: `True` if the original tweet was recently posted
+        """
+        full_url = reply.url
+        short_url = reply.description.split(" ")[-1]
+        for url in (full_url, short_url):
+            if "://" in url and RECENT_LINKS.posted_recently(msg.channel.id, url, messages=cls.RECENT_POST_WINDOW):
+                print("reply was recently posted")
+                return True
+        return False
+
     @classmethod
     def get_original_url(cls, reply_id) -> Optional[str]:
         pass
@@ -1,4 +1,10 @@
+import asyncio
+
+import metrics
+
 from embedGenerator.baseGenerator import *
+from embedGenerator.recentLinks import RECENT_LINKS
+from embedGenerator.routingTable import ROUTING_TABLE
 from embedGenerator.DuplicateLinkAlertGenerator import DuplicateLinkAlertGenerator
 from embedGenerator.DiscordMessageGenerator import DiscordMessageGenerator
 from embedGenerator.RedditSelfPostGenerator import RedditSelfPostGenerator
@@ -7,11 +13,78 @@ from embedGenerator.TwitterReplyGenerator import TwitterReplyGenerator
 # from embedGenerator.FxTwitterGenerator import FxTwitterGenerator  # <- Disable while fxtwitter.com is down
 from embedGenerator.SubredditGenerator import SubredditGenerator
 
+# Limits the number of generator tasks across the whole bot. A slot is taken before each task is
+# created, so a burst of messages waits here instead of piling up pending tasks
+_GENERATOR_SEMAPHORE = asyncio.Semaphore(EMBED_GENERATOR_MAX_TASKS)
+
+# Holds references to in-flight generator and cleanup tasks so they aren't garbage collected mid-run
+_GENERATOR_TASKS = set()
+
 
 async def process_message(message: Message):
     """
-    Executes EmbedGeneration on all EmbedGenerator subclasses
+    Executes EmbedGeneration on all EmbedGenerator subclasses whose triggers appear in the message.
+    The message is scanned once for the triggers of every generator active in its channel, and
+    each generator is handed only the matches of its own pattern
+
+    If concurrent generation is enabled, every generator is started as its own task and
+    this returns once they have all started, leaving the unfurls to finish in the background.
+    Each task needs one of the `EMBED_GENERATOR_MAX_TASKS` slots, so while they are all in use,
+    this waits for one to be freed before starting the next generator. Otherwise,
+    the generators are run one after another and this returns once they have all finished
+
+    :param message: The message to parse
+    """
+    guild_id = message.guild.id if message.guild is not None else None
+    found = TRIGGER_SCANNER.scan(message.content, ROUTING_TABLE.generators_for(guild_id, message.channel.id))
+    if not EMBED_GENERATOR_CONCURRENT_DISPATCH:
+        for subclass, matches in found.items():
+            await subclass.run(message, matches)
+        return
+
+    for subclass, matches in found.items():
+        await _GENERATOR_SEMAPHORE.acquire()
+        task = asyncio.create_task(_run_generator(subclass, message, matches))
+        _GENERATOR_TASKS.add(task)
+        task.add_done_callback(_GENERATOR_TASKS.discard)
+        task.add_done_callback(lambda _: _GENERATOR_SEMAPHORE.release())
+
+
+async def _run_generator(generator, message: Message, matches: list):
+    """
+    Runs a single generator on a message in the task slot `process_message` took for it. If the
+    generator takes longer than its `GENERATOR_TIMEOUT`, it is cancelled and the timeout is flagged
+
+    :param generator: The BaseGenerator subclass to run
     :param message: The message to parse
+    :param matches: The matches of the generator's pattern in the message
+    """
+    try:
+        await asyncio.wait_for(generator.run(message, matches), timeout=generator.GENERATOR_TIMEOUT)
+    except asyncio.TimeoutError:
+        metrics.GENERATOR_FAILURES.inc(generator.__name__, metrics.guild_label(message.guild))
+        await utils.flag(alert=f"{generator.__name__} timed out",
+                         description=f"Generator was cancelled after {generator.GENERATOR_TIMEOUT} seconds",
+                         message=message)
+    except Exception as e:
+        await utils.report(str(e), source=f"_run_generator() for `{generator.__name__}`", ctx=message)
+
+
+def schedule_trigger_delete(message: Message):
+    """
+    Starts cleaning up the unfurls of a deleted message in the background, so the delete
+    event handler returns without waiting on redis or the Discord API
+
+    :param message: The message that was deleted
     """
-    for subclass in BaseGenerator.__subclasses__():
-        await subclass.run(message)
+    task = asyncio.create_task(_run_trigger_delete(message))
+    _GENERATOR_TASKS.add(task)
+    task.add_done_callback(_GENERATOR_TASKS.discard)
+
+
+async def _run_trigger_delete(message: Message):
+    """ Cleans up the unfurls of a deleted message, reporting any error """
+    try:
+        await process_trigger_delete(message)
+    except Exception as e:
+        await utils.report(str(e), source="process_trigger_delete()", ctx=message)
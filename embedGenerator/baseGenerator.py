@@ -1,10 +1,21 @@
+import asyncio
+import itertools
 import json
+import time
+from re import Match
+from typing import Optional
 from discord import Embed, Message, Reaction, User
-from discord.errors import NotFound
-import redis
+from discord.abc import PrivateChannel
+from discord.errors import HTTPException, NotFound
+from redis.exceptions import ResponseError, WatchError
 
 from config import *
 from constants import *
+from embedGenerator.routingTable import ROUTING_TABLE, SourceList
+from embedGenerator.triggerScanner import TRIGGER_SCANNER
+from embedGenerator.unfurlCache import UNFURL_CACHE
+import metrics
+import redisconnection
 import utils
 
 
@@ -27,17 +38,37 @@ UNFURL_PREFIX = f"{BASE_PREFIX}UNFURL-"  # IDs of messages with embeds
 RECENTLY_UNFURLED_TIMEOUT = 3600  # How long to wait before unfurling the same thing again (1 hr)
 UNFURLED_CLEANUP_TRACKING = 60 * 60 * 24  # How long to track messages to cleanup unfurls (1 day)
 
+# Discord's limits on the embeds in a single message
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_LENGTH_PER_MESSAGE = 6000
+
 # Threshold of community reactions for the bot to delete an unfurl
 DELETE_EMOJI_COUNT_TO_DELETE = 4
 
-# Create redis client
-REDIS_CLIENT = redis.StrictRedis(host='localhost', charset="utf-8", decode_responses=True)
-
 # Records the most recent report to prevent spamming #alert-messages
 PREVIOUS_REPORT = None
 
 
-class BaseGenerator:
+# The class attributes which hold a generator's server and channel lists
+SOURCE_LISTS = ("SERVER_BLACKLIST", "CHANNEL_BLACKLIST", "SERVER_WHITELIST", "CHANNEL_WHITELIST")
+
+
+class GeneratorType(type):
+    """
+    The type of every EmbedGenerator. Server and channel lists assigned to a generator are
+    stored as `SourceList`s, so the routing table's cached routes are dropped whenever one is
+    replaced or changed in place
+    """
+
+    def __setattr__(cls, name, value):
+        if name in SOURCE_LISTS:
+            super().__setattr__(name, SourceList(value))
+            ROUTING_TABLE.invalidate()
+        else:
+            super().__setattr__(name, value)
+
+
+class BaseGenerator(metaclass=GeneratorType):
     """
         Base class for all EmbedGenerators
 
@@ -46,29 +77,59 @@ class BaseGenerator:
         to specify how Message objects should be parsed and Embeds be generated from that data.
 
         Additionally, it defines static methods for managing recent triggers and unfurls
+
+        Subclasses which define a `TRIGGER_PATTERN` are automatically registered with the
+        TriggerScanner, which finds their triggers in a single shared pass over each message
     """
 
+    # The compiled regex which matches this generator's triggers
+    TRIGGER_PATTERN = None
+    # Substrings, at least one of which must appear in every match of `TRIGGER_PATTERN`.
+    # These let the scanner skip the regex entirely for messages which can't contain a trigger
+    TRIGGER_HINTS = ()
+
     # Channel/Server ID Blacklist
-    SERVER_BLACKLIST = []
-    CHANNEL_BLACKLIST = []
+    SERVER_BLACKLIST = SourceList()
+    CHANNEL_BLACKLIST = SourceList()
 
     # Server/Channel ID Whitelist
-    # NOTE: If there is a server whitelist and channel blacklist (or vice versa), the channel list takes priority
-    SERVER_WHITELIST = []
-    CHANNEL_WHITELIST = []
+    # NOTE: A blacklisted channel is always blocked, and a whitelisted channel is allowed even on a blacklisted
+    # or unlisted server. Changes to any of these lists take effect on the next message
+    SERVER_WHITELIST = SourceList()
+    CHANNEL_WHITELIST = SourceList()
 
     # Whether to filter triggers that were recently seen. Can be changed by subclasses
     GENERATOR_ALLOWS_REPEATS = False
 
+    # How many seconds the replies for a trigger are cached and reused across channels and guilds.
+    # Only enable this for generators whose replies don't depend on where the trigger was posted.
+    # `None` disables caching
+    UNFURL_CACHE_TTL = None
+
+    # How many seconds a single `run()` may take when generators are dispatched concurrently
+    # before it is cancelled. Can be changed by subclasses which talk to slower services
+    GENERATOR_TIMEOUT = 15
+
+    def __init_subclass__(cls, **kwargs):
+        """ Registers the trigger pattern of each new generator with the TriggerScanner and RoutingTable """
+        super().__init_subclass__(**kwargs)
+        for name in SOURCE_LISTS:
+            if name in cls.__dict__:
+                setattr(cls, name, cls.__dict__[name])  # Store lists from the class body as SourceLists
+        if cls.TRIGGER_PATTERN is not None:
+            TRIGGER_SCANNER.register(cls, cls.TRIGGER_PATTERN, cls.TRIGGER_HINTS)
+            ROUTING_TABLE.register(cls)
+
     @classmethod
-    async def extract(cls, msg: Message) -> [str]:
+    async def extract(cls, msg: Message, matches: [Match]) -> [str]:
         """
-        Extracts the list of relevant phrases from the contents of a message.
+        Extracts the list of relevant phrases from the matches of this generator's `TRIGGER_PATTERN`.
         This must be defined by each subclass based on the information it is looking for
         This method only needs to extract relevant strings. `run()` will handle ignoring
         recent triggers and removing duplicates
 
         :param msg: The discord.Message object this Generator is extracting data from
+        :param matches: The matches of this generator's `TRIGGER_PATTERN` found in the message
         :return: The list of triggers
         """
         raise NotImplementedError
@@ -85,6 +146,66 @@ class BaseGenerator:
         """
         raise NotImplementedError
 
+    @classmethod
+    async def unfurl_cached(cls, triggers: [str], msg: Message) -> list:
+        """
+        Generates the list of responses for a list of triggers, reusing cached responses if this
+        generator has an `UNFURL_CACHE_TTL`. Triggers which aren't cached are unfurled individually
+        and their responses stored, so repeat links are served without any outbound requests.
+        Responses are then filtered through `is_redundant()`
+
+        :param triggers: The list of trigger phrases
+        :param msg: A copy of the original message object
+        :return: The list of relevant responses
+        """
+        if cls.UNFURL_CACHE_TTL is None:
+            replies = await cls.unfurl(triggers, msg)
+        else:
+            normalized = {trigger: cls.normalize_trigger(trigger) for trigger in triggers}
+            cached = await UNFURL_CACHE.get_many(cls, list(normalized.values()))
+            misses = [trigger for trigger in triggers if normalized[trigger] not in cached]
+            results = await asyncio.gather(*[cls.unfurl([trigger], msg) for trigger in misses])
+            for trigger, result in zip(misses, results):
+                cached[normalized[trigger]] = result
+                await UNFURL_CACHE.put(cls, normalized[trigger], result, cls.UNFURL_CACHE_TTL)
+
+            # Reassemble in trigger order, skipping replies which point to the same place
+            replies = []
+            seen_urls = set()
+            for trigger in triggers:
+                for reply in cached[normalized[trigger]]:
+                    url = reply.url if isinstance(reply, Embed) else str(reply)
+                    if url in seen_urls:
+                        continue
+                    seen_urls.add(url)
+                    replies.append(reply)
+
+        return [reply for reply in replies if not await cls.is_redundant(reply, msg)]
+
+    @classmethod
+    def normalize_trigger(cls, trigger: str) -> str:
+        """
+        Converts a trigger to the form its cached responses are stored under, so that different ways
+        of writing the same trigger share a cache entry. Can be overridden by subclasses
+
+        :param trigger: The trigger phrase
+        :return: The normalized trigger
+        """
+        return trigger.rstrip("/")
+
+    @classmethod
+    async def is_redundant(cls, reply, msg: Message) -> bool:
+        """
+        Checks whether a response shouldn't be posted in reply to this particular message.
+        Because responses may come from the cache, any check which depends on where the trigger
+        was posted belongs here rather than in `unfurl()`. Can be overridden by subclasses
+
+        :param reply: The Embed or string response
+        :param msg: The message which contained the trigger
+        :return: `True` if the response should not be posted
+        """
+        return False
+
     @classmethod
     async def recently_seen(cls, trigger: str, channel_id: int) -> bool:
         """
@@ -94,12 +215,43 @@ class BaseGenerator:
         :param channel_id: The ID of the channel the message was seen in
         :return: `True` if the trigger is still considered recently seen, `False` otherwise
         """
-        key = f"{cls._get_recent_prefix()}{channel_id}-{trigger}"
-        if REDIS_CLIENT.exists(key):
-            return True
-        # If key is not present, set and return `False`
-        REDIS_CLIENT.set(key, "", RECENTLY_UNFURLED_TIMEOUT)
-        return False
+        return not await cls.filter_recent([trigger], channel_id)
+
+    @classmethod
+    async def filter_recent(cls, triggers: [str], channel_id: int) -> [str]:
+        """
+        Checks a batch of triggers against those recently seen by this Generator in the same channel.
+        Every trigger which wasn't recently seen is recorded. This takes a single round trip to redis,
+        and because each trigger is checked and recorded atomically, concurrent messages with the same
+        trigger can't both be let through
+
+        :param triggers: The triggers to check for
+        :param channel_id: The ID of the channel the message was seen in
+        :return: The triggers which were NOT recently seen, in their original order
+        """
+        keys = {f"{cls._get_recent_prefix()}{channel_id}-{trigger}": "" for trigger in triggers}
+        claimed = await cls.claim_keys(keys, RECENTLY_UNFURLED_TIMEOUT)
+        return [trigger for trigger, key in zip(triggers, keys) if claimed[key]]
+
+    @staticmethod
+    async def claim_keys(entries: dict, expiration: int = None) -> dict:
+        """
+        Stores each value under its key, but only if the key isn't already set. All the keys are
+        claimed in one pipelined round trip, and each claim is atomic (`SET ... NX`), so when several
+        callers race for the same key, exactly one of them will claim it
+
+        :param entries: A dictionary mapping redis keys to the values to store under them
+        :param expiration: How many seconds claimed keys should be stored for before expiring.
+            Defaults to `None`, which means they will never expire
+        :return: A dictionary mapping each key to `True` if it was claimed by this call
+        """
+        if not entries:
+            return {}
+        pipe = redisconnection.get_client().pipeline(transaction=False)
+        for key, value in entries.items():
+            pipe.set(key, value, ex=expiration, nx=True)
+        results = await pipe.execute()
+        return {key: bool(result) for key, result in zip(entries, results)}
 
     @classmethod
     def _get_recent_prefix(cls):
@@ -112,46 +264,45 @@ class BaseGenerator:
         return f"{BASE_PREFIX}{cls.__name__}-DATA-"
 
     @classmethod
-    def _source_blocked(cls, msg):
+    def source_allowed(cls, guild_id: Optional[int], channel_id: int) -> bool:
         """
-        Checks if the source of the message is blocked, meaning either:
-            - The channel is blacklisted
-            - The channel isn't on the whitelist
-            - The server is blacklisted and the channel isn't whitelisted
-            - The server isn't on the whitelist
-
-        :param msg: The message to check
-        :return: Returns `True` if the message is from a disabled source
+        Checks this generator's server and channel lists to see if it may run in a channel.
+        The first rule that applies decides:
+            - A blacklisted channel is blocked
+            - A whitelisted channel is allowed
+            - A channel on a blacklisted server is blocked
+            - If there is any whitelist, only channels on a whitelisted server are allowed
+            - Otherwise, the channel is allowed
+
+        DMs have no server, so only the channel lists apply to them
+
+        :param guild_id: The ID of the guild, or `None` for DMs
+        :param channel_id: The ID of the channel
+        :return: `True` if the generator may run in the channel
         """
-        # Throw an error if there's a blacklist AND whitelist for either source
-        if cls.SERVER_BLACKLIST and cls.SERVER_WHITELIST:
-            raise ValueError(f"{cls.__name__} has both a server whitelist and blacklist, which is not allowed")
-        elif cls.CHANNEL_BLACKLIST and cls.CHANNEL_WHITELIST:
-            raise ValueError(f"{cls.__name__} has both a channel whitelist and blacklist, which is not allowed")
-
-        # If there isn't a blacklist or whitelist, message is automatically allowed
-        if not cls.SERVER_BLACKLIST and not cls.SERVER_WHITELIST and \
-                not cls.CHANNEL_BLACKLIST and not cls.CHANNEL_WHITELIST:
+        if channel_id in cls.CHANNEL_BLACKLIST:
             return False
-
-        # The channel is not whitelisted
-        if msg.channel.id not in cls.CHANNEL_WHITELIST:
-            return True
-        # The channel is blacklisted
-        if msg.channel.id in cls.CHANNEL_BLACKLIST:
-            return True
-        # The is server not whitelisted
-        if msg.guild.id not in cls.SERVER_WHITELIST:
-            return True
-        # The is server not blacklisted
-        if msg.guild.id in cls.SERVER_BLACKLIST:
+        if channel_id in cls.CHANNEL_WHITELIST:
             return True
+        if guild_id is not None and guild_id in cls.SERVER_BLACKLIST:
+            return False
+        if cls.SERVER_WHITELIST or cls.CHANNEL_WHITELIST:
+            return guild_id is not None and guild_id in cls.SERVER_WHITELIST
+        return True
 
-        # If no disable condition is met, return message is allowed
-        return False
+    @classmethod
+    def _source_blocked(cls, msg: Message) -> bool:
+        """
+        Checks if the source of the message is blocked by this generator's server and channel lists
+
+        :param msg: The message to check
+        :return: Returns `True` if the message is from a disabled source
+        """
+        guild_id = msg.guild.id if msg.guild is not None else None
+        return not ROUTING_TABLE.allows(cls, guild_id, msg.channel.id)
 
     @classmethod
-    async def run(cls, msg: Message):
+    async def run(cls, msg: Message, matches: [Match] = None):
         """
         Parses a Message for certain text patterns that can be unfurled into embeds. These
         embeds are then generated and posted as replies to the original message. If the message
@@ -159,73 +310,128 @@ class BaseGenerator:
         will happen.
 
         :param msg: The discord.Message object this Generator is extracting data from
+        :param matches: The matches of this generator's `TRIGGER_PATTERN` in the message, if they
+            have already been found by the TriggerScanner. If `None`, the message is scanned here
         """
+        labels = (cls.__name__, metrics.guild_label(msg.guild))
         try:
             # Ignore if message location blacklisted or not whitelisted
             if cls._source_blocked(msg):
                 return
 
+            # Find this generator's pattern in the message if the scanner hasn't already
+            if matches is None:
+                matches = TRIGGER_SCANNER.scan_for(cls, msg.content)
+            if not matches:
+                return
+
             # Parse triggers from message
+            start = time.perf_counter()
             try:
-                triggers = await cls.extract(msg)
+                triggers = await cls.extract(msg, matches)
             except Exception as e:
+                metrics.GENERATOR_FAILURES.inc(*labels)
                 await utils.report(str(e), f"{cls.__name__} failed to parse message", msg)
                 return
+            finally:
+                metrics.EXTRACT_SECONDS.observe(time.perf_counter() - start, *labels)
 
             # Escape if None or empty
             if not triggers:
                 return
 
             # Deduplicate
-            triggers = {trig for trig in triggers}
+            triggers = list(dict.fromkeys(triggers))
+            metrics.TRIGGERS_SEEN.inc(*labels, amount=len(triggers))
 
             # Ignore recent triggers if enabled
             if RECENT_EMBED_TRIGGER_FILTER_ENABLED and cls.GENERATOR_ALLOWS_REPEATS:
-                c_id = msg.channel.id
-                triggers = [t for t in triggers if not await cls.recently_seen(t, c_id)]
-            else:
-                triggers = list(triggers)
+                seen_count = len(triggers)
+                triggers = await cls.filter_recent(triggers, msg.channel.id)
+                if len(triggers) < seen_count:
+                    metrics.TRIGGERS_SUPPRESSED.inc(*labels, amount=seen_count - len(triggers))
 
             # Unfurl triggers
+            start = time.perf_counter()
             try:
-                embed_list = await cls.unfurl(triggers, msg)
+                embed_list = await cls.unfurl_cached(triggers, msg)
             except Exception as e:
+                metrics.GENERATOR_FAILURES.inc(*labels)
                 await utils.report(str(e), f"{cls.__name__} failed to unfurl message", msg)
                 return
+            finally:
+                metrics.UNFURL_SECONDS.observe(time.perf_counter() - start, *labels)
+            metrics.REPLIES_UNFURLED.inc(*labels, amount=len(embed_list))
 
             # Post embeds
-            unfurl_ids = []
-            for reply in embed_list:
-                try:
-                    if isinstance(reply, Embed):
-                        unfurl = await msg.reply(embed=reply)
-                    else:
-                        unfurl = await msg.reply(str(reply))
-                    await unfurl.add_reaction(DELETE_EMOJI)
-                    await unfurl.add_reaction(REPORT_EMOJI)
-                    await unfurl.add_reaction(HEART_EMOJI)
-                    unfurl_ids.append(unfurl.id)
-                    # Record unfurled message triggering author as unfurl_message_id: author_id
-                    unfurl_message_key = f"{UNFURL_PREFIX}{unfurl.id}"
-                    REDIS_CLIENT.set(unfurl_message_key, msg.author.id, UNFURLED_CLEANUP_TRACKING)
-                except Exception as e:
-                    await utils.report(str(e), f"{cls.__name__} failed to reply with embed for message", msg)
-                    return
-
-            # If no triggers were unfurled, the message's cleanup entry doesn't need to be updated
-            if len(unfurl_ids) == 0:
-                return
-
-            # Record unfurled message triggering message as trigger_message_id: [unfurl_message_id, ...]
-            trig_message_key = f"{TRIGGER_PREFIX}{msg.id}"
-            # Check if message has other associated unfurls, and if so, append them to the new list
-            trig_message_value = REDIS_CLIENT.get(trig_message_key)
-            if trig_message_value:
-                unfurl_ids += json.loads(trig_message_value)
-            REDIS_CLIENT.set(trig_message_key, json.dumps(unfurl_ids), UNFURLED_CLEANUP_TRACKING)
+            if embed_list:
+                start = time.perf_counter()
+                await cls.post_replies(embed_list, msg)
+                metrics.POST_SECONDS.observe(time.perf_counter() - start, *labels)
         except Exception as e:
+            metrics.GENERATOR_FAILURES.inc(*labels)
             await utils.report(str(e), f"run() in `{cls.__name__}`", msg)
 
+    @classmethod
+    async def post_replies(cls, replies: list, msg: Message) -> None:
+        """
+        Posts a list of responses as replies to a message, in order. Each run of consecutive embeds
+        is packed together into as few messages as Discord allows, and the interaction reactions are
+        added to every reply at once. The replies are then recorded for cleanup in a single pipelined
+        round trip to redis
+
+        :param replies: The list of Embeds and strings to post
+        :param msg: The message to reply to
+        """
+        unfurls = []
+        try:
+            for are_embeds, run in itertools.groupby(replies, lambda reply: isinstance(reply, Embed)):
+                if not are_embeds:
+                    for reply in run:
+                        unfurls.append(await msg.reply(str(reply)))
+                    continue
+                for batch in pack_embeds(list(run)):
+                    if len(batch) == 1:
+                        unfurls.append(await msg.reply(embed=batch[0]))
+                    else:
+                        unfurls.append(await utils.reply_with_embeds(msg, batch))
+        except Exception as e:
+            metrics.GENERATOR_FAILURES.inc(cls.__name__, metrics.guild_label(msg.guild))
+            await utils.report(str(e), f"{cls.__name__} failed to reply with embed for message", msg)
+
+        # If no triggers were unfurled, the message's cleanup entry doesn't need to be updated
+        if not unfurls:
+            return
+
+        # Each unfurl's reactions are added in order, so they always appear the same way,
+        # but the unfurls are seeded concurrently
+        async def seed_reactions(unfurl: Message) -> None:
+            for emoji in (DELETE_EMOJI, REPORT_EMOJI, HEART_EMOJI):
+                await unfurl.add_reaction(emoji)
+
+        reactions = await asyncio.gather(*[seed_reactions(unfurl) for unfurl in unfurls], return_exceptions=True)
+
+        # Record each unfurl's triggering author as unfurl_message_id: author_id
+        # and the triggering message as trigger_message_id: [unfurl_message_id, ...]
+        trig_message_key = f"{TRIGGER_PREFIX}{msg.id}"
+        pipe = redisconnection.get_client().pipeline(transaction=False)
+        for unfurl in unfurls:
+            pipe.set(f"{UNFURL_PREFIX}{unfurl.id}", msg.author.id, UNFURLED_CLEANUP_TRACKING)
+        pipe.rpush(trig_message_key, *[unfurl.id for unfurl in unfurls])
+        pipe.expire(trig_message_key, UNFURLED_CLEANUP_TRACKING)
+        results = await pipe.execute(raise_on_error=False)
+        pushed = results[len(unfurls)]
+        if isinstance(pushed, ResponseError) and str(pushed).startswith("WRONGTYPE"):
+            # The trigger was recorded by an older version, as a JSON string
+            await _convert_legacy_trigger(trig_message_key, [unfurl.id for unfurl in unfurls])
+        errors = [result for result in results if isinstance(result, Exception) and result is not pushed]
+        if errors:
+            raise errors[0]
+
+        failures = [result for result in reactions if isinstance(result, Exception)]
+        if failures:
+            await utils.report(str(failures[0]), f"{cls.__name__} failed to add reactions to unfurl", msg)
+
     @classmethod
     async def store_data(cls, key: str, data, expiration: int = None):
         """
@@ -237,7 +443,7 @@ class BaseGenerator:
             Defaults to `None`, which means it will never expire
         """
         data_key = f"{cls._get_data_prefix()}{key}"
-        REDIS_CLIENT.set(data_key, json.dumps(data), ex=expiration)
+        await redisconnection.get_client().set(data_key, json.dumps(data), ex=expiration)
 
     @classmethod
     async def load_data(cls, key: str):
@@ -248,36 +454,129 @@ class BaseGenerator:
         :param key: The key the data was stored under. If key could not be found, returns `None`
         """
         data_key = f"{cls._get_data_prefix()}{key}"
-        data = REDIS_CLIENT.get(data_key)
+        data = await redisconnection.get_client().get(data_key)
         return data if data is None else json.loads(data)
 
 
+def pack_embeds(embeds: [Embed]) -> [[Embed]]:
+    """
+    Splits a list of embeds into batches which can each be sent in a single message, staying
+    within Discord's limits on the number of embeds and their combined length
+
+    :param embeds: The embeds to pack
+    :return: A list of batches of embeds, in their original order
+    """
+    batches = []
+    batch_length = 0
+    for embed in embeds:
+        if not batches or len(batches[-1]) >= MAX_EMBEDS_PER_MESSAGE or \
+                batch_length + len(embed) > MAX_EMBED_LENGTH_PER_MESSAGE:
+            batches.append([])
+            batch_length = 0
+        batches[-1].append(embed)
+        batch_length += len(embed)
+    return batches
+
+
+async def get_tracked_unfurls(trigger_id: int) -> [int]:
+    """
+    Gets the IDs of the unfurls posted in reply to a trigger message
+
+    :param trigger_id: The ID of the trigger message
+    :return: The list of unfurl message IDs, which is empty if none were recorded
+    """
+    redis_client = redisconnection.get_client()
+    trigger_key = f"{TRIGGER_PREFIX}{trigger_id}"
+    # Triggers recorded before unfurls were tracked in a list are stored as a JSON string
+    if await redis_client.type(trigger_key) == "string":
+        return [int(unfurl) for unfurl in json.loads(await redis_client.get(trigger_key))]
+    return [int(unfurl) for unfurl in await redis_client.lrange(trigger_key, 0, -1)]
+
+
+async def _convert_legacy_trigger(trigger_key: str, unfurl_ids: [int]) -> None:
+    """
+    Rewrites a trigger's unfurls, recorded as a JSON string by older versions, as a list, and adds
+    new unfurls to it. The key is watched, so unfurls recorded for the trigger in the meantime aren't lost
+
+    :param trigger_key: The trigger message's redis key
+    :param unfurl_ids: The IDs of the new unfurls
+    """
+    async with redisconnection.get_client().pipeline(transaction=True) as pipe:
+        while True:
+            await pipe.watch(trigger_key)
+            legacy = await pipe.get(trigger_key) if await pipe.type(trigger_key) == "string" else None
+            pipe.multi()
+            if legacy is not None:
+                pipe.delete(trigger_key)
+                pipe.rpush(trigger_key, *json.loads(legacy))
+            pipe.rpush(trigger_key, *unfurl_ids)
+            pipe.expire(trigger_key, UNFURLED_CLEANUP_TRACKING)
+            try:
+                await pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
 async def process_trigger_delete(msg: Message):
     """
     When another user's message is deleted, this method checks if that message was a trigger
-    for any unfurls. If it was, the unfurl is deleted as well
+    for any unfurls. If it was, the unfurls are deleted as well
+
+    Unfurls are deleted by ID without being fetched first. Several unfurls are removed with a
+    single bulk delete if the bot is allowed to, and one alert summarizing the cleanup is sent
     :param msg: The message that was deleted
     """
-    trigger_key = f"{TRIGGER_PREFIX}{msg.id}"
-    unfurl_messages = REDIS_CLIENT.get(trigger_key)
-    if unfurl_messages is None:
+    unfurl_ids = await get_tracked_unfurls(msg.id)
+    if not unfurl_ids:
         return
-    unfurl_messages = json.loads(unfurl_messages)   # Convert to list
-    for unfurl in unfurl_messages:
+
+    failures = await _delete_unfurls(msg.channel, unfurl_ids)
+
+    # Nothing left to clean up, so stop tracking the trigger and its unfurls
+    pipe = redisconnection.get_client().pipeline(transaction=False)
+    pipe.delete(f"{TRIGGER_PREFIX}{msg.id}", *[f"{UNFURL_PREFIX}{unfurl_id}" for unfurl_id in unfurl_ids])
+    await pipe.execute()
+
+    deleted = len(unfurl_ids) - len(failures)
+    location = "a DM" if isinstance(msg.channel, PrivateChannel) else \
+        f"guild `{msg.guild.name}` on channel `#{msg.channel.name}`"
+    if deleted:
+        await utils.flag(alert="Unfurl deleted" if deleted == 1 else f"{deleted} unfurls deleted",
+                         description=f"User `{msg.author.name}` deleted a trigger in {location} "
+                                     f"sent at `{msg.created_at}`",
+                         message=msg)
+    if failures:
+        failure_list = "\n".join(f"`{unfurl_id}`: {error}" for unfurl_id, error in failures.items())
+        await utils.flag(alert="Failed to delete unfurls",
+                         description=f"When the specified message was deleted, these unfurls "
+                                     f"failed to delete:\n{failure_list}",
+                         message=msg)
+
+
+async def _delete_unfurls(channel, unfurl_ids: [int]) -> dict:
+    """
+    Deletes unfurls by ID. If there are several and the bot can manage messages in the channel,
+    they are deleted with a single bulk delete. Otherwise, or if the bulk delete is refused,
+    they are deleted individually and concurrently. Unfurls which were already deleted are
+    treated as deleted
+
+    :param channel: The channel the unfurls were posted in
+    :param unfurl_ids: The IDs of the unfurl messages
+    :return: A dictionary mapping the ID of each unfurl which could not be deleted to the error
+    """
+    unfurls = [channel.get_partial_message(unfurl_id) for unfurl_id in unfurl_ids]
+    if len(unfurls) > 1 and not isinstance(channel, PrivateChannel) and \
+            channel.permissions_for(channel.guild.me).manage_messages:
         try:
-            unfurl_message = await utils.get_message(msg.channel.id, int(unfurl))
-            await unfurl_message.delete()
-            await utils.flag(alert="Unfurl deleted",
-                             description=f"User `{msg.author.name}` deleted an unfurl in guild `{msg.guild.name}` "
-                                         f"on channel `#{msg.channel.name}` at `{msg.created_at}`",
-                             message=msg)
-        except NotFound:
-            pass    # Unfurl was probably already deleted
-        except Exception as e:
-            await utils.flag(alert="Failed to deleted unfurl",
-                             description=f"When the specified message was deleted, the unfurl `{unfurl}` "
-                                         f"failed to delete with the following error:\n```{str(e)}```",
-                             message=msg)
+            await channel.delete_messages(unfurls)
+            return {}
+        except HTTPException:
+            pass    # Bulk deletes are refused if any message is already gone, so fall back to deleting each
+
+    results = await asyncio.gather(*[unfurl.delete() for unfurl in unfurls], return_exceptions=True)
+    return {unfurl.id: str(result) for unfurl, result in zip(unfurls, results)
+            if isinstance(result, Exception) and not isinstance(result, NotFound)}
 
 
 async def process_delete_reaction(reaction: Reaction, user: User):
@@ -298,7 +597,7 @@ async def process_delete_reaction(reaction: Reaction, user: User):
 
         # Get trigger author id
         unfurl_message_key = f"{UNFURL_PREFIX}{reaction.message.id}"
-        trigger_author_id = REDIS_CLIENT.get(unfurl_message_key)
+        trigger_author_id = await redisconnection.get_client().get(unfurl_message_key)
         if trigger_author_id:   # Make sure ID is the right type
             trigger_author_id = int(trigger_author_id)
 
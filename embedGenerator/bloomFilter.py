@@ -0,0 +1,146 @@
+import math
+import struct
+import time
+
+
+class BloomFilter:
+    """
+    A fixed-size Bloom filter over byte strings which are already well-distributed hashes
+    (such as the link digests used by DuplicateLinkAlertGenerator).
+
+    `might_contain()` never returns `False` for an item that was added, but may return `True`
+    for one that wasn't. The chance of that grows with the number of items added
+    """
+
+    HEADER = struct.Struct(">dII")  # Creation time, item count, bit array length in bytes
+
+    def __init__(self, capacity: int, error_rate: float, created: float = None):
+        """
+        :param capacity: The number of items the filter is sized for
+        :param error_rate: The false positive rate the filter should have once `capacity` items are added
+        :param created: When the filter was created, as a unix timestamp. Defaults to now
+        """
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.created = time.time() if created is None else created
+        self.count = 0
+        self._bits = bytearray(-(-self.bit_count // 8))
+
+    def add(self, item: bytes) -> None:
+        """ Adds an item to the filter """
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def might_contain(self, item: bytes) -> bool:
+        """ Checks if an item may have been added. `False` means it definitely was not """
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def false_positive_rate(self) -> float:
+        """ Estimates the current chance that `might_contain()` returns `True` for an item that wasn't added """
+        return (1 - math.exp(-self.hash_count * self.count / self.bit_count)) ** self.hash_count
+
+    def size_in_bytes(self) -> int:
+        """ The memory used by the filter's bit array """
+        return len(self._bits)
+
+    def to_bytes(self) -> bytes:
+        """ Serializes the filter """
+        return self.HEADER.pack(self.created, self.count, len(self._bits)) + bytes(self._bits)
+
+    def load_bytes(self, data: bytes) -> int:
+        """
+        Loads the contents of a serialized filter with the same capacity and error rate into this one
+
+        :param data: The serialized data, which may be followed by other data
+        :return: The number of bytes that were read
+        """
+        created, count, length = self.HEADER.unpack_from(data)
+        if length != len(self._bits):
+            raise ValueError("Serialized Bloom filter does not match this filter's size")
+        start = self.HEADER.size
+        self.created = created
+        self.count = count
+        self._bits = bytearray(data[start:start + length])
+        return start + length
+
+    def _positions(self, item: bytes):
+        """ Derives the filter's bit positions for an item by double hashing its bytes """
+        first = int.from_bytes(item[:6], "big")
+        second = int.from_bytes(item[-6:], "big") | 1
+        return [(first + index * second) % self.bit_count for index in range(self.hash_count)]
+
+
+class RotatingBloomFilter:
+    """
+    A Bloom filter which forgets old items by keeping a fixed number of generations.
+
+    Items are added to the newest generation. Once it is `generation_seconds` old, a new
+    generation is started and the oldest one is dropped. An item is reported as possibly
+    present if any generation might contain it, so every item is remembered for at least
+    `generation_seconds * (generations - 1)` seconds
+    """
+
+    def __init__(self, capacity: int, error_rate: float, generation_seconds: int, generations: int):
+        """
+        :param capacity: The number of items each generation is sized for
+        :param error_rate: The false positive rate of each generation once it is full
+        :param generation_seconds: How long a generation receives new items before a new one is started
+        :param generations: How many generations are kept
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.generation_seconds = generation_seconds
+        self.generation_count = generations
+        self._generations = [BloomFilter(capacity, error_rate)]  # Newest first
+
+    def add(self, item: bytes) -> None:
+        """ Adds an item to the newest generation """
+        self._rotate()
+        self._generations[0].add(item)
+
+    def might_contain(self, item: bytes) -> bool:
+        """ Checks if an item may have been added recently. `False` means it definitely was not """
+        self._rotate()
+        return any(generation.might_contain(item) for generation in self._generations)
+
+    def false_positive_rate(self) -> float:
+        """ Estimates the chance that `might_contain()` returns `True` for an item that wasn't added """
+        miss_rate = 1
+        for generation in self._generations:
+            miss_rate *= 1 - generation.false_positive_rate()
+        return 1 - miss_rate
+
+    def size_in_bytes(self) -> int:
+        """ The memory used by the bit arrays of every generation """
+        return sum(generation.size_in_bytes() for generation in self._generations)
+
+    def __len__(self):
+        return sum(generation.count for generation in self._generations)
+
+    def to_bytes(self) -> bytes:
+        """ Serializes every generation """
+        return struct.pack(">I", len(self._generations)) + \
+            b"".join(generation.to_bytes() for generation in self._generations)
+
+    def load_bytes(self, data: bytes) -> None:
+        """ Replaces this filter's generations with those of a serialized filter of the same configuration """
+        (count,), offset = struct.unpack_from(">I", data), 4
+        generations = []
+        for _ in range(count):
+            generation = BloomFilter(self.capacity, self.error_rate)
+            offset += generation.load_bytes(data[offset:])
+            generations.append(generation)
+        self._generations = generations or [BloomFilter(self.capacity, self.error_rate)]
+        self._rotate()
+
+    def _rotate(self) -> None:
+        """ Starts new generations and drops old ones until the newest generation is current """
+        now = time.time()
+        while now - self._generations[0].created >= self.generation_seconds:
+            created = self._generations[0].created + self.generation_seconds
+            if now - created >= self.generation_seconds * self.generation_count:
+                created = now  # Everything is stale, so skip straight to a fresh generation
+                self._generations = []
+            self._generations.insert(0, BloomFilter(self.capacity, self.error_rate, created=created))
+            del self._generations[self.generation_count:]
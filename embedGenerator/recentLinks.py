@@ -0,0 +1,131 @@
+from collections import deque, OrderedDict
+import time
+from typing import Optional
+
+from discord import Message
+
+from parse import URL_REGEX, canonical_url
+
+# How many of each channel's most recent messages are remembered
+MESSAGES_PER_CHANNEL = 100
+
+# How many channels are tracked before the one which has been idle the longest is forgotten
+MAX_CHANNELS = 1000
+
+
+class ChannelLinks:
+    """
+    The links posted in a channel's most recent messages.
+
+    Messages are kept in a ring buffer, and each link maps to the sequence number and time of
+    the latest message containing it, so checking for a link doesn't depend on how many
+    messages are remembered. When a message falls out of the buffer, any link whose latest
+    appearance was in that message is forgotten
+    """
+
+    def __init__(self, max_messages: int = MESSAGES_PER_CHANNEL):
+        """
+        :param max_messages: The number of recent messages to remember
+        """
+        self.max_messages = max_messages
+        self.message_count = 0  # Sequence number of the next message
+        self._messages = deque()  # (Sequence number, links) of each remembered message, oldest first
+        self._links = {}  # Maps link -> (sequence number, time) of the latest message it was in
+
+    def add(self, links: [str], timestamp: float) -> None:
+        """ Records the links found in the channel's newest message """
+        sequence = self.message_count
+        self.message_count += 1
+        self._messages.append((sequence, links))
+        for link in links:
+            self._links[link] = (sequence, timestamp)
+
+        while len(self._messages) > self.max_messages:
+            old_sequence, old_links = self._messages.popleft()
+            for link in old_links:
+                if self._links.get(link, (None,))[0] == old_sequence:
+                    del self._links[link]
+
+    def last_seen(self, link: str) -> Optional[tuple]:
+        """
+        Finds when a link was last posted in the channel
+
+        :param link: The canonicalized link
+        :return: How many messages ago and how many seconds ago it was posted, or `None` if it wasn't recently
+        """
+        seen = self._links.get(link)
+        if seen is None:
+            return None
+        sequence, timestamp = seen
+        return self.message_count - 1 - sequence, time.time() - timestamp
+
+
+class RecentLinkIndex:
+    """
+    A bounded, in-process index of the links recently posted in each channel, fed by every
+    message the bot receives. It lets generators check whether something was already posted
+    in a channel without paging through the channel's history through the Discord API.
+
+    Channels are kept in least recently used order, and the channel which has gone the
+    longest without a message is forgotten once too many are tracked
+    """
+
+    def __init__(self, max_channels: int = MAX_CHANNELS, messages_per_channel: int = MESSAGES_PER_CHANNEL):
+        """
+        :param max_channels: The number of channels which are tracked at once
+        :param messages_per_channel: The number of recent messages remembered in each channel
+        """
+        self.max_channels = max_channels
+        self.messages_per_channel = messages_per_channel
+        self._channels = OrderedDict()  # Maps channel ID -> ChannelLinks
+
+    def record(self, message: Message) -> None:
+        """ Records the links in a message which was just posted """
+        channel_links = self._channels.get(message.channel.id)
+        if channel_links is None:
+            channel_links = self._channels[message.channel.id] = ChannelLinks(self.messages_per_channel)
+            while len(self._channels) > self.max_channels:
+                self._channels.popitem(last=False)
+        else:
+            self._channels.move_to_end(message.channel.id)
+
+        links = []
+        if message.content and "://" in message.content:
+            for match in URL_REGEX.finditer(message.content):
+                link = canonical_url(match.group(0))
+                links.append(link)
+                # Also index it without its query, so looking up a bare link matches it like a prefix would
+                if "?" in link:
+                    links.append(link[:link.find("?")])
+        channel_links.add(list(dict.fromkeys(links)), message.created_at.timestamp())
+
+    def posted_recently(self, channel_id: int, link: str, messages: int = None, seconds: float = None) -> bool:
+        """
+        Checks if a link was posted in a channel recently. A link without a query also matches
+        the same link posted with one, but a link with a query only matches that exact query
+
+        :param channel_id: The ID of the channel
+        :param link: The link to look for. It is canonicalized the same way recorded links are
+        :param messages: (Optional) Only match the link if it was in one of this many most recent messages
+        :param seconds: (Optional) Only match the link if it was posted within this many seconds
+        :return: `True` if the link was posted within both limits
+        """
+        channel_links = self._channels.get(channel_id)
+        if channel_links is None:
+            return False
+        seen = channel_links.last_seen(canonical_url(link))
+        if seen is None:
+            return False
+        messages_ago, seconds_ago = seen
+        return (messages is None or messages_ago < messages) and (seconds is None or seconds_ago <= seconds)
+
+    def clear(self) -> None:
+        """ Drops everything recorded for every channel """
+        self._channels.clear()
+
+    def __len__(self):
+        return len(self._channels)
+
+
+# The recent link index shared by every generator
+RECENT_LINKS = RecentLinkIndex()
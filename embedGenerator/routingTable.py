@@ -0,0 +1,83 @@
+from collections import OrderedDict
+from typing import Optional
+
+# How many (guild, channel) routes are kept before the least recently used are evicted
+ROUTING_TABLE_SIZE = 5000
+
+
+class RoutingTable:
+    """
+    Caches which EmbedGenerators are active in each channel.
+
+    Whether a generator runs somewhere depends only on its server and channel lists, so the
+    answer is worked out once per (guild, channel) and reused for every later message there.
+    Routes are dropped whenever a generator is registered or its lists change. Generators keep
+    their lists as `SourceList`s, which tell the table when they're changed
+    """
+
+    def __init__(self, max_entries: int = ROUTING_TABLE_SIZE):
+        """
+        :param max_entries: The number of (guild, channel) routes the table can hold
+        """
+        self.max_entries = max_entries
+        self._generators = []  # Every registered generator, in registration order
+        self._routes = OrderedDict()  # Maps (guild ID, channel ID) -> tuple of active generators
+
+    def register(self, generator) -> None:
+        """ Adds a generator to the table """
+        if generator not in self._generators:
+            self._generators.append(generator)
+        self.invalidate()
+
+    def generators_for(self, guild_id: Optional[int], channel_id: int) -> tuple:
+        """
+        Gets the generators which are active in a channel
+
+        :param guild_id: The ID of the guild, or `None` for DMs
+        :param channel_id: The ID of the channel
+        :return: The active generators, in registration order
+        """
+        key = (guild_id, channel_id)
+        route = self._routes.get(key)
+        if route is not None:
+            self._routes.move_to_end(key)
+            return route
+
+        route = tuple(generator for generator in self._generators if generator.source_allowed(guild_id, channel_id))
+        self._routes[key] = route
+        while len(self._routes) > self.max_entries:
+            self._routes.popitem(last=False)
+        return route
+
+    def allows(self, generator, guild_id: Optional[int], channel_id: int) -> bool:
+        """ Checks if a generator is active in a channel """
+        return generator in self.generators_for(guild_id, channel_id)
+
+    def invalidate(self) -> None:
+        """ Drops every cached route, so they are worked out again from the generators' current lists """
+        self._routes.clear()
+
+
+class SourceList(list):
+    """ A generator's server or channel list, which drops the cached routes whenever it's changed """
+
+
+def _invalidating(name: str):
+    """ Wraps a list method so the cached routes are dropped after it runs """
+    method = getattr(list, name)
+
+    def changed(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        ROUTING_TABLE.invalidate()
+        return result
+    changed.__name__ = name
+    return changed
+
+
+for _name in ("__setitem__", "__delitem__", "__iadd__", "__imul__",
+              "append", "extend", "insert", "remove", "pop", "clear"):
+    setattr(SourceList, _name, _invalidating(_name))
+
+
+# The routing table every generator registers with
+ROUTING_TABLE = RoutingTable()
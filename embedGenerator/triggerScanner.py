@@ -0,0 +1,89 @@
+
+class TriggerScanner:
+    """
+    Finds the triggers for every registered EmbedGenerator in a single scan of a message.
+
+    Each generator registers a compiled pattern along with a handful of "hints", substrings
+    which must appear in a message for the pattern to possibly match. Scanning happens in
+    three stages, each cheaper than the next:
+        1. A single substring check for a character shared by every hint. Most chat messages
+           contain no URL at all and are rejected here without any regex running
+        2. A substring check of each generator's hints
+        3. The generator's regex, run only if one of its hints was found
+
+    Generators are then handed only the matches of their own pattern
+    """
+
+    def __init__(self):
+        self._generators = {}  # Maps generator -> (pattern, hints)
+        self._gate = None  # A character present in every hint, if one exists
+
+    def register(self, generator, pattern, hints):
+        """
+        Registers a generator's trigger pattern with the scanner
+
+        :param generator: The generator class the pattern belongs to
+        :param pattern: The compiled regex that matches the generator's triggers
+        :param hints: A tuple of substrings, at least one of which appears in every match of `pattern`
+        """
+        if not hints:
+            raise ValueError(f"{generator.__name__} must provide at least one trigger hint")
+        self._generators[generator] = (pattern, tuple(hints))
+        self._gate = self._find_gate()
+
+    def scan(self, content: str, generators=None) -> dict:
+        """
+        Scans the contents of a message for the triggers of every registered generator
+
+        :param content: The text of the message
+        :param generators: (Optional) Only scan for the triggers of these generators
+        :return: A dictionary mapping each generator with at least one match to its list of `re.Match` objects
+        """
+        if not content or (self._gate is not None and self._gate not in content):
+            return {}
+        if generators is None:
+            generators = self._generators
+        found = {}
+        for generator in generators:
+            entry = self._generators.get(generator)
+            if entry is None:
+                continue
+            matches = self._scan_pattern(content, *entry)
+            if matches:
+                found[generator] = matches
+        return found
+
+    def scan_for(self, generator, content: str) -> list:
+        """
+        Scans the contents of a message for the triggers of a single generator
+
+        :param generator: The registered generator class
+        :param content: The text of the message
+        :return: The list of `re.Match` objects for that generator's pattern
+        """
+        if not content or generator not in self._generators:
+            return []
+        pattern, hints = self._generators[generator]
+        return self._scan_pattern(content, pattern, hints)
+
+    @staticmethod
+    def _scan_pattern(content: str, pattern, hints) -> list:
+        """ Runs a pattern on the content, but only if one of its hints is present """
+        for hint in hints:
+            if hint in content:
+                return list(pattern.finditer(content))
+        return []
+
+    def _find_gate(self):
+        """ Finds a single character that is shared by every hint of every generator, preferring '/' """
+        shared = None
+        for _, hints in self._generators.values():
+            for hint in hints:
+                shared = set(hint) if shared is None else shared & set(hint)
+        if not shared:
+            return None
+        return "/" if "/" in shared else sorted(shared)[0]
+
+
+# The scanner every generator registers its pattern with
+TRIGGER_SCANNER = TriggerScanner()
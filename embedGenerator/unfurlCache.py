@@ -0,0 +1,119 @@
+from collections import OrderedDict
+import json
+import time
+
+from discord import Embed
+
+import redisconnection
+
+# How many results are kept in the in-process tier before the least recently used are evicted
+LOCAL_CACHE_SIZE = 500
+
+# How many seconds a trigger which produced no replies is cached for. This is kept short
+# since an empty result can also mean the source was temporarily unavailable
+EMPTY_RESULT_TTL = 60
+
+
+class UnfurlCache:
+    """
+    A two-tier cache of the replies a generator produced for a trigger, so that the same
+    post or tweet linked in several channels or guilds is only fetched and built once.
+
+    The first tier is an in-process LRU. The second is redis, which outlives restarts and
+    is shared by every bot process. Replies are stored serialized (Embeds as their dict
+    form, text replies as strings), and fresh objects are built on every hit so that
+    callers are free to modify them
+    """
+
+    def __init__(self, max_entries: int = LOCAL_CACHE_SIZE):
+        """
+        :param max_entries: The number of results the in-process tier can hold
+        """
+        self.max_entries = max_entries
+        self._local = OrderedDict()  # Maps cache key -> (expiry time, serialized replies)
+
+    async def get_many(self, generator, triggers: [str]) -> dict:
+        """
+        Looks up the cached replies for a list of normalized triggers. Anything missing from the
+        in-process tier is looked up in redis in a single round trip
+
+        :param generator: The generator class the replies belong to
+        :param triggers: The normalized triggers
+        :return: A dictionary mapping each trigger that was found to its list of replies
+        """
+        found = {}
+        missing = []
+        now = time.monotonic()
+        for trigger in triggers:
+            key = self._get_key(generator, trigger)
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(key)
+                found[trigger] = self._deserialize(entry[1])
+            else:
+                self._local.pop(key, None)
+                missing.append(trigger)
+
+        if missing:
+            redis_client = redisconnection.get_client()
+            keys = [self._get_key(generator, trigger) for trigger in missing]
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+                pipe.ttl(key)
+            results = await pipe.execute()
+            for index, (trigger, key) in enumerate(zip(missing, keys)):
+                payload, ttl = results[2 * index], results[2 * index + 1]
+                if payload is None:
+                    continue
+                self._store_local(key, payload, ttl if ttl > 0 else EMPTY_RESULT_TTL)
+                found[trigger] = self._deserialize(payload)
+        return found
+
+    async def put(self, generator, trigger: str, replies: list, ttl: int) -> None:
+        """
+        Caches the replies a generator produced for a trigger in both tiers
+
+        :param generator: The generator class the replies belong to
+        :param trigger: The normalized trigger
+        :param replies: The list of Embeds and strings produced for the trigger
+        :param ttl: How many seconds the replies should be cached for
+        """
+        if not replies:
+            ttl = min(ttl, EMPTY_RESULT_TTL)
+        key = self._get_key(generator, trigger)
+        payload = self._serialize(replies)
+        self._store_local(key, payload, ttl)
+        await redisconnection.get_client().set(key, payload, ex=ttl)
+
+    def clear(self) -> None:
+        """ Empties the in-process tier """
+        self._local.clear()
+
+    def _store_local(self, key: str, payload: str, ttl: int) -> None:
+        """ Stores a serialized result in the in-process tier, evicting the oldest entries if it is full """
+        self._local[key] = (time.monotonic() + ttl, payload)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    @staticmethod
+    def _get_key(generator, trigger: str) -> str:
+        """ Gets the redis key a generator's result for a trigger is cached under """
+        return f"EG-{generator.__name__}-UNFURL-CACHE-{trigger}"
+
+    @staticmethod
+    def _serialize(replies: list) -> str:
+        """ Converts a list of replies to JSON """
+        return json.dumps([{"embed": reply.to_dict()} if isinstance(reply, Embed) else {"text": str(reply)}
+                           for reply in replies])
+
+    @staticmethod
+    def _deserialize(payload: str) -> list:
+        """ Rebuilds a list of replies from JSON """
+        return [Embed.from_dict(reply["embed"]) if "embed" in reply else reply["text"]
+                for reply in json.loads(payload)]
+
+
+# The unfurl cache shared by every generator
+UNFURL_CACHE = UnfurlCache()
@@ -0,0 +1,377 @@
+import asyncio
+from collections import OrderedDict
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+
+from config import *
+
+"""
+HTTP Cache
+
+A private HTTP cache for the JSON the bot fetches with `utils.get_json_with_get`. Responses
+are kept for as long as their `Cache-Control` (or `Expires`) header allows, and are served
+without a request while they are fresh. Once stale, a response with an `ETag` or
+`Last-Modified` validator is revalidated with a conditional request, and a 304 Not Modified
+answer makes it fresh again without downloading or parsing the body. Entries live in a
+pluggable store, either an in-memory LRU with a byte budget or a directory on disk
+"""
+
+# How long a response without any freshness information, but with a `Last-Modified`
+# header, is considered fresh for at most. Within that, it's a tenth of its age (RFC 7234 4.2.2)
+MAX_HEURISTIC_LIFETIME = 24 * 60 * 60
+
+
+class CacheEntry:
+    """ A cached response body, along with what's needed to decide whether it's fresh and revalidate it """
+
+    __slots__ = ("body", "etag", "last_modified", "stored_at", "lifetime", "_value")
+
+    def __init__(self, body: bytes, etag: Optional[str], last_modified: Optional[str],
+                 stored_at: float, lifetime: float, value=None):
+        """
+        :param body: The raw response body
+        :param etag: The response's `ETag` header, if it had one
+        :param last_modified: The response's `Last-Modified` header, if it had one
+        :param stored_at: When the response was generated, as a UNIX timestamp
+        :param lifetime: How many seconds after `stored_at` the response stays fresh for
+        :param value: (Optional) The body, already parsed as JSON
+        """
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.lifetime = lifetime
+        self._value = value
+
+    @property
+    def value(self):
+        """ The body parsed as JSON. It's parsed once and shared, so it must not be modified """
+        if self._value is None:
+            self._value = json.loads(self.body)
+        return self._value
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.stored_at + self.lifetime
+
+    def has_validators(self) -> bool:
+        return self.etag is not None or self.last_modified is not None
+
+    def validators(self) -> dict:
+        """ The headers which make a request conditional on the response having changed """
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def size_in_bytes(self) -> int:
+        """ The size of the entry, counted by its body. The parsed value isn't included """
+        return len(self.body) + len(self.etag or "") + len(self.last_modified or "")
+
+    def to_bytes(self) -> bytes:
+        """ Serializes the entry as a line of JSON metadata followed by the body """
+        metadata = {"etag": self.etag, "last_modified": self.last_modified,
+                    "stored_at": self.stored_at, "lifetime": self.lifetime}
+        return json.dumps(metadata).encode("utf-8") + b"\n" + self.body
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CacheEntry":
+        """ Restores an entry serialized by `to_bytes()` """
+        metadata, body = data.split(b"\n", 1)
+        metadata = json.loads(metadata)
+        return cls(body, metadata["etag"], metadata["last_modified"], metadata["stored_at"], metadata["lifetime"])
+
+
+# ------------------------------------------------------------------------ Stores
+
+class MemoryStore:
+    """ Keeps entries in memory, evicting the least recently used ones to stay within a byte budget """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0  # The total size of every entry, in bytes
+        self._entries = OrderedDict()  # Maps key -> CacheEntry, least recently used first
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: CacheEntry) -> None:
+        await self.delete(key)
+        if entry.size_in_bytes() > self.max_bytes:
+            return
+        self._entries[key] = entry
+        self.size += entry.size_in_bytes()
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.size_in_bytes()
+
+    async def delete(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size_in_bytes()
+
+    async def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+class DiskStore:
+    """
+    Keeps entries as files in a directory, so they survive restarts. Files are read and written
+    in the default executor. When the directory grows past its byte budget, the files which were
+    least recently used are deleted
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0  # The total size of every file, in bytes
+        self._sizes = None  # Maps key -> file size, loaded from the directory on first use
+
+    def __len__(self):
+        return len(self._sizes or {})
+
+    async def get(self, key: str) -> Optional[CacheEntry]:
+        await self._load()
+        if key not in self._sizes:
+            return None
+        try:
+            data = await asyncio.get_event_loop().run_in_executor(None, self._read, key)
+            return CacheEntry.from_bytes(data)
+        except (OSError, ValueError, KeyError):
+            await self.delete(key)
+            return None
+
+    async def set(self, key: str, entry: CacheEntry) -> None:
+        await self._load()
+        data = entry.to_bytes()
+        if len(data) > self.max_bytes:
+            await self.delete(key)
+            return
+        await asyncio.get_event_loop().run_in_executor(None, self._write, key, data)
+        self.size += len(data) - self._sizes.get(key, 0)
+        self._sizes[key] = len(data)
+        if self.size > self.max_bytes:
+            await self._evict()
+
+    async def delete(self, key: str) -> None:
+        await self._load()
+        if key in self._sizes:
+            self.size -= self._sizes.pop(key)
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    async def clear(self) -> None:
+        await self._load()
+        for key in list(self._sizes):
+            await self.delete(key)
+
+    async def _load(self) -> None:
+        """ Finds the entries already in the directory """
+        if self._sizes is None:
+            self._sizes = await asyncio.get_event_loop().run_in_executor(None, self._scan)
+            self.size = sum(self._sizes.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _scan(self) -> dict:
+        os.makedirs(self.directory, exist_ok=True)
+        return {entry.name: entry.stat().st_size for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.endswith(".tmp")}
+
+    def _read(self, key: str) -> bytes:
+        path = self._path(key)
+        with open(path, "rb") as file:
+            data = file.read()
+        os.utime(path)  # Mark the entry as recently used
+        return data
+
+    def _write(self, key: str, data: bytes) -> None:
+        # Written to a temporary file first, so a crash can't leave a partial entry behind
+        temporary_path = self._path(key) + ".tmp"
+        with open(temporary_path, "wb") as file:
+            file.write(data)
+        os.replace(temporary_path, self._path(key))
+
+    async def _evict(self) -> None:
+        """ Deletes the least recently used files until the directory is within its budget """
+        keys = list(self._sizes)
+        modified_times = await asyncio.get_event_loop().run_in_executor(None, self._modified_times, keys)
+        for key in sorted(keys, key=modified_times.get):
+            if self.size <= self.max_bytes:
+                break
+            await self.delete(key)
+
+    def _modified_times(self, keys: [str]) -> dict:
+        times = {}
+        for key in keys:
+            try:
+                times[key] = os.path.getmtime(self._path(key))
+            except OSError:
+                times[key] = 0
+        return times
+
+
+# ------------------------------------------------------------------------ Cache
+
+class HTTPCache:
+    """ Decides which responses can be cached, and for how long, and keeps them in a store """
+
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0  # Requests answered by a fresh entry
+        self.revalidations = 0  # Requests answered by a stale entry after a 304
+        self.misses = 0  # Requests which had to download a response
+
+    async def get(self, key) -> Optional[CacheEntry]:
+        """
+        Looks up the cached response to a request. Entries that are stale and can't be revalidated
+        are dropped, and fresh ones count as hits
+
+        :param key: The request key, as built by `ratelimit.request_key()`
+        """
+        digest = _digest(key)
+        entry = await self.store.get(digest)
+        if entry is not None and not entry.is_fresh() and not entry.has_validators():
+            await self.store.delete(digest)
+            return None
+        if entry is not None and entry.is_fresh():
+            self.hits += 1
+        return entry
+
+    async def put(self, key, headers, body: bytes, value=None, ttl: float = None) -> Optional[CacheEntry]:
+        """
+        Caches a 200 response if its headers allow it
+
+        :param key: The request key, as built by `ratelimit.request_key()`
+        :param headers: The response headers
+        :param body: The response body
+        :param value: (Optional) The body, already parsed
+        :param ttl: (Optional) How many seconds to keep the response fresh for, instead of what its headers say
+        :return: The new entry, or `None` if the response can't be cached
+        """
+        self.misses += 1
+        cache_control = parse_cache_control(headers.get("Cache-Control"))
+        if "no-store" in cache_control or headers.get("Vary") == "*":
+            await self.store.delete(_digest(key))
+            return None
+        entry = CacheEntry(body, headers.get("ETag"), headers.get("Last-Modified"),
+                           _response_time(headers), _lifetime(headers, cache_control, ttl), value)
+        if not entry.is_fresh() and not entry.has_validators():
+            await self.store.delete(_digest(key))
+            return None  # It could never be used
+        await self.store.set(_digest(key), entry)
+        return entry
+
+    async def refresh(self, key, entry: CacheEntry, headers, ttl: float = None) -> CacheEntry:
+        """
+        Makes a stale entry fresh again after the server answered a conditional request with 304
+
+        :param key: The request key, as built by `ratelimit.request_key()`
+        :param entry: The entry which was revalidated
+        :param headers: The headers of the 304 response, which update the entry's
+        :param ttl: (Optional) How many seconds to keep the response fresh for, instead of what its headers say
+        """
+        self.revalidations += 1
+        cache_control = parse_cache_control(headers.get("Cache-Control"))
+        entry.etag = headers.get("ETag", entry.etag)
+        entry.last_modified = headers.get("Last-Modified", entry.last_modified)
+        entry.stored_at = _response_time(headers)
+        entry.lifetime = _lifetime(headers, cache_control, ttl)
+        if "no-store" in cache_control:
+            await self.store.delete(_digest(key))
+        else:
+            await self.store.set(_digest(key), entry)
+        return entry
+
+    def hit_rate(self) -> float:
+        """ The fraction of requests which didn't need to download a response """
+        total = self.hits + self.revalidations + self.misses
+        return (self.hits + self.revalidations) / total if total else 0.0
+
+
+def parse_cache_control(value: Optional[str]) -> dict:
+    """
+    Parses a `Cache-Control` header
+
+    :return: A dictionary mapping lowercase directive -> its argument, or `None` if it had none
+    """
+    directives = {}
+    for directive in (value or "").split(","):
+        name, _, argument = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else None
+    return directives
+
+
+def _lifetime(headers, cache_control: dict, ttl: Optional[float]) -> float:
+    """ Works out how many seconds a response stays fresh for """
+    if ttl is not None:
+        return ttl
+    if "no-cache" in cache_control:
+        return 0
+    if "max-age" in cache_control:
+        try:
+            return max(0, int(cache_control["max-age"]))
+        except ValueError:
+            return 0
+    expires = _parse_date(headers.get("Expires"))
+    if expires is not None:
+        return max(0.0, expires - (_parse_date(headers.get("Date")) or time.time()))
+    last_modified = _parse_date(headers.get("Last-Modified"))
+    if last_modified is not None:
+        return min(MAX_HEURISTIC_LIFETIME, max(0.0, (time.time() - last_modified) / 10))
+    return 0
+
+
+def _response_time(headers) -> float:
+    """ Works out when a response was generated, taking any time it spent in caches along the way into account """
+    try:
+        age = max(0, int(headers.get("Age", 0)))
+    except ValueError:
+        age = 0
+    return time.time() - age
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    """ Converts an HTTP date to a UNIX timestamp """
+    if not value:
+        return None
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return date.timestamp()
+
+
+def _digest(key) -> str:
+    """ Turns a request key into a name that's safe to use as a file name """
+    return hashlib.sha256(repr(key).encode("utf-8")).hexdigest()
+
+
+def build_store():
+    """ Creates the store chosen by `HTTP_CACHE_STORE` in the config """
+    if HTTP_CACHE_STORE == "disk":
+        return DiskStore(HTTP_CACHE_DIR, HTTP_CACHE_MAX_BYTES)
+    return MemoryStore(HTTP_CACHE_MAX_BYTES)
+
+
+# The cache used by `utils.get_json_with_get`
+HTTP_CACHE = HTTPCache(build_store())
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from typing import Optional
+
+from discord import Message
+
+"""
+Message Cache
+
+An in-process cache of recently seen messages, so that looking up a message the bot has
+already received or fetched doesn't cost a request to the Discord API. It is filled from
+the messages the bot receives and from every message fetched through `utils.get_message()`,
+and entries are dropped whenever the gateway reports that a message was edited, deleted,
+or had its reactions changed
+"""
+
+# How many messages are kept before the least recently used are evicted
+MESSAGE_CACHE_SIZE = 2000
+
+
+class MessageCache:
+    """ A bounded LRU of Message objects, keyed by message ID """
+
+    def __init__(self, max_entries: int = MESSAGE_CACHE_SIZE):
+        """
+        :param max_entries: The number of messages the cache can hold
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._messages = OrderedDict()  # Maps message ID -> Message
+
+    def get(self, message_id: int) -> Optional[Message]:
+        """
+        Looks up a message, counting the lookup as a hit or a miss
+
+        :param message_id: The ID of the message
+        :return: The cached Message, or `None` if it isn't cached
+        """
+        message = self._messages.get(message_id)
+        if message is None:
+            self.misses += 1
+            return None
+        self._messages.move_to_end(message_id)
+        self.hits += 1
+        return message
+
+    def put(self, message: Message) -> None:
+        """ Caches a message, evicting the least recently used messages if the cache is full """
+        self._messages[message.id] = message
+        self._messages.move_to_end(message.id)
+        while len(self._messages) > self.max_entries:
+            self._messages.popitem(last=False)
+
+    def invalidate(self, *message_ids: int) -> None:
+        """ Drops messages from the cache, if they are cached """
+        for message_id in message_ids:
+            self._messages.pop(message_id, None)
+
+    def clear(self) -> None:
+        """ Drops every message and resets the counters """
+        self._messages.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def hit_rate(self) -> float:
+        """ The fraction of lookups which were served from the cache """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._messages)
+
+
+# The message cache shared by the whole bot
+MESSAGE_CACHE = MessageCache()
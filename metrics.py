@@ -0,0 +1,221 @@
+import bisect
+from typing import Optional
+
+from aiohttp import web
+
+from config import *
+
+"""
+Metrics
+
+Counters and latency histograms for the bot's embed generators, kept in process. They can be
+read through `!dev stats`, or scraped by Prometheus from a small HTTP server bound to the
+local machine (see `METRICS_SERVER_ENABLED` in the config)
+"""
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Counter:
+    """ A family of monotonically increasing counts, one for each combination of label values """
+
+    kind = "counter"
+
+    def __init__(self, name: str, description: str, label_names: tuple):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}  # Maps label values -> count
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        """ Adds to the count for a combination of label values """
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def total(self, **labels) -> float:
+        """ Sums the counts of every combination matching the given label values """
+        return sum(value for label_values, value in self.values.items() if _matches(self, label_values, labels))
+
+    def render(self) -> [str]:
+        """ Formats the counter in the Prometheus text format """
+        return [f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+                for label_values, value in sorted(self.values.items())]
+
+
+class Histogram:
+    """ A family of latency distributions, one for each combination of label values """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, label_names: tuple, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        self.values = {}  # Maps label values -> [per bucket counts (the last is +Inf), sum]
+
+    def observe(self, value: float, *label_values) -> None:
+        """ Records a single observation for a combination of label values """
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def summarize(self, **labels) -> Optional[tuple]:
+        """
+        Merges the distributions matching the given label values
+
+        :return: The (count, mean, estimated median, estimated 99th percentile), or `None` if nothing matched
+        """
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for label_values, (bucket_counts, value_sum) in self.values.items():
+            if _matches(self, label_values, labels):
+                counts = [merged + count for merged, count in zip(counts, bucket_counts)]
+                total += value_sum
+        count = sum(counts)
+        if not count:
+            return None
+        return count, total / count, self._quantile(counts, 0.5), self._quantile(counts, 0.99)
+
+    def _quantile(self, counts: [int], quantile: float) -> float:
+        """ Estimates a quantile by interpolating within the bucket it falls in """
+        target = quantile * sum(counts)
+        seen = 0
+        for index, count in enumerate(counts):
+            if count and seen + count >= target:
+                if index == len(self.buckets):
+                    return self.buckets[-1]  # Past the last bucket, the best estimate is its bound
+                lower = self.buckets[index - 1] if index else 0
+                return lower + (self.buckets[index] - lower) * (target - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self) -> [str]:
+        """ Formats the histogram in the Prometheus text format """
+        lines = []
+        for label_values, (bucket_counts, value_sum) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), bucket_counts):
+                cumulative += count
+                labels = _format_labels(self.label_names + ("le",), label_values + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(value_sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+def _matches(metric, label_values: tuple, labels: dict) -> bool:
+    """ Checks if a combination of label values has every given label value """
+    return all(label_values[metric.label_names.index(name)] == value for name, value in labels.items())
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    """ Formats label names and values as a Prometheus label set """
+    if not names:
+        return ""
+    pairs = (f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+def _escape(value) -> str:
+    """ Escapes a label value """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value) -> str:
+    """ Formats a number the way Prometheus expects """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# ------------------------------------------------------------------------ Embed generator metrics
+
+GENERATOR_LABELS = ("generator", "guild")
+
+EXTRACT_SECONDS = Histogram("embed_generator_extract_seconds",
+                            "Time spent extracting triggers from a message", GENERATOR_LABELS)
+UNFURL_SECONDS = Histogram("embed_generator_unfurl_seconds",
+                           "Time spent unfurling the triggers of a message", GENERATOR_LABELS)
+POST_SECONDS = Histogram("embed_generator_post_seconds",
+                         "Time spent posting the replies to a message", GENERATOR_LABELS)
+
+TRIGGERS_SEEN = Counter("embed_generator_triggers_seen_total",
+                        "Unique triggers extracted from messages", GENERATOR_LABELS)
+TRIGGERS_SUPPRESSED = Counter("embed_generator_triggers_suppressed_total",
+                              "Triggers ignored because they were recently unfurled in the channel", GENERATOR_LABELS)
+REPLIES_UNFURLED = Counter("embed_generator_replies_unfurled_total",
+                           "Replies produced for triggers", GENERATOR_LABELS)
+GENERATOR_FAILURES = Counter("embed_generator_failures_total",
+                             "Messages a generator failed to extract, unfurl, or post", GENERATOR_LABELS)
+
+METRICS = [EXTRACT_SECONDS, UNFURL_SECONDS, POST_SECONDS,
+           TRIGGERS_SEEN, TRIGGERS_SUPPRESSED, REPLIES_UNFURLED, GENERATOR_FAILURES]
+
+
+def guild_label(guild) -> str:
+    """ Gets the label value for the guild a message was sent in """
+    return "dm" if guild is None else str(guild.id)
+
+
+def render() -> str:
+    """ Formats every metric in the Prometheus text exposition format """
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.description}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def generator_summary() -> dict:
+    """
+    Summarizes the metrics of each generator across every guild
+
+    :return: A dictionary mapping generator name -> dictionary of metric name -> value. Latencies
+        are (count, mean, estimated median, estimated 99th percentile) in seconds, or `None`
+    """
+    generators = sorted({label_values[0] for metric in METRICS for label_values in metric.values})
+    return {generator: {"seen": TRIGGERS_SEEN.total(generator=generator),
+                        "suppressed": TRIGGERS_SUPPRESSED.total(generator=generator),
+                        "unfurled": REPLIES_UNFURLED.total(generator=generator),
+                        "failed": GENERATOR_FAILURES.total(generator=generator),
+                        "extract": EXTRACT_SECONDS.summarize(generator=generator),
+                        "unfurl": UNFURL_SECONDS.summarize(generator=generator),
+                        "post": POST_SECONDS.summarize(generator=generator)}
+            for generator in generators}
+
+
+# ------------------------------------------------------------------------ Prometheus endpoint
+
+_runner = None  # The running web server, if it has been started
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> None:
+    """ Starts serving the metrics at `/metrics`, unless the server is already running """
+    global _runner
+    if _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _runner = runner
+
+
+async def stop_server() -> None:
+    """ Stops the metrics server if it is running """
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
+
+
+async def _handle_metrics(_) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
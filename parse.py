@@ -1,4 +1,6 @@
 import re
+from urllib.parse import urlsplit, urlunsplit
+
 import utils
 
 URL_REGEX = re.compile(r"(https?://" +  # Protocol
@@ -35,6 +37,18 @@ def args(message: str) -> ([str], str):
     return arguments, message[i:].strip()
 
 
+def canonical_url(url: str) -> str:
+    """
+    Reduces a url to a canonical form, so trivially different ways of writing it compare as equal.
+    The scheme and host are lowercased, and any trailing slash and fragment are dropped
+
+    :param url: The url to canonicalize
+    :return: The canonical url
+    """
+    scheme, netloc, path, query, _ = urlsplit(url.strip())
+    return urlunsplit((scheme.lower(), netloc.lower(), path.rstrip("/"), query, ""))
+
+
 def func_param(string: str) -> [str]:
     """
     Strips off the command and then parses out the function
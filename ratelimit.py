@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+from config import *
+
+"""
+Outbound Rate Limiting
+
+Every outbound web request the bot makes goes through the OutboundScheduler, which keeps one
+token bucket per host so that a burst of unfurls can't get the bot throttled. Identical GET
+requests which are already in flight are merged, so the same popular link pasted into several
+servers at once is only requested once. When a host answers with 429 Too Many Requests, every
+request to it waits out the `Retry-After` period, and the request is retried if the wait is short
+"""
+
+# Requests per second and burst size used for hosts without an entry in `OUTBOUND_HOST_LIMITS`
+DEFAULT_HOST_RATE = 5
+DEFAULT_HOST_BURST = 10
+
+# How long a request will wait out a 429 to be retried. Longer waits return the 429 to the caller
+MAX_RETRY_AFTER_WAIT = 10
+# How many times a request is retried after a 429
+MAX_RATE_LIMIT_RETRIES = 2
+# How long to back off for when a 429 doesn't say how long to wait
+DEFAULT_RETRY_AFTER = 5
+
+
+class RateLimited(Exception):
+    """
+    Raised by a request function when the host answered with 429 Too Many Requests
+
+    :param retry_after: The value of the response's `Retry-After` header, if it had one
+    :param result: What the request should return if it isn't retried
+    """
+
+    def __init__(self, retry_after: Optional[str], result):
+        super().__init__(f"Rate limited (Retry-After: {retry_after})")
+        self.retry_after = parse_retry_after(retry_after)
+        self.result = result
+
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """ Converts a `Retry-After` header, either a number of seconds or an HTTP date, to seconds from now """
+    if not value:
+        return DEFAULT_RETRY_AFTER
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """ Allows `rate` requests per second on average, with bursts of up to `burst` requests """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.blocked_until = 0.0  # Set when the host asks the bot to back off
+        self._updated = time.monotonic()
+
+    async def acquire(self) -> None:
+        """ Waits until a request may be sent, and takes a token for it """
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block_for(self, seconds: float) -> None:
+        """ Holds back every request for some time, such as after a 429 """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class OutboundScheduler:
+    """ Paces outbound requests per host, merging identical in-flight GETs and backing off on 429s """
+
+    def __init__(self, host_limits: dict = None):
+        """
+        :param host_limits: (Optional) Maps host name -> (requests per second, burst size)
+        """
+        self.host_limits = dict(host_limits or {})
+        self.sent = 0  # Requests sent, including retries
+        self.merged = 0  # Requests served by another identical request already in flight
+        self.rate_limited = 0  # 429 responses received
+        self._buckets = {}  # Maps host -> TokenBucket
+        self._in_flight = {}  # Maps request key -> Task
+
+    async def request(self, url: str, send, key=None):
+        """
+        Sends a request once the host's rate limit allows it
+
+        :param url: The URL being requested, which decides the host it is paced by
+        :param send: A coroutine function which makes the request and returns its result. It should
+            raise `RateLimited` if the host answers with 429
+        :param key: (Optional) A hashable description of the request, to merge it with identical
+            requests. See `coalesce()`
+        :return: Whatever `send` returns
+        """
+        return await self.coalesce(key, lambda: self._send(url, send))
+
+    async def coalesce(self, key, send):
+        """
+        Runs a request, unless an identical one is already in flight, in which case its result is shared
+
+        :param key: A hashable description of the request. Requests with the same key that overlap
+            are only sent once, and every caller gets the same result, so only pass this for requests
+            without side effects, whose result is the same for every caller, and treat the result as
+            read-only. If `None`, the request isn't merged
+        :param send: A coroutine function which makes the request and returns its result
+        :return: Whatever `send` returns
+        """
+        if key is None:
+            return await send()
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(send())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.merged += 1
+        # Shielded so a caller timing out doesn't cancel the request for everyone else waiting on it
+        return await asyncio.shield(task)
+
+    async def _send(self, url: str, send):
+        """ Sends a request, waiting out and retrying after short 429 backoffs """
+        bucket = self._get_bucket(url)
+        retries = 0
+        while True:
+            await bucket.acquire()
+            self.sent += 1
+            try:
+                return await send()
+            except RateLimited as e:
+                self.rate_limited += 1
+                bucket.block_for(e.retry_after)
+                if retries >= MAX_RATE_LIMIT_RETRIES or e.retry_after > MAX_RETRY_AFTER_WAIT:
+                    return e.result
+                retries += 1
+
+    def _get_bucket(self, url: str) -> TokenBucket:
+        """ Gets the token bucket for a URL's host, creating it if necessary """
+        host = urlsplit(url).hostname or ""
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            rate, burst = self.host_limits.get(host, (DEFAULT_HOST_RATE, DEFAULT_HOST_BURST))
+            bucket = self._buckets[host] = TokenBucket(rate, burst)
+        return bucket
+
+
+def request_key(method: str, url: str, params: dict = None, headers: dict = None, *extra) -> tuple:
+    """ Builds a hashable key identifying a request, for merging identical requests """
+    return (method, url,
+            tuple(sorted((str(name), str(value)) for name, value in (params or {}).items())),
+            tuple(sorted((str(name), str(value)) for name, value in (headers or {}).items())),
+            *extra)
+
+
+# The scheduler every outbound request goes through
+OUTBOUND = OutboundScheduler(OUTBOUND_HOST_LIMITS)
@@ -0,0 +1,366 @@
+import copy
+import time
+
+import redis.asyncio as aioredis
+
+from config import *
+
+"""
+Redis Connection
+
+Provides the asyncio Redis clients shared by the whole bot. Every client draws from a
+connection pool, so awaiting a Redis call only suspends the coroutine making it instead
+of blocking the entire event loop.
+
+If `REDIS_IN_MEMORY` is set (or `use_memory_store()` is called), the clients are replaced
+by an in-process stand-in so that tests and benchmarks can run without a Redis server
+"""
+
+# Pools and clients are keyed by whether they decode responses to `str`
+_pools = {}
+_clients = {}
+
+_memory_store = None  # The backing data of the in-process stand-in, if it is in use
+
+
+def get_client(decode_responses: bool = True):
+    """
+    Gets the shared Redis client
+
+    :param decode_responses: Whether values are returned as `str` (Default) or raw `bytes`
+    :return: An asyncio Redis client, or the in-process stand-in if it is enabled
+    """
+    if decode_responses in _clients:
+        return _clients[decode_responses]
+
+    if _memory_store is not None or REDIS_IN_MEMORY:
+        client = InMemoryRedis(_get_memory_store(), decode_responses=decode_responses)
+    else:
+        pool = aioredis.ConnectionPool(host=REDIS_HOST,
+                                       port=REDIS_PORT,
+                                       max_connections=REDIS_MAX_CONNECTIONS,
+                                       encoding="utf-8",
+                                       decode_responses=decode_responses)
+        _pools[decode_responses] = pool
+        client = aioredis.Redis(connection_pool=pool)
+    _clients[decode_responses] = client
+    return client
+
+
+def use_memory_store() -> None:
+    """ Replaces the Redis clients with the in-process stand-in. Used by tests and benchmarks """
+    _get_memory_store()
+    _clients.clear()
+
+
+async def close() -> None:
+    """ Closes every client and disconnects their connection pools """
+    for client in _clients.values():
+        await client.close()
+    for pool in _pools.values():
+        await pool.disconnect()
+    _clients.clear()
+    _pools.clear()
+
+
+def _get_memory_store() -> dict:
+    """ Gets the data shared by every in-process client, creating it if necessary """
+    global _memory_store
+    if _memory_store is None:
+        _memory_store = {}
+    return _memory_store
+
+
+# ------------------------------------------------------------------------ In-process stand-in
+
+
+class InMemoryRedis:
+    """
+    An in-process stand-in for the subset of the asyncio Redis client used by the bot.
+
+    Values are stored as `bytes`, the same as Redis, and decoded on the way out if
+    `decode_responses` is set. Several clients can share the same data, which is how
+    the `str` and `bytes` clients see the same keys. None of the methods suspend, so
+    each command (and each pipeline) runs atomically with respect to other coroutines
+    """
+
+    def __init__(self, data: dict = None, decode_responses: bool = True):
+        """
+        :param data: The dictionary holding the stored keys. If not provided, a new one is made
+        :param decode_responses: Whether values are returned as `str` instead of `bytes`
+        """
+        self._data = {} if data is None else data
+        self.decode_responses = decode_responses
+
+    # ---------------------------------------------------- Keys
+
+    async def exists(self, *names) -> int:
+        return sum(1 for name in names if self._lookup(name) is not None)
+
+    async def delete(self, *names) -> int:
+        deleted = 0
+        for name in names:
+            if self._lookup(name) is not None:
+                del self._data[self._encode(name)]
+                deleted += 1
+        return deleted
+
+    async def expire(self, name, time_seconds) -> bool:
+        entry = self._lookup(name)
+        if entry is None:
+            return False
+        entry[1] = time.monotonic() + int(time_seconds)
+        return True
+
+    async def pexpire(self, name, time_milliseconds) -> bool:
+        entry = self._lookup(name)
+        if entry is None:
+            return False
+        entry[1] = time.monotonic() + int(time_milliseconds) / 1000
+        return True
+
+    async def ttl(self, name) -> int:
+        entry = self._lookup(name)
+        if entry is None:
+            return -2
+        if entry[1] is None:
+            return -1
+        return max(0, round(entry[1] - time.monotonic()))
+
+    async def type(self, name) -> str:
+        entry = self._lookup(name)
+        kind = "none" if entry is None else entry[2]
+        return kind if self.decode_responses else kind.encode()
+
+    # ---------------------------------------------------- Strings
+
+    async def get(self, name):
+        entry = self._lookup(name, "string")
+        return None if entry is None else self._decode(entry[0])
+
+    async def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        exists = self._lookup(name) is not None
+        if (nx and exists) or (xx and not exists):
+            return None
+        self._store(name, self._encode(value), "string", ex=ex, px=px)
+        return True
+
+    # ---------------------------------------------------- Hashes
+
+    async def hget(self, name, key):
+        entry = self._lookup(name, "hash")
+        if entry is None:
+            return None
+        value = entry[0].get(self._encode(key))
+        return None if value is None else self._decode(value)
+
+    async def hset(self, name, key=None, value=None, mapping: dict = None) -> int:
+        entry = self._lookup(name, "hash")
+        if entry is None:
+            self._store(name, {}, "hash")
+            entry = self._lookup(name)
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        added = 0
+        for field, field_value in items.items():
+            field = self._encode(field)
+            added += field not in entry[0]
+            entry[0][field] = self._encode(field_value)
+        return added
+
+    async def hsetnx(self, name, key, value) -> bool:
+        entry = self._lookup(name, "hash")
+        if entry is not None and self._encode(key) in entry[0]:
+            return False
+        await self.hset(name, key, value)
+        return True
+
+    async def hlen(self, name) -> int:
+        entry = self._lookup(name, "hash")
+        return 0 if entry is None else len(entry[0])
+
+    # ---------------------------------------------------- Lists
+
+    async def rpush(self, name, *values) -> int:
+        entry = self._lookup(name, "list")
+        if entry is None:
+            self._store(name, [], "list")
+            entry = self._lookup(name)
+        entry[0].extend(self._encode(value) for value in values)
+        return len(entry[0])
+
+    async def lpush(self, name, *values) -> int:
+        entry = self._lookup(name, "list")
+        if entry is None:
+            self._store(name, [], "list")
+            entry = self._lookup(name)
+        entry[0][:0] = [self._encode(value) for value in reversed(values)]
+        return len(entry[0])
+
+    async def lpop(self, name, count: int = None):
+        return self._pop(name, count, 0)
+
+    async def rpop(self, name, count: int = None):
+        return self._pop(name, count, -1)
+
+    async def ltrim(self, name, start: int, end: int) -> bool:
+        entry = self._lookup(name, "list")
+        if entry is not None:
+            entry[0][:] = entry[0][self._list_slice(entry[0], start, end)]
+            if not entry[0]:
+                del self._data[self._encode(name)]
+        return True
+
+    async def lrange(self, name, start: int, end: int) -> list:
+        entry = self._lookup(name, "list")
+        if entry is None:
+            return []
+        return [self._decode(value) for value in entry[0][self._list_slice(entry[0], start, end)]]
+
+    async def llen(self, name) -> int:
+        entry = self._lookup(name, "list")
+        return 0 if entry is None else len(entry[0])
+
+    # ---------------------------------------------------- Pipelines
+
+    def pipeline(self, transaction: bool = True):
+        return InMemoryPipeline(self)
+
+    async def close(self) -> None:
+        pass
+
+    # ---------------------------------------------------- Helpers
+
+    def _pop(self, name, count, index: int):
+        """ Removes `count` values (or a single value, if `count` is `None`) from one end of a list """
+        entry = self._lookup(name, "list")
+        if entry is None:
+            return None
+        values = [self._decode(entry[0].pop(index)) for _ in range(min(1 if count is None else count, len(entry[0])))]
+        if not entry[0]:
+            del self._data[self._encode(name)]  # Redis deletes lists once they are empty
+        return values[0] if count is None else values
+
+    @staticmethod
+    def _list_slice(values: list, start: int, end: int) -> slice:
+        """ Converts an inclusive Redis range, where negative indices count from the end, to a slice """
+        start, end = int(start), int(end)
+        if start < 0:
+            start = max(0, len(values) + start)
+        if end < 0:
+            end += len(values)
+        return slice(start, max(start, end + 1))
+
+    def _snapshot(self, name):
+        """ Copies a key's entry, so a WATCH can tell whether it has changed since """
+        return copy.deepcopy(self._lookup(name))
+
+    def _lookup(self, name, kind: str = None):
+        """ Gets the [value, expiry, type] entry for a key, dropping it if it has expired """
+        key = self._encode(name)
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self._data[key]
+            return None
+        if kind is not None and entry[2] != kind:
+            raise aioredis.ResponseError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return entry
+
+    def _store(self, name, value, kind: str, ex=None, px=None) -> None:
+        """ Stores a value under a key, replacing anything already there """
+        expiry = None
+        if ex is not None:
+            expiry = time.monotonic() + int(ex)
+        elif px is not None:
+            expiry = time.monotonic() + int(px) / 1000
+        self._data[self._encode(name)] = [value, expiry, kind]
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        """ Converts a value to bytes the same way the Redis client does """
+        if isinstance(value, bytes):
+            return value
+        if isinstance(value, str):
+            return value.encode("utf-8")
+        if isinstance(value, (int, float)):
+            return repr(value).encode("utf-8")
+        raise aioredis.DataError(f"Invalid input of type: '{type(value).__name__}'")
+
+    def _decode(self, value):
+        """ Converts stored bytes to the type this client returns """
+        if self.decode_responses and isinstance(value, bytes):
+            return value.decode("utf-8")
+        return value
+
+
+class InMemoryPipeline:
+    """
+    Queues commands for an InMemoryRedis client and runs them together on `execute()`,
+    mirroring the asyncio Redis pipeline.
+
+    Optimistic transactions work the same way too. After `watch()`, commands run straight away
+    until `multi()` is called, and `execute()` raises `WatchError` instead of running the queued
+    commands if any watched key has changed since it was watched
+    """
+
+    def __init__(self, client: InMemoryRedis):
+        self._client = client
+        self._commands = []
+        self._watched = {}  # Maps each watched key to a copy of its entry when it was watched
+        self._immediate = False  # Whether commands run straight away, as they do between WATCH and MULTI
+
+    def __getattr__(self, name):
+        command = getattr(self._client, name)
+        if self._immediate:
+            return command
+
+        def queue(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+        return queue
+
+    def __len__(self):
+        return len(self._commands)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.reset()
+
+    async def watch(self, *names) -> bool:
+        for name in names:
+            self._watched[name] = self._client._snapshot(name)
+        self._immediate = True
+        return True
+
+    def multi(self) -> None:
+        self._immediate = False
+
+    async def reset(self) -> None:
+        self._commands = []
+        self._watched = {}
+        self._immediate = False
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        """
+        Runs the queued commands. Like Redis, a command which fails doesn't stop the rest from
+        running. Its error is raised afterwards, or returned in its place if `raise_on_error` is False
+        """
+        commands, watched = self._commands, self._watched
+        await self.reset()
+        if any(self._client._snapshot(name) != entry for name, entry in watched.items()):
+            raise aioredis.WatchError("Watched variable changed.")
+        results = []
+        for command, args, kwargs in commands:
+            try:
+                results.append(await command(*args, **kwargs))
+            except aioredis.ResponseError as e:
+                results.append(e)
+        errors = [result for result in results if isinstance(result, aioredis.ResponseError)]
+        if errors and raise_on_error:
+            raise errors[0]
+        return results
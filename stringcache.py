@@ -1,5 +1,23 @@
-import redis
+import asyncio
+from collections import OrderedDict, deque
+import math
+import time
+import uuid
+import weakref
+
+from redis.exceptions import WatchError
+
+import redisconnection
 import utils
+from config import *
+
+# Every StringCache which has been created and is still in use, by cache ID
+_caches = weakref.WeakValueDictionary()
+
+
+def all_caches() -> list:
+    """ Gets every StringCache in use """
+    return list(_caches.values())
 
 
 class StringCache:
@@ -10,47 +28,106 @@ class StringCache:
     has no default implementation and must be defined for every application of
     this class.
 
+    The queue is kept in memory, and mirrored to a Redis list so it survives restarts.
+    Every change to the queue is a single list command (LPOP or RPUSH) sent in the
+    background, so serving a value never waits on the database. Values may contain
+    any characters, including newlines
+
+    The refill threshold and target size adapt to demand. The cache tracks how fast values
+    are popped and how long `gather()` takes, and keeps enough values on hand that it won't
+    run dry before a refill lands, plus about a minute's worth of demand on top
+
     NOTE: If the cache runs out, it will supply the only remaining value repeatedly
     until it can fill itself
+
+    A shared cache keeps its queue on the Redis server alone, so several bot processes can
+    serve from it without serving a value twice. Values are popped on the server with `take()`,
+    and the last value served is saved alongside the queue to be served again if it runs out.
+    Refills are guarded by a lease, so only one process runs `gather()` at a time
     """
 
-    CACHE_DELIMITER = "\n"
     DB_KEY_PREFIX = "STRING-CACHE-QUEUE-"
+    LAST_SERVED_KEY_PREFIX = "STRING-CACHE-LAST-"  # The last value served by a shared cache
+    LEASE_KEY_PREFIX = "STRING-CACHE-LEASE-"  # Held by the process refilling a shared cache
+    LEGACY_DELIMITER = b"\n"  # Queues used to be saved as a single string, joined by newlines
 
-    def __init__(self, bot, cache_id, fill_size=10, fill_threshold=3, gather_limit=5):
+    POP_RATE_WINDOW = 30  # Seconds over which the pop rate is averaged. Older pops fade out exponentially
+    LATENCY_SMOOTHING = 0.3  # The weight of the newest gather() in the average gather latency
+    SAFETY_FACTOR = 2  # How many refills' worth of time the values left at the threshold should last
+    REFILL_HORIZON = 60  # Seconds of demand each fill should cover, beyond the threshold
+
+    def __init__(self, bot, cache_id, fill_size=10, fill_threshold=3, gather_limit=5, fill_parallelism=3,
+                 recent_window=100, adaptive=True, max_fill_size=None, max_fill_threshold=None, shared=None):
         """
-        Creates a StringCache, loads the saved queue from the database (if it exists)
+        Creates a StringCache, and starts loading the saved queue from the database (if it exists)
 
         :param bot: The bot object (contains important properties like the async event loop)
         :param cache_id: The key for storing this queue in the database
             NOTE: If this key is not unique between caches, they will overwrite each other
             NOTE: This key is not used 'as is'. It is prepended with 'STRING-CACHE-QUEUE-' to
             help ensure no collisions with any existing database keys
-        :param fill_size: The size the queue will be filled to (Default: 10)
+        :param fill_size: The size the queue will be filled to (Default: 10). If the cache is adaptive,
+            this is the smallest it will fill to
             NOTE: depending on implementation of fill(), this value may be exceeded
-        :param fill_threshold: The size limit that triggers a refill (Default: 3)
-        :param gather_limit: The maximum number of gather() attempts to make while filling (Default: 5)
+        :param fill_threshold: The size limit that triggers a refill (Default: 3). If the cache is
+            adaptive, this is the lowest the limit will go
+        :param gather_limit: The maximum number of gather() attempts to make while filling (Default: 5). If
+            the cache is adaptive, this grows in proportion with the fill size
+        :param fill_parallelism: The maximum number of gather() attempts to run at once (Default: 3)
+        :param recent_window: How many of the most recently served values are kept out of refills (Default: 100)
+        :param adaptive: Whether to adjust the fill size and threshold to demand (Default: True)
+        :param max_fill_size: The largest the fill size can grow to (Default: 5 times `fill_size`)
+        :param max_fill_threshold: The highest the threshold can grow to (Default: half of `max_fill_size`)
+        :param shared: Whether the queue is shared with other bot processes (Default: `STRING_CACHE_SHARED`)
+            NOTE: Values must be popped from a shared cache with `take()`, and adaptive sizing only sees
+            the pops made by this process
         """
         self.bot = bot
         self.cache_id = cache_id
         self.fill_size = fill_size
         self.fill_threshold = fill_threshold
         self.gather_limit = gather_limit
+        self.fill_parallelism = fill_parallelism
+        self.recent_window = recent_window
+        self.adaptive = adaptive
+        self.shared = STRING_CACHE_SHARED if shared is None else shared
+        self.min_fill_size = fill_size
+        self.min_fill_threshold = fill_threshold
+        self.max_fill_size = max_fill_size if max_fill_size is not None else 5 * fill_size
+        self.max_fill_threshold = max_fill_threshold if max_fill_threshold is not None else self.max_fill_size // 2
+        self.duplicates = 0  # Gathered values dropped because they were queued or recently served
+        self.stale_serves = 0  # Times the last value was served again because the cache hadn't refilled
+        self.gather_latency = None  # The average time a gather() takes, in seconds, once one has finished
+
+        self._pop_rate = 0.0  # The pop rate as of `_pop_rate_updated`
+        self._pop_rate_updated = self._first_pop = None
 
         self._locked = False
         self._loop = bot.loop
-        self._redis_db = redis.StrictRedis(host='localhost', charset="utf-8", decode_responses=True)
-        self._queue = []
+        self._redis = redisconnection.get_client(decode_responses=False)
+        self._db_key = StringCache.DB_KEY_PREFIX + self.cache_id
+        self._last_served_key = StringCache.LAST_SERVED_KEY_PREFIX + self.cache_id
+        self._lease_key = StringCache.LEASE_KEY_PREFIX + self.cache_id
+        # The length of a shared queue, as of the last time this process popped from or filled it.
+        # A shared cache's `_queue` is only a copy of the server's, taken at the start of each fill
+        self._shared_length = 0
+        self._queue = deque()
         # Indicates that the last string has already been returned and should be deleted when the cache refills
         self._stale = False
+        self._recently_served = OrderedDict()  # The last `recent_window` values served, oldest first
+        self._values_per_gather = None  # How many new values the last gather() added, to plan the next fill
 
-        # Load saved queue
-        cached_list = self._redis_db.get(StringCache.DB_KEY_PREFIX + self.cache_id)
-        if cached_list:
-            self._queue = cached_list.split(StringCache.CACHE_DELIMITER)
+        # Changes to the queue waiting to be written to the database, as (command, arguments)
+        self._pending_writes = []
+        self._writer = None  # The task writing them, while it's running
+        self._clears = 0  # How many times the cache has been cleared, so a load can tell if it was overtaken
+
+        # Load saved queue. Until it's loaded, the cache is empty, and nothing is written to the database
+        self._load_task = self._loop.create_task(self._load())
+        _caches[cache_id] = self
 
     def __len__(self):
-        return len(self._queue)
+        return self._shared_length if self.shared else len(self._queue)
 
     def clear(self, refill=False):
         """
@@ -58,14 +135,19 @@ class StringCache:
 
         :param refill (bool) If "True", a refill will be triggered once the cache is empty
         """
-        self._queue = []
-        self._save()
+        self._queue.clear()
+        self._stale = False
+        self._clears += 1
+        self._persist("delete", self._db_key)
+        if self.shared:
+            self._shared_length = 0
+            self._persist("delete", self._last_served_key)
         if refill:
             self.fill()
 
-    def fill(self):
+    def fill(self) -> asyncio.Task:
         """ A function which creates an async task to fill up the cache """
-        self._loop.create_task(self._fill())
+        return self._loop.create_task(self._fill())
 
     async def gather(self) -> list:
         """
@@ -85,58 +167,230 @@ class StringCache:
         return self._stale
 
     def peek(self):
-        """ Returns the next value in the cache without removing """
+        """
+        Returns the next value in the cache without removing
+        NOTE: Returns `None` until the saved queue has loaded from the database
+        NOTE: A shared cache returns the next value as of its last fill, which may have been served since
+        """
         if len(self._queue) == 0:
             return None
         return self._queue[0]
 
     def pop(self) -> str:
-        """ Removes the next value in the cache and returns it. Returns 'None' if cache is empty """
+        """
+        Removes the next value in the cache and returns it. Returns 'None' if cache is empty
+        NOTE: The cache is empty until the saved queue has loaded from the database, which starts when
+        it's created, and it won't start a refill until then. Use `take()` to wait for the load
+        """
+        if self.shared:
+            raise RuntimeError(f"StringCache `{self.cache_id}` is shared, so values must be popped with `take()`")
         if len(self._queue) == 0:  # Return None if cache is empty
             value = None
         elif len(self._queue) == 1:  # If only one item left in cache, return it but do not remove it
             value = self._queue[0]
+            if self._stale:
+                self.stale_serves += 1
             self._stale = True  # Signal that the element in the queue should be purged upon refill
         else:  # Pop the next item off the queue and update the database
-            value = self._queue.pop(0)
-            self._save()
+            value = self._queue.popleft()
+            self._persist("lpop", self._db_key)
+        if value is not None:
+            self._remember_served(value)
+        self._record_pop()
+
+        # Fill cache if queue is running low. Until the saved queue has loaded, it may not be
+        if len(self) < self.fill_threshold and self._load_task.done():
+            self.fill()
+        return value
+
+    async def take(self):
+        """
+        Removes the next value in the cache and returns it, the same as `pop()`, once the saved queue
+        has loaded. A shared cache pops the value on the Redis server, so no other process can serve it too
+        """
+        await self._load_task
+        if not self.shared:
+            return self.pop()
+        try:
+            pipe = self._redis.pipeline(transaction=True)
+            pipe.lpop(self._db_key)
+            pipe.llen(self._db_key)
+            value, self._shared_length = await pipe.execute()
+            if value is not None:
+                self._stale = False
+                await self._redis.set(self._last_served_key, value)
+            else:  # Out of values, so serve the last one again until the cache is refilled
+                value = await self._redis.get(self._last_served_key)
+                if value is not None:
+                    self.stale_serves += 1
+                    self._stale = True
+        except Exception as e:
+            await utils.report(f"Failed to pop from StringCache `{self.cache_id}`\n" + str(e))
+            return None
+        if value is not None:
+            value = value.decode("utf-8")
+            self._remember_served(value)
+        self._record_pop()
 
         # Fill cache if queue is running low
         if len(self) < self.fill_threshold:
             self.fill()
         return value
 
-    def _save(self) -> None:
-        """ Save the current queue to the database """
-        db_key = StringCache.DB_KEY_PREFIX + self.cache_id
-        db_value = StringCache.CACHE_DELIMITER.join(self._queue)
-        self._redis_db.set(db_key, db_value)
+    def pop_rate(self) -> float:
+        """ The recent rate of pops, in pops per second """
+        if self._first_pop is None:
+            return 0.0
+        now = time.monotonic()
+        rate = self._pop_rate * math.exp((self._pop_rate_updated - now) / StringCache.POP_RATE_WINDOW)
+        # Until a full window has passed, the average is made up of fewer pops than it should be. Scale it
+        # up to make up for the missing time, but not by more than the first pop alone can account for
+        warmup = 1 - math.exp((self._first_pop - now) / StringCache.POP_RATE_WINDOW)
+        return rate / max(warmup, 1 / StringCache.POP_RATE_WINDOW)
+
+    def stats(self) -> dict:
+        """ Reports the cache's size, its demand, and the thresholds worked out from it """
+        return {"size": len(self), "fill_size": self.fill_size, "fill_threshold": self.fill_threshold,
+                "pop_rate": self.pop_rate(), "gather_latency": self.gather_latency,
+                "stale_serves": self.stale_serves, "duplicates": self.duplicates}
+
+    def _record_pop(self) -> None:
+        """ Adds a pop to the pop rate, and adjusts the thresholds to it """
+        now = time.monotonic()
+        if self._first_pop is None:
+            self._first_pop = self._pop_rate_updated = now
+        decay = math.exp((self._pop_rate_updated - now) / StringCache.POP_RATE_WINDOW)
+        self._pop_rate = self._pop_rate * decay + 1 / StringCache.POP_RATE_WINDOW
+        self._pop_rate_updated = now
+        self._adapt()
+
+    def _record_gather_latency(self, seconds: float) -> None:
+        if self.gather_latency is None:
+            self.gather_latency = seconds
+        else:
+            self.gather_latency += StringCache.LATENCY_SMOOTHING * (seconds - self.gather_latency)
+        self._adapt()
+
+    def _adapt(self) -> None:
+        """
+        Sizes the threshold so the values left when a refill starts outlast the refill, and the
+        fill size so each fill covers the threshold plus `REFILL_HORIZON` seconds of demand
+        """
+        if not self.adaptive or self.gather_latency is None:
+            return
+        pop_rate = self.pop_rate()
+        # One more than needed, since the last value is held back to be served stale
+        threshold = math.ceil(pop_rate * self.gather_latency * StringCache.SAFETY_FACTOR) + 1
+        self.fill_threshold = max(self.min_fill_threshold, min(self.max_fill_threshold, threshold))
+        fill_size = self.fill_threshold + math.ceil(pop_rate * StringCache.REFILL_HORIZON)
+        self.fill_size = max(self.min_fill_size, self.fill_threshold + 1, min(self.max_fill_size, fill_size))
+
+    def _remember_served(self, value: str) -> None:
+        """ Records that a value was served, so refills won't queue it again for a while """
+        self._recently_served[value] = None
+        self._recently_served.move_to_end(value)
+        while len(self._recently_served) > self.recent_window:
+            self._recently_served.popitem(last=False)
+
+    def _append(self, values: list) -> None:
+        """ Adds values to the end of the queue """
+        if not values:
+            return
+        self._queue.extend(values)
+        self._persist("rpush", self._db_key, *(value.encode("utf-8") for value in values))
+
+    async def _load(self) -> None:
+        """ Loads the saved queue from the database, converting it to a list if it was saved by an older version """
+        try:
+            clears = self._clears
+            kind = await self._redis.type(self._db_key)
+            if kind == b"list":
+                values = await self._redis.lrange(self._db_key, 0, -1)
+            elif kind == b"string":
+                saved = await self._redis.get(self._db_key)
+                values = saved.split(StringCache.LEGACY_DELIMITER) if saved else []
+                pipe = self._redis.pipeline(transaction=True)
+                pipe.delete(self._db_key)
+                if values:
+                    pipe.rpush(self._db_key, *values)
+                await pipe.execute()
+            else:
+                values = []
+            if clears == self._clears:
+                self._queue.extendleft(value.decode("utf-8") for value in reversed(values))
+                self._shared_length = len(values)
+        except Exception as e:
+            await utils.report(f"Failed to load StringCache `{self.cache_id}`\n" + str(e))
+        # Values popped while loading didn't start a refill, so start it now if one is needed
+        if self._first_pop is not None and len(self) < self.fill_threshold:
+            self.fill()
+
+    def _persist(self, command: str, *args) -> None:
+        """ Queues a list command which mirrors a change to the queue, and makes sure it will be written """
+        self._pending_writes.append((command, args))
+        if self._writer is None or self._writer.done():
+            self._writer = self._loop.create_task(self._write())
+
+    async def _write(self) -> None:
+        """
+        Writes queued changes to the database in order. Changes made while a batch is being
+        written are sent together in the next batch
+        """
+        await self._load_task
+        while self._pending_writes:
+            writes, self._pending_writes = self._pending_writes, []
+            pipe = self._redis.pipeline(transaction=False)
+            for command, args in writes:
+                getattr(pipe, command)(*args)
+            try:
+                await pipe.execute()
+            except Exception as e:
+                await utils.report(f"Failed to save StringCache `{self.cache_id}`\n" + str(e))
 
     async def _fill(self) -> None:
         """
         The asynchronous method which fills the queue using the `gather()` function.
+        Several gathers run at once, up to `fill_parallelism`, but no more than it should
+        take to reach `fill_size`. Once it's reached, any gathers still running are cancelled.
+        Gathered values which are already queued, or were served recently, are dropped.
         When called once, this function will lock itself until it finishes to prevent
-        multiple concurrent activations. Any subsequent calls will instantly exit
+        multiple concurrent activations. Any subsequent calls will instantly exit.
+        A shared cache also has to take the refill lease, so other processes' calls exit too
         """
+        if self._locked:
+            print(f"Cache {self.cache_id} locked. Abandoning `_fill()`")
+            return
+        self._locked = True  # Lock fetching to prevent concurrent fetching
+        in_flight = set()
+        lease = None
         try:
-            if self._locked:
-                print(f"Cache {self.cache_id} locked. Abandoning `_fill()`")
-                return
-            self._locked = True  # Lock fetching to prevent concurrent fetching
+            await self._load_task  # Fill on top of the saved queue
+            if self.shared:
+                lease = await self._acquire_lease()
+                if lease is None:
+                    print(f"Cache {self.cache_id} is being filled by another process. Abandoning `_fill()`")
+                    return
+                # Fill on top of the queue as it is on the server
+                self._queue = deque(value.decode("utf-8") for value in await self._redis.lrange(self._db_key, 0, -1))
             print(f"Filling cache `{self.cache_id}`...")
             # Gather values
             gather_count = 0
-            while len(self._queue) < self.fill_size and gather_count < self.gather_limit:
-                gather_count += 1
-                try:
-                    values = await self.gather()
-                    if self._stale and len(values) > 0:  # Remove stale entry when new values added
-                        self._queue = []
-                        self._stale = False  # Queue is no longer stale
-                    self._queue.extend(values)
-                except Exception as exc:
-                    await utils.flag(alert=f"Failed fill attempt {gather_count} for StringCache `{self.cache_id}`",
-                                     description=str(exc))
+            while len(self._queue) < self.fill_size:
+                if lease is not None and not await self._renew_lease(lease):
+                    await utils.report(f"Lost the refill lease for StringCache `{self.cache_id}` while filling")
+                    lease = None
+                    return
+                wanted = min(self.fill_parallelism, self._gathers_needed()) - len(in_flight)
+                while wanted > 0 and gather_count < self._gather_limit():
+                    gather_count += 1
+                    wanted -= 1
+                    in_flight.add(self._loop.create_task(self._attempt_gather(gather_count)))
+                if not in_flight:
+                    break
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if len(self._queue) < self.fill_size:
+                        self._add_gathered(task.result())
 
             # Send an error if failed to fill queue after reaching maximum attempts
             if len(self._queue) < self.fill_size:
@@ -148,8 +402,105 @@ class StringCache:
                                    f"Cache: `{', '.join(self._queue)}`")
             else:
                 print(f"Cache `{self.cache_id}` filled!")
-            self._locked = False
-            self._save()
         except Exception as e:
-            self._locked = True  # Don't lock up the queue
             await utils.report(f"Exception on `_fill()` for StringCache `{self.cache_id}` \n" + str(e))
+        finally:
+            for task in in_flight:
+                task.cancel()  # The queue is full, so their values aren't needed
+            if lease is not None:
+                await self._release_lease(lease)
+            self._locked = False  # Don't lock up the queue
+
+    async def _acquire_lease(self):
+        """
+        Takes a shared cache's refill lease, if no other process holds it. The lease expires after
+        `STRING_CACHE_LEASE_SECONDS`, so a process which dies while filling can't hold it forever
+        :return: The token identifying this holder of the lease, or `None` if it's already held
+        """
+        token = uuid.uuid4().hex
+        if await self._redis.set(self._lease_key, token, px=self._lease_milliseconds(), nx=True):
+            return token
+        return None
+
+    async def _renew_lease(self, token: str) -> bool:
+        """ Extends the refill lease, if it's still held with `token`. Returns whether it was """
+        return await self._if_lease_held(token, "pexpire", self._lease_milliseconds())
+
+    async def _release_lease(self, token: str) -> None:
+        """
+        Saves the filled queue, then gives up the refill lease so another process can fill the cache.
+        The lease is only deleted if it's still held with `token`, since it may have expired and been
+        taken by another process
+        """
+        try:
+            if self._writer is not None:
+                await self._writer  # Values must be on the server before another process fills on top of them
+            self._shared_length = await self._redis.llen(self._db_key)
+            await self._if_lease_held(token, "delete")
+        except Exception as e:
+            await utils.report(f"Failed to release the refill lease for StringCache `{self.cache_id}`\n" + str(e))
+
+    async def _if_lease_held(self, token: str, command: str, *args) -> bool:
+        """
+        Runs a command on the refill lease's key, but only if the lease is still held with `token`.
+        The key is watched while it's checked, so if the lease expires and is taken by another process
+        before the command runs, the transaction is aborted and the other process's lease is untouched
+
+        :return: Whether the lease was held, and the command ran
+        """
+        async with self._redis.pipeline(transaction=True) as pipe:
+            await pipe.watch(self._lease_key)
+            if await pipe.get(self._lease_key) != token.encode():
+                return False
+            pipe.multi()
+            getattr(pipe, command)(self._lease_key, *args)
+            try:
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    @staticmethod
+    def _lease_milliseconds() -> int:
+        return int(STRING_CACHE_LEASE_SECONDS * 1000)
+
+    def _gather_limit(self) -> int:
+        """ The number of gather() attempts allowed per fill, scaled up as the fill size grows """
+        return self.gather_limit * math.ceil(self.fill_size / max(1, self.min_fill_size))
+
+    def _gathers_needed(self) -> int:
+        """ Estimates how many more gathers it will take to fill the queue, based on the last one """
+        if not self._values_per_gather:
+            return self.fill_parallelism
+        return math.ceil((self.fill_size - len(self._queue)) / self._values_per_gather)
+
+    async def _attempt_gather(self, attempt: int) -> list:
+        """ Runs `gather()`, flagging it and returning no values if it fails """
+        try:
+            start = time.monotonic()
+            values = await self.gather()
+            self._record_gather_latency(time.monotonic() - start)
+            return values
+        except Exception as exc:
+            await utils.flag(alert=f"Failed fill attempt {attempt} for StringCache `{self.cache_id}`",
+                             description=str(exc))
+            return []
+
+    def _add_gathered(self, values: list) -> None:
+        """ Adds the gathered values which aren't queued or recently served to the queue """
+        seen = set(self._queue)
+        seen.update(self._recently_served)
+        new_values = []
+        for value in values:
+            if value in seen:
+                self.duplicates += 1
+            else:
+                seen.add(value)
+                new_values.append(value)
+        self._values_per_gather = len(new_values)
+        if self._stale and new_values:  # Remove stale entry when new values added
+            if self.shared:
+                self._stale = False  # The stale value is kept apart from the shared queue, so it isn't purged
+            else:
+                self.clear()
+        self._append(new_values)
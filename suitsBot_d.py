@@ -10,10 +10,16 @@ from config.credentials import tokens
 import embedGenerator
 from scheduler import Scheduler
 from dbconnection import DBConnection
+import redisconnection
+import circuitbreaker
+import metrics
+from messagecache import MESSAGE_CACHE
+from httpcache import HTTP_CACHE
 from constants import *
 from config import *
 import utils
 import parse
+import stringcache
 from cogs import images
 from utils import embed_from_dict
 
@@ -67,6 +73,39 @@ async def post_apod(_):
     except Exception as e:
         await utils.report(str(e), source="Daily APOD command")
 
+
+async def save_link_filters(_):
+    """
+    Snapshot the duplicate link filters so they survive a restart
+    """
+    try:
+        await embedGenerator.DuplicateLinkAlertGenerator.save_link_filters()
+    except Exception as e:
+        await utils.report(str(e), source="Hourly link filter snapshot")
+
+
+async def close_connections():
+    """
+    Save in-memory state and close connections before the bot shuts down.
+    Failures are only printed, since nothing here should prevent a restart
+    """
+    try:
+        await embedGenerator.DuplicateLinkAlertGenerator.save_link_filters(clean=True)
+    except Exception as e:
+        print(f"Failed to save link filters: {e}")
+    try:
+        await redisconnection.close()
+    except Exception as e:
+        print(f"Failed to close redis connections: {e}")
+    try:
+        await metrics.stop_server()
+    except Exception as e:
+        print(f"Failed to stop metrics server: {e}")
+    try:
+        await utils.close_http_session()
+    except Exception as e:
+        print(f"Failed to close HTTP session: {e}")
+
 # --------------------------- BOT EVENTS --------------------------------
 
 
@@ -90,6 +129,42 @@ async def on_member_join(member: discord.member):
         await utils.report(str(e), source="on_member_join")
 
 
+@bot.event
+async def on_raw_message_edit(payload):
+    """ Drop edited messages from the message cache """
+    MESSAGE_CACHE.invalidate(payload.message_id)
+
+
+@bot.event
+async def on_raw_message_delete(payload):
+    """ Drop deleted messages from the message cache """
+    MESSAGE_CACHE.invalidate(payload.message_id)
+
+
+@bot.event
+async def on_raw_bulk_message_delete(payload):
+    """ Drop deleted messages from the message cache """
+    MESSAGE_CACHE.invalidate(*payload.message_ids)
+
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    """ Drop messages from the message cache when their reactions change, since unfurls show them """
+    MESSAGE_CACHE.invalidate(payload.message_id)
+
+
+@bot.event
+async def on_raw_reaction_remove(payload):
+    """ Drop messages from the message cache when their reactions change, since unfurls show them """
+    MESSAGE_CACHE.invalidate(payload.message_id)
+
+
+@bot.event
+async def on_raw_reaction_clear(payload):
+    """ Drop messages from the message cache when their reactions change, since unfurls show them """
+    MESSAGE_CACHE.invalidate(payload.message_id)
+
+
 @bot.event
 async def on_message_delete(message):
     """ On message delete:
@@ -97,7 +172,7 @@ async def on_message_delete(message):
     - Check if message was expanded by bot and, if so, delete embed
     """
     try:
-        await embedGenerator.process_trigger_delete(message)
+        embedGenerator.schedule_trigger_delete(message)
     except Exception as e:
         await utils.report(str(e), source="on_message_delete")
 
@@ -170,6 +245,7 @@ async def on_ready():
         bot.APOD_CHANNELS.append(bot.get_channel(channel_id))
     bot.HERESY_CHANNEL = bot.get_channel(HERESY_CHANNEL_ID)
     bot.voice = None  # Voice client
+    await utils.open_http_session()
 
     try:
         # Post restart embed
@@ -206,6 +282,13 @@ async def on_ready():
         except discord.InvalidArgument as e:
             await utils.report(str(e), source="Failed to change presence")
 
+        # Serve embed generator metrics for Prometheus
+        if METRICS_SERVER_ENABLED:
+            try:
+                await metrics.start_server()
+            except OSError as e:
+                await utils.report(str(e), source="Failed to start metrics server")
+
         print('------------\nOnline!\n------------')
 
         ready_embed.remove_field(status_field)
@@ -219,6 +302,16 @@ async def on_ready():
 async def on_message(message):
     # ---------------------------- HELPER METHODS
     try:
+        # ------------------------------------------- RECORD RECENT MESSAGES
+        # Lets embed generators look up recent messages and links without calling the Discord API.
+        # Messages from bots and webhooks are recorded too, as they're part of the channel's history.
+        # Errors are reported here so they can't stop the restart command below
+        try:
+            MESSAGE_CACHE.put(message)
+            embedGenerator.RECENT_LINKS.record(message)
+        except Exception as e:
+            await utils.report(str(e), source="Recording a recent message")
+
         # ------------------------------------------- FILTER OTHER BOTS
         if message.author.bot:
             return
@@ -229,6 +322,7 @@ async def on_message(message):
         if message.content == "!r":
             if message.author.id in AUTHORIZED_IDS:
                 bot.dbconn.close()
+                await close_connections()
                 # if bot.is_voice_connected(message.guild):
                 #     await bot.voice_client_in(message.guild).disconnect()  # Disconnect from voice
                 await message.channel.send("Restarting...")
@@ -355,18 +449,51 @@ async def dev(ctx):
             title = "`!dev` User Guide"
             description = "A list of features useful for "
             helpdict = {
+                "bloom": "Reports the size and false positive rate of the duplicate link filters",
+                "breakers": "Reports the health of each web API host the bot has made requests to",
                 "channelid": "Posts the ID of the current channel",
                 "dump": "A debug command for the bot to dump a variable into chat",
                 "flag": "Tests the `flag` function",
+                "httpcache": "Reports the size and hit rate of the web API response cache",
                 "load": "Loads an extension",
+                "messagecache": "Reports the size and hit rate of the message cache",
                 "playing": "Sets the presence of the bot (what the bot says it's currently playing)",
                 "reload": "Reloads an extension",
                 "report": "Tests the `report` function",
                 "serverid": "Posts the ID of the current channel",
+                "stats": "Reports trigger counts and latencies for each embed generator",
+                "stringcaches": "Reports the demand on each string cache and the refill thresholds set from it",
                 "test": "A catch-all command for inserting code into the bot to test",
             }
             await ctx.send("`!dev` User Guide", embed=embed_from_dict(helpdict, title=title, description=description))
 
+        elif func == "bloom":
+            stats = embedGenerator.DuplicateLinkAlertGenerator.link_filter_stats()
+            if not stats:
+                await ctx.send("No duplicate link filters have been loaded yet")
+                return
+            filter_dict = {}
+            for guild_id, (link_count, size, error_rate) in stats.items():
+                guild = bot.get_guild(guild_id)
+                filter_dict[guild.name if guild else str(guild_id)] = \
+                    f"{link_count:,} links, {size / 1024:,.1f} KiB, {error_rate:.3%} false positive rate"
+            await ctx.send(embed=embed_from_dict(filter_dict, title="Duplicate Link Filters"))
+
+        elif func == "breakers":
+            breakers = sorted(circuitbreaker.BREAKERS, key=lambda breaker: breaker.host)
+            if not breakers:
+                await ctx.send("No web requests have been made yet")
+                return
+            breaker_dict = {}
+            for breaker in breakers:
+                state = breaker.state
+                if state == circuitbreaker.OPEN:
+                    state += f" (probing in {breaker.retry_in():.0f}s)"
+                breaker_dict[breaker.host] = (f"{state}, {breaker.consecutive_failures} failures in a row\n"
+                                              f"{breaker.failures:,} failed, {breaker.rejected:,} refused, "
+                                              f"opened {breaker.times_opened:,} times")
+            await ctx.send(embed=embed_from_dict(breaker_dict, title="Circuit Breakers"))
+
         elif func == "channelid":
             await ctx.send("Channel ID: " + ctx.channel.id)
 
@@ -377,6 +504,16 @@ async def dev(ctx):
             await ctx.send("Triggering flag...")
             await utils.flag("Test", description="This is a test of the flag ability", ctx=ctx)
 
+        elif func == "httpcache":
+            await ctx.send(embed=embed_from_dict({"Responses": f"{len(HTTP_CACHE.store):,}",
+                                                  "Size": f"{HTTP_CACHE.store.size / 1024:,.1f} / "
+                                                          f"{HTTP_CACHE.store.max_bytes / 1024:,.0f} KiB",
+                                                  "Hits": f"{HTTP_CACHE.hits:,}",
+                                                  "Revalidated": f"{HTTP_CACHE.revalidations:,}",
+                                                  "Misses": f"{HTTP_CACHE.misses:,}",
+                                                  "Hit Rate": f"{HTTP_CACHE.hit_rate():.1%}"},
+                                                 title="HTTP Cache"))
+
         elif func == "nick":
             try:
                 if ctx.guild is None:
@@ -390,6 +527,29 @@ async def dev(ctx):
             except Exception as e:
                 await utils.report(str(e), source="!dev nick", ctx=ctx)
 
+        elif func == "messagecache":
+            await ctx.send(embed=embed_from_dict({"Messages": f"{len(MESSAGE_CACHE):,} / {MESSAGE_CACHE.max_entries:,}",
+                                                  "Hits": f"{MESSAGE_CACHE.hits:,}",
+                                                  "Misses": f"{MESSAGE_CACHE.misses:,}",
+                                                  "Hit Rate": f"{MESSAGE_CACHE.hit_rate():.1%}"},
+                                                 title="Message Cache"))
+
+        elif func == "stringcaches":
+            caches = sorted(stringcache.all_caches(), key=lambda cache: cache.cache_id)
+            if not caches:
+                await ctx.send("No string caches have been created yet")
+                return
+            cache_dict = {}
+            for cache in caches:
+                stats = cache.stats()
+                latency = "unknown" if stats["gather_latency"] is None else f"{stats['gather_latency'] * 1000:,.0f}ms"
+                cache_dict[cache.cache_id] = (f"{stats['size']:,} queued, refills below {stats['fill_threshold']:,} "
+                                              f"up to {stats['fill_size']:,}\n"
+                                              f"{stats['pop_rate'] * 60:,.1f} pops/min, {latency} per gather\n"
+                                              f"{stats['stale_serves']:,} stale serves, "
+                                              f"{stats['duplicates']:,} duplicates dropped")
+            await ctx.send(embed=embed_from_dict(cache_dict, title="String Caches"))
+
         elif func == "playing":
             try:
                 currently_playing = parameter
@@ -420,6 +580,23 @@ async def dev(ctx):
             await ctx.send("Triggering report...")
             await utils.report("This is a test of the report system", source="dev report command", ctx=ctx)
 
+        elif func == "stats":
+            summary = metrics.generator_summary()
+            if not summary:
+                await ctx.send("No embed generators have run yet")
+                return
+            stats_dict = {}
+            for generator, stats in summary.items():
+                lines = [f"{stats['seen']:,.0f} seen, {stats['suppressed']:,.0f} suppressed, "
+                         f"{stats['unfurled']:,.0f} unfurled, {stats['failed']:,.0f} failed"]
+                for stage in ("extract", "unfurl", "post"):
+                    if stats[stage] is not None:
+                        count, mean, median, p99 = stats[stage]
+                        lines.append(f"{stage}: p50 {median * 1000:,.0f}ms, p99 {p99 * 1000:,.0f}ms, "
+                                     f"mean {mean * 1000:,.0f}ms ({count:,})")
+                stats_dict[generator] = "\n".join(lines)
+            await ctx.send(embed=embed_from_dict(stats_dict, title="Embed Generator Stats"))
+
         elif func == "test":
             try:
                 print("testing...")
@@ -516,6 +693,7 @@ print('Scheduling tasks...')
 try:
     bot.scheduler = Scheduler(bot)
     bot.scheduler.add_daily_task(post_apod)
+    bot.scheduler.add_hourly_task(save_link_filters)
 except Exception as exc:
     print("--- Failed to start scheduler! ---")
     bot.scheduler = exc
@@ -0,0 +1,76 @@
+import pytest
+
+from circuitbreaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+THRESHOLD = 3
+RESET_TIMEOUT = 10
+
+
+class Clock:
+    """ A clock which only moves when it's told to """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def open_breaker(clock: Clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("example.com", THRESHOLD, RESET_TIMEOUT, clock=clock)
+    for _ in range(THRESHOLD):
+        breaker.before_request()
+        breaker.record_failure()
+    return breaker
+
+
+def test_failures_below_the_threshold_keep_it_closed():
+    breaker = CircuitBreaker("example.com", THRESHOLD, RESET_TIMEOUT, clock=Clock())
+    for _ in range(THRESHOLD - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.before_request()
+
+
+def test_opens_after_failures_in_a_row_and_refuses_requests():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 1
+
+    clock.now += RESET_TIMEOUT - 1
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
+    assert breaker.rejected == 1
+    assert breaker.retry_in() == 1
+
+
+def test_successful_probe_closes_it():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now += RESET_TIMEOUT
+
+    breaker.before_request()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):  # Only the probe is let through
+        breaker.before_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_request()
+
+
+def test_failed_probe_reopens_it():
+    clock = Clock()
+    breaker = open_breaker(clock)
+    clock.now += RESET_TIMEOUT
+
+    breaker.before_request()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert breaker.times_opened == 2
+    assert breaker.retry_in() == RESET_TIMEOUT
+    with pytest.raises(CircuitOpen):
+        breaker.before_request()
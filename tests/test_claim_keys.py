@@ -0,0 +1,26 @@
+import asyncio
+
+import redisconnection
+
+redisconnection.use_memory_store()
+
+from embedGenerator.baseGenerator import BaseGenerator  # noqa: E402 (the Redis stand-in has to be in place first)
+
+BURSTS = 50
+KEYS = [f"TEST-CLAIM-{index}" for index in range(20)]
+
+
+def test_concurrent_claims_have_one_winner_per_key():
+    async def burst(caller: int) -> dict:
+        return await BaseGenerator.claim_keys({key: str(caller) for key in KEYS}, expiration=60)
+
+    async def replay() -> (list, list):
+        results = await asyncio.gather(*(burst(caller) for caller in range(BURSTS)))
+        stored = [await redisconnection.get_client().get(key) for key in KEYS]
+        return results, stored
+
+    results, stored = asyncio.run(replay())
+    for key, value in zip(KEYS, stored):
+        winners = [caller for caller, claims in enumerate(results) if claims[key]]
+        assert len(winners) == 1, f"{key} was claimed by {len(winners)} callers"
+        assert value == str(winners[0])  # Later callers didn't overwrite the winner's value
@@ -0,0 +1,116 @@
+import asyncio
+import itertools
+import types
+
+import redisconnection
+
+redisconnection.use_memory_store()
+
+from config import STRING_CACHE_LEASE_SECONDS  # noqa: E402
+from stringcache import StringCache  # noqa: E402
+
+_ids = itertools.count()
+
+
+class EmptyCache(StringCache):
+    """ A shared cache which never refills on its own, so only the paths under test touch the store """
+
+    def __init__(self, cache_id: str):
+        super().__init__(types.SimpleNamespace(loop=asyncio.get_running_loop()), cache_id,
+                         fill_threshold=0, adaptive=False, shared=True)
+
+    async def gather(self) -> list:
+        return []
+
+
+def run(test):
+    """ Runs a test coroutine with a fresh cache ID, so tests don't see each other's keys """
+    return asyncio.run(test(f"test-{next(_ids)}"))
+
+
+def test_lease_is_held_by_one_cache_until_released():
+    async def test(cache_id):
+        first, second = EmptyCache(cache_id), EmptyCache(cache_id)
+        token = await first._acquire_lease()
+        assert token is not None
+        assert await second._acquire_lease() is None
+
+        await first._release_lease(token)
+        assert await second._acquire_lease() is not None
+    run(test)
+
+
+def test_renew_extends_only_the_holders_lease():
+    async def test(cache_id):
+        cache = EmptyCache(cache_id)
+        token = await cache._acquire_lease()
+        await cache._redis.pexpire(cache._lease_key, 1000)
+
+        assert not await cache._renew_lease("someone else")
+        assert await cache._redis.ttl(cache._lease_key) == 1
+        assert await cache._renew_lease(token)
+        assert await cache._redis.ttl(cache._lease_key) == STRING_CACHE_LEASE_SECONDS
+    run(test)
+
+
+def test_renew_fails_if_the_lease_is_taken_after_it_is_checked():
+    async def test(cache_id):
+        cache = EmptyCache(cache_id)
+        token = await cache._acquire_lease()
+        redis = cache._redis
+        pipeline = redis.pipeline
+
+        def pipeline_taken_over_after_get(*args, **kwargs):
+            # The lease expires and another process takes it between the GET and the EXEC
+            pipe = pipeline(*args, **kwargs)
+
+            async def get(name):
+                value = await redis.get(name)
+                await redis.set(name, b"other", px=1000)
+                return value
+            pipe.get = get
+            return pipe
+        redis.pipeline = pipeline_taken_over_after_get
+
+        assert not await cache._renew_lease(token)  # The transaction failed with WatchError
+        del redis.pipeline
+        assert await redis.get(cache._lease_key) == b"other"
+        assert await redis.ttl(cache._lease_key) == 1
+    run(test)
+
+
+def test_release_leaves_another_holders_lease():
+    async def test(cache_id):
+        cache = EmptyCache(cache_id)
+        token = await cache._acquire_lease()
+        await cache._redis.set(cache._lease_key, b"other")  # Expired, and taken by another process
+
+        await cache._release_lease(token)
+        assert await cache._redis.get(cache._lease_key) == b"other"
+    run(test)
+
+
+def test_take_pops_on_the_server_then_serves_the_last_value_again():
+    async def test(cache_id):
+        redis = redisconnection.get_client(decode_responses=False)
+        await redis.rpush(StringCache.DB_KEY_PREFIX + cache_id, b"a", b"b")
+        first, second = EmptyCache(cache_id), EmptyCache(cache_id)
+
+        assert await first.take() == "a"
+        assert await second.take() == "b"
+        assert len(second) == 0
+        assert await redis.llen(StringCache.DB_KEY_PREFIX + cache_id) == 0
+        assert not first.is_stale()
+
+        assert await first.take() == "b"  # Out of values, so the last one served anywhere is served again
+        assert first.is_stale()
+        assert first.stale_serves == 1
+    run(test)
+
+
+def test_take_from_an_empty_cache_returns_none():
+    async def test(cache_id):
+        cache = EmptyCache(cache_id)
+        assert await cache.take() is None
+        assert not cache.is_stale()
+    run(test)
@@ -1,17 +1,29 @@
 import aiohttp
+import asyncio
+import codecs
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 import feedparser
 from datetime import datetime
+from functools import partial
 import random
 import re
 import traceback
 from typing import Optional, Union
+from urllib.parse import urlsplit
 
 from discord import Client, Embed, Member, Message, User
 from discord.abc import GuildChannel, PrivateChannel
 from discord.ext.commands import Context
+from discord.http import Route
 
 from config.local_config import *
 from constants import EMBED_COLORS
+import circuitbreaker
+from circuitbreaker import TRANSIENT_STATUSES, CircuitOpen, ServerError
+from httpcache import HTTP_CACHE
+from messagecache import MESSAGE_CACHE
+from ratelimit import OUTBOUND, RateLimited, request_key
 
 
 # ------------------------------------------------------------------------ Discord Specific Functions
@@ -28,15 +40,21 @@ def _get_bot() -> Client:
 
 async def get_message(channel_id: int, message_id: int) -> Optional[Message]:
     """
-    Fetches a specific message object from Discord using a channel and message ID
+    Fetches a specific message object from Discord using a channel and message ID.
+    Messages the bot recently received or fetched are served from the message cache
     :param channel_id: The ID of the channel containing the message
     :param message_id: The ID of the message being fetched
     :return: If found, the Message object with that ID. `None` otherwise
     """
+    message = MESSAGE_CACHE.get(message_id)
+    if message is not None and message.channel.id == channel_id:
+        return message
     message_channel = _get_bot().get_channel(channel_id)
     if message_channel is None:
         return None
-    return await message_channel.fetch_message(message_id)
+    message = await message_channel.fetch_message(message_id)
+    MESSAGE_CACHE.put(message)
+    return message
 
 
 async def get_channel(channel_id: int) -> Optional[Union[GuildChannel, PrivateChannel]]:
@@ -49,6 +67,25 @@ async def get_channel(channel_id: int) -> Optional[Union[GuildChannel, PrivateCh
     return _get_bot().get_channel(channel_id)
 
 
+async def reply_with_embeds(message: Message, embeds: [Embed]) -> Message:
+    """
+    Replies to a message with several embeds in a single message. discord.py only supports sending
+    one embed per message, so this posts the message through the bot's HTTP client directly
+
+    :param message: The message to reply to
+    :param embeds: The embeds to send. Discord allows up to 10 per message
+    :return: The Message object of the reply
+    """
+    state = message._state
+    payload = {"embeds": [embed.to_dict() for embed in embeds],
+               "message_reference": message.to_message_reference_dict()}
+    if state.allowed_mentions is not None:
+        payload["allowed_mentions"] = state.allowed_mentions.to_dict()
+    route = Route("POST", "/channels/{channel_id}/messages", channel_id=message.channel.id)
+    data = await state.http.request(route, json=payload)
+    return state.create_message(channel=message.channel, data=data)
+
+
 def get_screen_name(user: Union[User, Member]) -> str:
     """
     Gets the screen name of either a User or Member object
@@ -237,9 +274,100 @@ def embed_from_dict(dictionary, title=None, description=None, thumbnail_url=None
     return embed
 
 
-async def get_json_with_get(url, params=None, headers=None, content_type=None):
+_http_session: Optional[aiohttp.ClientSession] = None  # Shared by every web request. See `open_http_session()`
+_host_semaphores = {}  # Maps host -> Semaphore, for hosts with a "max_connections" setting
+
+
+async def open_http_session() -> aiohttp.ClientSession:
+    """
+    Opens the HTTP client shared by every web request the bot makes, if it isn't already open.
+    Its connections are kept alive and reused, and DNS lookups are cached, so repeat requests
+    to the same host skip the TCP and TLS handshakes
+
+    :return: The shared ClientSession
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(limit=HTTP_MAX_CONNECTIONS,
+                                         limit_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                                         keepalive_timeout=HTTP_KEEPALIVE_SECONDS,
+                                         ttl_dns_cache=HTTP_DNS_CACHE_SECONDS)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS)
+        _http_session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS)
+    return _http_session
+
+
+async def close_http_session() -> None:
+    """ Closes the shared HTTP client and all of its connections """
+    global _http_session
+    if _http_session is not None:
+        await _http_session.close()
+        _http_session = None
+
+
+@asynccontextmanager
+async def http_request(method: str, url: str, **kwargs):
+    """
+    Makes a request with the shared HTTP client, applying any `HTTP_HOST_SETTINGS` for the host.
+    Used as `async with utils.http_request("GET", url) as resp:`
+
+    :param method: The HTTP method
+    :param url: The URL to request
+    :param kwargs: Any other arguments for `ClientSession.request()`
+    """
+    session = await open_http_session()
+    host = urlsplit(url).hostname
+    settings = HTTP_HOST_SETTINGS.get(host, {})
+    if "timeout" in settings:
+        kwargs.setdefault("timeout", aiohttp.ClientTimeout(total=settings["timeout"],
+                                                           connect=HTTP_CONNECT_TIMEOUT_SECONDS))
+    if "max_connections" not in settings:
+        async with session.request(method, url, **kwargs) as resp:
+            yield resp
+        return
+
+    semaphore = _host_semaphores.get(host)
+    if semaphore is None:
+        semaphore = _host_semaphores[host] = asyncio.Semaphore(settings["max_connections"])
+    async with semaphore:
+        async with session.request(method, url, **kwargs) as resp:
+            yield resp
+
+
+async def call_host(url, send, unavailable, retries=0, key=None):
+    """
+    Sends a request through the host's circuit breaker, retrying transient failures. Every attempt,
+    including each retry, waits its turn in the host's rate limit
+
+    :param url: The URL being requested
+    :param send: A coroutine function which makes the request. It should raise `ServerError` for `TRANSIENT_STATUSES`
+    :param unavailable: What to return without sending the request if the host's circuit breaker is open
+    :param retries: (Optional) How many times to retry a failed request. Only for requests without side effects
+    :param key: (Optional) A key from `request_key()`, to merge the request with identical ones in flight.
+        Only for requests without side effects whose result is the same for every caller
+    :return: Whatever `send` returns
+    """
+    async def paced():
+        return await OUTBOUND.request(url, send)
+
+    async def send_with_retries():
+        try:
+            return await circuitbreaker.call(url, paced, retries)
+        except CircuitOpen:
+            return unavailable
+
+    return await OUTBOUND.coalesce(key, send_with_retries)
+
+
+async def get_json_with_get(url, params=None, headers=None, content_type=None, ttl=None, use_cache=True,
+                            coalesce=True):
     """
-    Requests JSON data using a GET request
+    Requests JSON data using a GET request. The request is paced by the outbound rate limiter,
+    retried if it fails with a connection error, timeout, or server error, and refused while the
+    host's circuit breaker is open. Identical requests which overlap are only sent once. Responses are cached for as long as
+    their headers allow and revalidated with conditional requests, so the returned JSON is shared
+    and must not be modified. For endpoints which answer differently every time, such as ones
+    returning something random, pass `use_cache=False, coalesce=False`
 
     Parameters
     -------------
@@ -253,6 +381,12 @@ async def get_json_with_get(url, params=None, headers=None, content_type=None):
         If not provided, the default headers are used
     content_type : Optional - String
         Content type of the returned json
+    ttl : Optional - float
+        How many seconds to cache the response for, instead of what its headers say
+    use_cache : Optional - bool
+        Whether to use the HTTP cache. Defaults to True
+    coalesce : Optional - bool
+        Whether to share the response of an identical request already in flight. Defaults to True
 
     Returns
     -------------
@@ -274,16 +408,33 @@ async def get_json_with_get(url, params=None, headers=None, content_type=None):
     if headers is None:
         headers = HEADERS
     else:
-        merged_headers = HEADERS
-        merged_headers.update(headers)
-        headers = merged_headers
-
-    async with aiohttp.ClientSession(headers=headers) as session:
-        async with session.get(url, params=params) as resp:
-            if resp.status is 200:
+        headers = {**HEADERS, **headers}
+
+    key = request_key("GET", url, params, headers, content_type)
+    use_cache = use_cache and HTTP_CACHE_ENABLED
+    entry = await HTTP_CACHE.get(key) if use_cache else None
+    if entry is not None and entry.is_fresh():
+        return [entry.value, 200]
+
+    async def send():
+        # Ask the server to answer with 304 Not Modified if the cached response is still current
+        request_headers = headers if entry is None else {**headers, **entry.validators()}
+        async with http_request("GET", url, params=params, headers=request_headers) as resp:
+            if resp.status == 429:
+                raise RateLimited(resp.headers.get("Retry-After"), (None, 429))
+            if resp.status == 304 and entry is not None:
+                await HTTP_CACHE.refresh(key, entry, resp.headers, ttl)
+                return entry.value, 200
+            if resp.status == 200:
                 json = await resp.json(content_type=content_type)
-                return [json, 200]
-            return [None, resp.status]
+                if use_cache:
+                    await HTTP_CACHE.put(key, resp.headers, await resp.read(), json, ttl)
+                return json, 200
+            if resp.status in TRANSIENT_STATUSES:
+                raise ServerError(resp.status, (None, resp.status))
+            return None, resp.status
+
+    return list(await call_host(url, send, (None, 503), retries=HTTP_GET_RETRIES, key=key if coalesce else None))
 
 
 async def get_json_with_post(url, params=None, headers=None, json=None):
@@ -323,44 +474,157 @@ async def get_json_with_post(url, params=None, headers=None, json=None):
     if headers is None:
         headers = HEADERS
     else:
-        merged_headers = HEADERS
-        merged_headers.update(headers)
-        headers = merged_headers
+        headers = {**HEADERS, **headers}
 
     # Create json dictionary if none passed
     if json is None:
         json = {}
 
-    async with aiohttp.ClientSession(headers=headers) as session:
-        async with session.post(url, params=params, json=json) as resp:
-            json = await resp.json()
-            return [json, resp.status]
+    async def send():
+        async with http_request("POST", url, params=params, json=json, headers=headers) as resp:
+            if resp.status == 429:
+                raise RateLimited(resp.headers.get("Retry-After"), [None, 429])
+            if resp.status in TRANSIENT_STATUSES:
+                raise ServerError(resp.status, [None, resp.status])
+            return [await resp.json(), resp.status]
+
+    # POSTs aren't merged or retried, since they may have side effects
+    return await call_host(url, send, [None, 503])
 
 
-async def get_website_text(url, params=None, json=None):
+async def read_text(resp, max_bytes):
+    """
+    Reads and decodes a response body as it streams in, stopping once `max_bytes` have been read.
+    The rest of the body is never downloaded
+
+    :param resp: The aiohttp response
+    :param max_bytes: The most bytes of the body to read
+    :return: A tuple of the decoded text, and whether the body was cut short
+    """
+    try:
+        decoder = codecs.getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    parts = []
+    size = 0
+    truncated = False
+    async for chunk in resp.content.iter_chunked(WEB_TEXT_CHUNK_BYTES):
+        if size + len(chunk) > max_bytes:
+            chunk = chunk[:max_bytes - size]
+            truncated = True
+        size += len(chunk)
+        parts.append(decoder.decode(chunk))
+        if truncated:
+            resp.close()  # Drop the connection rather than reading the rest of the body
+            break
+    # A cut short body may end partway through a character, which is dropped rather than replaced
+    parts.append(decoder.decode(b"", final=not truncated))
+    return "".join(parts), truncated
+
+
+async def fetch_text(url, method="GET", params=None, headers=None, json=None, max_bytes=WEB_TEXT_MAX_BYTES):
+    """
+    Fetches a web page as text, reading no more than `max_bytes` of it. Use this for anything
+    which only shows part of the response, so large pages aren't downloaded and decoded in full.
+    GETs are retried like in `get_json_with_get`, but aren't cached or merged
+
+    Parameters
+    -------------
+    url : str
+        The url to request from
+    method : Optional - str
+        The HTTP method. Defaults to GET
+    params : Optional - dict{str:str}
+        Parameters passed in the request
+    headers : Optional - dict{str:str}
+        Headers passed in the request, added to the default headers
+    json : Optional - dict
+        A JSON payload to include
+    max_bytes : Optional - int
+        The most bytes of the response body to read. Defaults to `WEB_TEXT_MAX_BYTES`
+
+    Returns
+    -------------
+    A tuple
+    [0] - The text of the response, or None if it couldn't be read
+    [1] - resp.status
+    [2] - Whether the text was cut short at `max_bytes`
+    """
+    headers = HEADERS if headers is None else {**HEADERS, **headers}
+
+    async def send():
+        async with http_request(method, url, params=params, headers=headers, json=json) as resp:
+            if resp.status == 429:
+                raise RateLimited(resp.headers.get("Retry-After"), (None, 429, False))
+            if resp.status in TRANSIENT_STATUSES:
+                raise ServerError(resp.status, (None, resp.status, False))
+            text, truncated = await read_text(resp, max_bytes)
+            return text, resp.status, truncated
+
+    return await call_host(url, send, (None, 503, False), retries=HTTP_GET_RETRIES if method == "GET" else 0)
+
+
+async def get_website_text(url, params=None, json=None, max_bytes=WEB_TEXT_MAX_BYTES):
     """
     Gets the contents of a web page and returns it in raw HTML
 
     :param url: The url to query
     :param params: a dictionary of url parameters
     :param json: A JSON payload to include
+    :param max_bytes: The most bytes of the page to read. Longer pages are cut short
     :return: The raw HTML of the web page
     """
-    async with aiohttp.ClientSession(headers=HEADERS) as session:
-        async with session.post(url, params=params, json=json) as resp:
-            if resp.status is not 200:
-                return None
-            return await resp.text()
+    text, status, _ = await fetch_text(url, method="POST", params=params, json=json, max_bytes=max_bytes)
+    return text if status == 200 else None
+
 
+_rss_parse_pool = ThreadPoolExecutor(max_workers=RSS_PARSE_WORKERS, thread_name_prefix="rss-parse")
 
-def get_rss_feed(url):
+
+async def get_rss_feed(url, etag=None, modified=None):
     """
-    Returns a feedparser object containing the information about the RSS feed
+    Downloads and parses an RSS feed. Passing the `etag` and `modified` of the last copy of the
+    feed makes the download conditional, and parsing happens on a worker thread so large feeds
+    don't hold up the bot
 
     :param url: (str) the url of the rss feed
-    :return: A feedparser object
-    """
-    return feedparser.parse(url)
+    :param etag: (Optional) The `etag` of the last copy of the feed
+    :param modified: (Optional) The `modified` date of the last copy of the feed
+    :return: A feedparser object, with the `etag` and `modified` to pass next time, or None if the
+        feed hasn't changed since the last copy
+    :raises RuntimeError: If the feed couldn't be downloaded
+    """
+    headers = {**HEADERS, "Accept": "application/rss+xml, application/atom+xml, application/xml;q=0.9, */*;q=0.8"}
+    if etag:
+        headers["If-None-Match"] = etag
+    if modified:
+        headers["If-Modified-Since"] = modified
+
+    async def send():
+        async with http_request("GET", url, headers=headers) as resp:
+            if resp.status == 429:
+                raise RateLimited(resp.headers.get("Retry-After"), (429, None, None))
+            if resp.status in TRANSIENT_STATUSES:
+                raise ServerError(resp.status, (resp.status, None, None))
+            if resp.status != 200:
+                return resp.status, None, None
+            # Lowercased, the way feedparser expects them
+            response_headers = {name.lower(): value for name, value in resp.headers.items()}
+            return 200, await resp.read(), response_headers
+
+    key = request_key("GET", url, None, headers)
+    status, body, response_headers = await call_host(url, send, (503, None, None), retries=HTTP_GET_RETRIES, key=key)
+    if status == 304:
+        return None
+    if status != 200:
+        raise RuntimeError(f"Failed to retrieve the feed at {url}, status code: {status}")
+
+    feed = await asyncio.get_event_loop().run_in_executor(
+        _rss_parse_pool, partial(feedparser.parse, body, response_headers=response_headers))
+    feed["etag"] = response_headers.get("etag")
+    feed["modified"] = response_headers.get("last-modified")
+    return feed
 
 
 # ------------------------------------------------------------------------ Database caching